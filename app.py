@@ -1,7 +1,35 @@
 import streamlit as st
-from openai import OpenAI
+import hashlib
+import math
+import os
+import re
+import uuid
+from datetime import datetime
 import urllib.parse
-from mistralai import Mistral
+import exportacion
+import lotes
+import nucleo
+import observabilidad
+import plantillas
+import postprocesado
+import proveedores_async
+from configuracion import (
+    DIRECTORIO_DATOS, MAX_TOKENS_ENTRADA, CONVERSACION_MAX_TOKENS, PERFILADO, SIMILITUD_UMBRAL, TRABAJOS_INTERVALO_SEGUNDOS,
+    MEMORIA_ADMIN, HISTORIAL_MAX_POR_SESION, HISTORIAL_DIAS_RETENCION, LIMITES_POR_CLAVE
+)
+from historial import obtener_historial, resumir
+from versiones import AlmacenVersiones
+from tokens import contabilidad, estimar_tokens
+from planificador import planificador
+from clientes import descartar_cliente, precargar
+from resiliencia import ErrorGeneracion
+from trabajos import gestor as gestor_trabajos
+from memoria_sesiones import gestor as gestor_memoria
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from nucleo import (
+    PROVEEDORES, MODELOS_TEXTO, MODELOS_CODIGO, mensajes_texto, mensajes_codigo,
+    construir_prompt_contenido, construir_prompt_ideas, construir_prompt_codigo, construir_prompt_mejora
+)
 
 st.set_page_config(
     page_title="ContelIA",
@@ -9,96 +37,453 @@ st.set_page_config(
     layout="wide"
 )
 
-def conectar_api(proveedor):
-    try:
-        if proveedor == "DeepSeek":
-            cliente = OpenAI(
-                api_key=st.session_state.get('deepseek_api_key', ''),
-                base_url="https://api.deepseek.com"
-            )
-        elif proveedor == "Mistral":
-            cliente = Mistral(
-                api_key=st.session_state.get('mistral_api_key', ''),
-                model="mistral-large-latest"
-            )
-        return cliente
-    except Exception as e:
-        st.error(f"Error al conectar con {proveedor}: {str(e)}")
-        return None
+MODOS_PROVEEDOR = ["Un proveedor", "Carrera (primera respuesta)", "Comparar proveedores"]
+FORMATOS_REDES = ["Post para Twitter/X", "Post para Facebook", "Post para Instagram", "Guión para TikTok"]
+ESTRATEGIAS_MULTIFORMATO = {"Una sola respuesta (JSON)": "json", "Llamadas en paralelo": "paralelo"}
 
-def generar_texto(prompt, proveedor, tipo_contenido):
-    cliente = conectar_api(proveedor)
-    if not cliente:
-        return "Error de conexión con la API"
-    
-    system_prompts = {
-        "Post para Twitter/X": "Eres un experto en marketing digital especializado en crear tweets virales. Genera contenido conciso y atractivo en 280 caracteres o menos.",
-        "Post para Facebook": "Eres un experto en marketing de redes sociales especializado en Facebook. Crea contenido atractivo con el tono y formato adecuados para esta plataforma.",
-        "Post para Instagram": "Eres un experto en marketing visual para Instagram. Crea contenido atractivo con hashtags relevantes y llamadas a la acción.",
-        "Guión para TikTok": "Eres un creador de contenido para TikTok. Genera un guión breve y entretenido que capture la atención en los primeros segundos.",
-        "Artículo de blog": "Eres un redactor profesional de blogs. Genera un artículo bien estructurado con introducción, desarrollo y conclusión sobre el tema solicitado.",
-        "Email marketing": "Eres un experto en email marketing. Genera un correo persuasivo con asunto atractivo, introducción, beneficios y llamada a la acción clara."
+def claves_sesion():
+    return {proveedor: st.session_state.get(f"{proveedor.lower()}_api_key", '') for proveedor in PROVEEDORES}
+
+def aviso_cola():
+    aviso = st.empty()
+    
+    def al_esperar(posicion):
+        if posicion:
+            aviso.caption(f"⏳ Tu petición está en cola (posición {posicion})...")
+        else:
+            aviso.empty()
+    return al_esperar
+
+# Adaptadores del núcleo a la sesión de Streamlit: claves, respaldo e identificador de sesión
+
+def opciones_sesion(ignorar_cache=False):
+    return {
+        "claves": claves_sesion(),
+        "ignorar_cache": ignorar_cache,
+        "respaldo": st.session_state.get("respaldo_automatico", False),
+        "sesion": id_sesion()
     }
+
+def generar_resultado(mensaje, funcion, funcion_stream, argumentos, ignorar_cache, destino, tipo, prompt, al_completar=None, procesar=None):
+    # En segundo plano el trabajo sigue aunque haya reruns y el resultado
+    # llega a st.session_state[destino] desde el panel de trabajos; si no,
+    # se genera en esta ejecución como hasta ahora. procesar(texto) se aplica
+    # al texto completo antes de guardarlo
+    opciones = opciones_sesion(ignorar_cache)
     
-    system_content = system_prompts.get(tipo_contenido, "Eres un asistente útil y creativo.")
+    def completar(resultado):
+        # Puede ejecutarse en el hilo del trabajo: no usa st.session_state
+        guardar_en_historial(tipo, prompt, resultado, opciones["sesion"])
+        if al_completar:
+            al_completar(resultado)
     
-    try:
-        respuesta = cliente.chat.completions.create(
-            model="deepseek-chat" if proveedor == "DeepSeek" else "mistral-large" if proveedor == "Mistral" else "claude-3-opus-20240229",
-            messages=[
-                {"role": "system", "content": system_content},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
-        )
-        return respuesta.choices[0].message.content
-    except Exception as e:
-        return f"Error al generar texto: {str(e)}"
+    if st.session_state.get("segundo_plano", False):
+        try:
+            gestor_trabajos.enviar(
+                opciones["sesion"], mensaje.removesuffix("..."),
+                lambda al_esperar: funcion_stream(*argumentos, **opciones, al_esperar=al_esperar),
+                destino, completar, procesar, argumentos
+            )
+        except ErrorGeneracion as e:
+            st.error(str(e))
+        return
+    
+    resultado = ejecutar_generacion(
+        mensaje,
+        lambda: funcion(*argumentos, **opciones, al_esperar=aviso_cola()),
+        lambda: funcion_stream(*argumentos, **opciones, al_esperar=aviso_cola())
+    )
+    if resultado is not None:
+        if procesar:
+            with st.spinner("Revisando el resultado..."):
+                resultado = procesar(resultado)
+        st.session_state[destino] = resultado
+        completar(resultado)
+
+def revision_codigo(proveedor, lenguaje, ignorar_cache, solo_codigo):
+    # Las opciones se leen aquí porque la revisión puede ejecutarse en el hilo de un trabajo
+    opciones = opciones_sesion(ignorar_cache)
+    reparar = st.session_state.get("reparar_codigo", True)
+    return lambda texto: nucleo.revisar_codigo(texto, proveedor, lenguaje, solo_codigo=solo_codigo, reparar=reparar, **opciones)["resultado"]
+
+def solo_codigo_stream(funcion_stream, lenguaje):
+    # Durante el stream se muestran solo las líneas de los bloques de código
+    return lambda *args, **kwargs: postprocesado.extraer_codigo_stream(funcion_stream(*args, **kwargs), lenguaje)
+
+def mostrar_codigo(codigo, lenguaje, es_codigo=False):
+    # Las respuestas con explicaciones se muestran como Markdown y el código
+    # solo, resaltado. La sintaxis se comprueba en los bloques ``` o en todo
+    # el texto si es el resultado de "solo código"
+    con_bloques = bool(postprocesado.extraer_bloques(codigo))
+    if con_bloques:
+        st.markdown(codigo)
+    else:
+        st.code(codigo, language=lenguaje.lower())
+    if postprocesado.validable(lenguaje) and (con_bloques or es_codigo):
+        fallo = postprocesado.validar_respuesta(codigo, lenguaje, es_codigo)
+        if fallo:
+            st.warning(f"El código tiene un error de sintaxis ({fallo[1]})")
+        else:
+            st.caption(f"Sintaxis de {lenguaje} válida")
+
+def proveedores_configurados():
+    return [proveedor for proveedor in PROVEEDORES if st.session_state.get(f"{proveedor.lower()}_api_key")]
 
-def generar_codigo(descripcion, proveedor, lenguaje):
-    cliente = conectar_api(proveedor)
-    if not cliente:
-        return "Error de conexión con la API"
+def generar_multiproveedor(modo, modelos, mensajes, ignorar_cache=False, tipo=""):
+    modo_nucleo = "carrera" if modo == MODOS_PROVEEDOR[1] else "comparar"
+    return nucleo.generar_en_paralelo(modo_nucleo, modelos, mensajes, claves_sesion(), ignorar_cache, id_sesion(), aviso_cola(), tipo)
+
+def ejecutar_multiproveedor(modo, modelos, mensajes, ignorar_cache, clave_estado, tipo, prompt):
+    with st.spinner(f"Generando con {', '.join(proveedores_configurados())}..."):
+        try:
+            resultados = generar_multiproveedor(modo, modelos, mensajes, ignorar_cache, tipo)
+        except ErrorGeneracion as e:
+            st.error(str(e))
+            return
     
-    prompt = f"""Genera código en {lenguaje} para la siguiente tarea: {descripcion} Proporciona código bien comentado y explicado, siguiendo las mejores prácticas de programación."""
+    if modo == MODOS_PROVEEDOR[1]:
+        ganador = resultados[0]
+        st.session_state[clave_estado] = ganador["resultado"]
+        guardar_en_historial(tipo, prompt, ganador["resultado"])
+        st.caption(f"Respuesta más rápida: {ganador['proveedor']} ({ganador['duracion']:.1f} s)")
+    else:
+        st.session_state[f"comparacion_{clave_estado}"] = resultados
+        for resultado in resultados:
+            if resultado["error"] is None:
+                guardar_en_historial(f"{tipo} ({resultado['proveedor']})", prompt, resultado["resultado"])
+
+def ejecutar_multiformato(prompt_base, tipo_respuesta, formatos, proveedor, estrategia, ignorar_cache, clave_estado):
+    # Las variantes llegan juntas al final, así que no se usa streaming ni segundo plano
+    opciones = opciones_sesion(ignorar_cache)
+    with st.spinner(f"Generando {len(formatos)} formatos con {proveedor}..."):
+        try:
+            variantes = nucleo.generar_multiformato(
+                prompt_base, tipo_respuesta, formatos, proveedor,
+                estrategia=ESTRATEGIAS_MULTIFORMATO[estrategia], al_esperar=aviso_cola(), **opciones
+            )
+        except ErrorGeneracion as e:
+            st.error(f"Error al generar: {str(e)}")
+            return
     
-    try:
-        respuesta = cliente.chat.completions.create(
-            model="deepseek-coder" if proveedor == "DeepSeek" else "mistral-large" if proveedor == "Mistral" else "claude-3-opus-20240229",
-            messages=[
-                {"role": "system", "content": f"Eres un experto programador de {lenguaje}. Proporciona soluciones de código eficientes, bien comentadas y siguiendo las mejores prácticas."},
-                {"role": "user", "content": prompt}
-            ],
-            stream=False
-        )
-        return respuesta.choices[0].message.content
-    except Exception as e:
-        return f"Error al generar código: {str(e)}"
+    st.session_state[f"multiformato_{clave_estado}"] = variantes
+    for tipo, variante in variantes.items():
+        if variante["resultado"] is not None:
+            guardar_en_historial(tipo, construir_prompt_contenido(tipo, prompt_base, tipo_respuesta), variante["resultado"], opciones["sesion"])
 
-def guardar_en_historial(tipo, prompt, resultado):
-    if 'historial' not in st.session_state:
-        st.session_state.historial = []
+def mostrar_multiformato(clave_estado):
+    variantes = estado_sesion(f"multiformato_{clave_estado}")
+    if not variantes:
+        return
+    
+    st.subheader("Contenido por Plataforma")
+    for pestana, (tipo, variante) in zip(st.tabs(list(variantes)), variantes.items()):
+        with pestana:
+            if variante["error"]:
+                st.error(variante["error"])
+                continue
+            st.write(variante["resultado"])
+            maximo = plantillas.actuales().max_caracteres(tipo)
+            detalle = f"{len(variante['resultado'])} caracteres" + (f" de {maximo}" if maximo else "")
+            if variante["intentos"] > 1:
+                detalle += f" · {variante['intentos']} intentos"
+            st.caption(detalle)
+            if variante["aviso"]:
+                st.warning(variante["aviso"])
+            if st.button("Usar como versión actual", key=f"usar_multiformato_{clave_estado}_{tipo}"):
+                st.session_state[clave_estado] = variante["resultado"]
+                st.rerun()
+
+def mostrar_comparacion(clave_estado, lenguaje=None):
+    resultados = estado_sesion(f"comparacion_{clave_estado}")
+    if not resultados:
+        return
     
-    st.session_state.historial.append({
-        "tipo": tipo,
-        "prompt": prompt,
-        "resultado": resultado,
-    })
+    st.subheader("Comparación de Proveedores")
+    columnas = st.columns(len(resultados))
+    for columna, resultado in zip(columnas, resultados):
+        with columna:
+            st.markdown(f"**{resultado['proveedor']}** · {resultado['duracion']:.1f} s")
+            if resultado["error"]:
+                st.error(resultado["error"])
+                continue
+            if lenguaje:
+                mostrar_codigo(resultado["resultado"], lenguaje)
+            else:
+                st.write(resultado["resultado"])
+            if st.button("Usar esta versión", key=f"usar_{clave_estado}_{resultado['proveedor']}"):
+                st.session_state[clave_estado] = resultado["resultado"]
+                del st.session_state[f"comparacion_{clave_estado}"]
+                st.rerun()
+
+def ejecutar_generacion(mensaje, funcion, funcion_stream, *args):
+    # Devuelve None si la generación falla, para no guardar el error como contenido
+    if not st.session_state.get("modo_streaming", True):
+        with st.spinner(mensaje):
+            try:
+                return funcion(*args)
+            except ErrorGeneracion as e:
+                st.error(f"Error al generar: {str(e)}")
+                return None
+    
+    # El texto se muestra mientras llega y se retira al terminar, ya que
+    # el resultado final se vuelve a mostrar en la sección correspondiente
+    marcador = st.empty()
+    try:
+        with marcador.container():
+            st.caption(mensaje)
+            resultado = st.write_stream(funcion_stream(*args))
+    except ErrorGeneracion as e:
+        marcador.empty()
+        st.error(f"Error al generar: {str(e)}")
+        return None
+    marcador.empty()
+    
+    if not isinstance(resultado, str):
+        resultado = "".join(str(parte) for parte in resultado)
+    return resultado
+
+COOKIE_SESION = "contelia_sesion"
+SESION_VALIDA = re.compile(r"[0-9a-f]{32}")
+
+def id_sesion():
+    # El identificador se guarda en una cookie del navegador para recuperar el
+    # historial al recargar la página; en la URL daría acceso al historial a
+    # cualquiera que viera el enlace
+    if 'id_sesion' not in st.session_state:
+        guardado = st.context.cookies.get(COOKIE_SESION)
+        if isinstance(guardado, str) and SESION_VALIDA.fullmatch(guardado):
+            st.session_state.id_sesion = guardado
+        else:
+            st.session_state.id_sesion = uuid.uuid4().hex
+            guardar_cookie_sesion(st.session_state.id_sesion)
+        # Los enlaces antiguos con ?sesion= ya no se aceptan
+        if "sesion" in st.query_params:
+            del st.query_params["sesion"]
+    return st.session_state.id_sesion
+
+def guardar_cookie_sesion(sesion):
+    # Streamlit no permite fijar cookies desde el servidor: se escribe desde el navegador
+    url = st.context.url
+    segura = "; Secure" if isinstance(url, str) and url.startswith("https:") else ""
+    duracion = int(HISTORIAL_DIAS_RETENCION * 86400)
+    st.html(
+        f"<script>document.cookie = '{COOKIE_SESION}={sesion}; Max-Age={duracion}; Path=/; SameSite=Strict{segura}';</script>",
+        unsafe_allow_javascript=True
+    )
 
+def id_conexion():
+    # La memoria se reparte por conexión de Streamlit: id_sesion() se conserva
+    # al recargar la página, pero cada recarga tiene su propio st.session_state
+    contexto = get_script_run_ctx()
+    return contexto.session_id if contexto else id_sesion()
+
+def estado_sesion(clave):
+    # Para las entradas grandes de st.session_state (versiones, comparaciones,
+    # conversaciones): si se movieron a disco vuelven a memoria
+    return gestor_memoria.recuperar(id_conexion(), st.session_state, clave)
+
+def guardar_en_historial(tipo, prompt, resultado, sesion=None):
+    with observabilidad.medir("historial", tipo=tipo):
+        obtener_historial().agregar(sesion or id_sesion(), tipo, prompt, resultado)
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def cargar_entrada_historial(sesion, identificador):
+    # Las entradas no cambian una vez guardadas, así que se pueden cachear
+    return obtener_historial().obtener(sesion, identificador)
+
+def eliminar_de_historial(sesion, identificador):
+    obtener_historial().eliminar(sesion, identificador)
+    st.session_state.pop(f"ver_{identificador}", None)
+
+@st.fragment
 def mostrar_historial():
-    if 'historial' not in st.session_state or not st.session_state.historial:
+    # Al ser un fragmento, paginar, filtrar o eliminar solo vuelve a dibujar esta lista
+    historial = obtener_historial()
+    sesion = id_sesion()
+    
+    col1, col2, col3 = st.columns([3, 2, 1])
+    with col1:
+        busqueda = st.text_input("Buscar en prompts y resultados:", key="busqueda_historial")
+    with col2:
+        tipo = st.selectbox("Tipo:", ["Todos"] + historial.tipos(sesion), key="tipo_historial")
+    with col3:
+        tamano = st.selectbox("Por página:", [10, 25, 50], key="tamano_historial")
+    tipo = None if tipo == "Todos" else tipo
+    exportar_importar_historial(historial, sesion, tipo, busqueda)
+    
+    total = historial.contar(sesion, tipo, busqueda)
+    if not total:
         st.info("No hay historial disponible")
         return
     
-    for i, item in enumerate(st.session_state.historial):
-        with st.expander(f"{item['tipo']}"):
-            st.write("**Prompt:**")
-            st.write(item['prompt'])
-            st.write("**Resultado:**")
-            st.write(item['resultado'])
-            if st.button(f"Eliminar", key=f"del_{i}"):
-                st.session_state.historial.pop(i)
-                st.rerun()
+    paginas = math.ceil(total / tamano)
+    if st.session_state.get("pagina_historial", 1) > paginas:
+        st.session_state.pagina_historial = paginas
+    pagina = st.number_input(f"Página (de {paginas}):", min_value=1, max_value=paginas, value=1, key="pagina_historial")
+    st.caption(f"{total} entradas, de la más reciente a la más antigua")
+    
+    # Cada fila muestra solo el resumen guardado; el texto completo se carga al abrirla
+    for entrada in historial.listar(sesion, pagina - 1, tamano, tipo, busqueda):
+        with st.container(border=True):
+            col1, col2, col3 = st.columns([6, 1, 1])
+            with col1:
+                st.markdown(f"**{entrada['tipo']}** · {datetime.fromtimestamp(entrada['creado']).strftime('%d/%m/%Y %H:%M')}")
+                st.caption(entrada['resumen'])
+            with col2:
+                ver = st.toggle("Ver", key=f"ver_{entrada['id']}")
+            with col3:
+                st.button("Eliminar", key=f"del_{entrada['id']}", on_click=eliminar_de_historial, args=(sesion, entrada['id']))
+            
+            if ver:
+                item = cargar_entrada_historial(sesion, entrada['id'])
+                if item is not None:
+                    st.write("**Prompt:**")
+                    st.write(item['prompt'])
+                    st.write("**Resultado:**")
+                    st.write(item['resultado'])
+
+def mostrar_consumo():
+    with st.expander("Consumo de tokens"):
+        resumen = contabilidad.resumen_sesion(id_sesion())
+        if not resumen:
+            st.caption("Aún no hay llamadas en esta sesión")
+            return
+        
+        for proveedor, agregado in resumen.items():
+            st.markdown(f"**{proveedor}** · {agregado['llamadas']} llamadas")
+            st.caption(f"Entrada: {agregado['entrada']} tokens ({agregado['entrada_cache']} desde caché del proveedor) · Salida: {agregado['salida']} tokens · Coste estimado: ${agregado['coste']:.4f}")
+        
+        total = sum(agregado["coste"] for agregado in resumen.values())
+        st.metric("Coste de la sesión (USD)", f"${total:.4f}")
+        
+        st.download_button(
+            "Exportar consumo (CSV)",
+            contabilidad.exportar_csv(id_sesion()),
+            file_name="consumo_tokens.csv",
+            mime="text/csv",
+            key="exportar_consumo"
+        )
+
+def mostrar_cola():
+    with st.expander("Cola de peticiones"):
+        metricas = planificador.metricas()
+        if not metricas:
+            st.caption("Sin peticiones registradas en este proceso")
+            return
+        
+        for proveedor, datos in metricas.items():
+            st.markdown(f"**{proveedor}** · {datos['en_cola']} en cola")
+            st.caption(
+                f"Atendidas: {datos['concedidos']} · Rechazadas: {datos['rechazados']} · "
+                f"Espera media: {datos['espera_media']:.2f} s · p95: {datos['espera_p95']:.2f} s · máx.: {datos['espera_maxima']:.2f} s"
+            )
+
+ESTADOS_TRABAJO = {
+    "en_cola": "⏳ En cola",
+    "ejecutando": "✍️ Generando",
+    "completado": "✅ Completado",
+    "error": "❌ Error",
+    "cancelado": "⏹️ Cancelado"
+}
+
+def cancelar_trabajo(identificador):
+    gestor_trabajos.cancelar(id_sesion(), identificador)
+
+def descartar_trabajo(identificador):
+    gestor_trabajos.descartar(id_sesion(), identificador)
+
+def panel_trabajos(refrescando):
+    trabajos_sesion = gestor_trabajos.listar(id_sesion())
+    
+    # Los resultados se entregan de uno en uno para que cada uno pase por el
+    # historial de versiones; el rerun completo los muestra en su sección
+    pendiente = next((trabajo for trabajo in trabajos_sesion if trabajo.estado == "completado" and not trabajo.entregado), None)
+    if pendiente is not None:
+        pendiente.entregado = True
+        st.session_state[pendiente.destino] = pendiente.resultado
+        st.rerun()
+    if refrescando and all(trabajo.terminado for trabajo in trabajos_sesion):
+        # Sin trabajos en curso el panel deja de refrescarse
+        st.rerun()
+    if not trabajos_sesion:
+        return
+    
+    en_curso = sum(not trabajo.terminado for trabajo in trabajos_sesion)
+    with st.expander(f"Generaciones en segundo plano ({en_curso} en curso)", expanded=bool(en_curso)):
+        for trabajo in reversed(trabajos_sesion):
+            with st.container(border=True):
+                col1, col2 = st.columns([5, 1])
+                with col1:
+                    st.markdown(f"**{trabajo.descripcion}** · {ESTADOS_TRABAJO[trabajo.estado]} · {trabajo.duracion():.0f} s")
+                    if trabajo.estado == "error":
+                        st.error(trabajo.error)
+                    elif trabajo.posicion:
+                        st.caption(f"En la cola del proveedor (posición {trabajo.posicion})")
+                    elif trabajo.estado == "ejecutando" and trabajo.partes:
+                        st.caption("…" + trabajo.texto()[-200:])
+                with col2:
+                    if trabajo.terminado:
+                        st.button("Quitar", key=f"quitar_{trabajo.id}", on_click=descartar_trabajo, args=(trabajo.id,))
+                    else:
+                        st.button("Cancelar", key=f"cancelar_{trabajo.id}", on_click=cancelar_trabajo, args=(trabajo.id,))
+
+@st.fragment(run_every=TRABAJOS_INTERVALO_SEGUNDOS)
+def panel_trabajos_en_curso():
+    panel_trabajos(True)
+
+@st.fragment
+def panel_trabajos_terminados():
+    panel_trabajos(False)
+
+def mostrar_trabajos():
+    # El panel solo se refresca periódicamente mientras hay trabajos en curso
+    trabajos_sesion = gestor_trabajos.listar(id_sesion())
+    if any(not trabajo.terminado for trabajo in trabajos_sesion):
+        panel_trabajos_en_curso()
+    elif trabajos_sesion:
+        panel_trabajos_terminados()
+
+def armar_perfil():
+    # La ejecución que provoca el propio botón no se perfila, sino la siguiente
+    st.session_state.perfil_estado = "armado"
+
+def mostrar_perfilado():
+    with st.expander("Perfilado"):
+        st.button("Perfilar la siguiente ejecución", on_click=armar_perfil, key="perfilar")
+        if st.session_state.get("perfil_estado"):
+            st.caption("La próxima interacción se ejecutará con cProfile activo")
+        
+        perfil = estado_sesion("ultimo_perfil")
+        if perfil and perfil.get("error"):
+            st.warning(f"No se pudo perfilar: {perfil['error']}")
+        elif perfil:
+            st.caption(f"Último perfil: {perfil['ruta']}")
+            st.code(perfil["resumen"], language=None)
+
+def formato_bytes(cantidad):
+    for unidad in ("B", "KB", "MB"):
+        if cantidad < 1024:
+            return f"{cantidad:.0f} {unidad}"
+        cantidad /= 1024
+    return f"{cantidad:.1f} GB"
+
+def mostrar_memoria():
+    with st.expander("Memoria por sesión"):
+        sesiones = gestor_memoria.resumen()
+        st.caption(
+            f"{len(sesiones)} sesiones · {formato_bytes(sum(sesion['memoria'] for sesion in sesiones))} en memoria · "
+            f"{formato_bytes(sum(sesion['disco'] for sesion in sesiones))} en disco"
+        )
+        # Tabla en Markdown: st.dataframe cargaría pandas solo para esta vista
+        filas = ["| Sesión | Memoria | Disco | Inactiva | Entradas mayores |", "|---|---|---|---|---|"]
+        for sesion in sesiones:
+            mayores = ", ".join(f"{clave} ({formato_bytes(cantidad)})" for clave, cantidad in sesion["mayores"])
+            propia = " (esta)" if sesion["sesion"] == id_conexion() else ""
+            filas.append(
+                f"| {sesion['sesion'][:8]}{propia} | {formato_bytes(sesion['memoria'])} | {formato_bytes(sesion['disco'])} "
+                f"| {sesion['inactiva']:.0f} s | {mayores} |"
+            )
+        st.markdown("\n".join(filas))
 
 def main():
     with st.sidebar:
@@ -115,10 +500,45 @@ def main():
         mistral_key = st.text_input("Mistral API Key", value=st.session_state.mistral_api_key, type="password")
         
         if st.button("Guardar Claves"):
+            # Los clientes creados con una clave reemplazada salen del registro;
+            # no se cierran, por si alguna generación en curso aún los usa
+            if deepseek_key != st.session_state.deepseek_api_key:
+                descartar_cliente("DeepSeek", st.session_state.deepseek_api_key)
+                proveedores_async.descartar_cliente_async("DeepSeek", st.session_state.deepseek_api_key)
+            if mistral_key != st.session_state.mistral_api_key:
+                descartar_cliente("Mistral", st.session_state.mistral_api_key)
+                proveedores_async.descartar_cliente_async("Mistral", st.session_state.mistral_api_key)
             st.session_state.deepseek_api_key = deepseek_key
             st.session_state.mistral_api_key = mistral_key
             st.success("Claves guardadas con éxito")
         
+        st.subheader("Preferencias")
+        st.checkbox(
+            "Mostrar respuesta en tiempo real",
+            value=True,
+            key="modo_streaming",
+            help="Muestra el texto a medida que lo genera el proveedor y permite detener la generación con el botón Stop. No se aplica a la generación en segundo plano."
+        )
+        st.checkbox(
+            "Generar en segundo plano",
+            value=False,
+            key="segundo_plano",
+            help="La generación continúa aunque cambies de pestaña u opciones y puedes lanzar varias a la vez. Mientras tanto solo se muestra el final del texto, actualizado cada segundo, y se cancela desde el panel de trabajos; el resultado completo aparece al terminar."
+        )
+        st.checkbox(
+            "Cambiar de proveedor automáticamente si falla",
+            value=False,
+            key="respaldo_automatico",
+            help="Si el proveedor elegido no responde tras los reintentos, se usa el otro proveedor configurado."
+        )
+        
+        mostrar_consumo()
+        mostrar_cola()
+        if PERFILADO:
+            mostrar_perfilado()
+        if MEMORIA_ADMIN:
+            mostrar_memoria()
+        
         st.subheader("Navegación")
         pagina = st.radio("Ir a:", ["Generador de Contenido", "Generador de Código", "Historial"])
         
@@ -126,6 +546,8 @@ def main():
         st.info("ContelIA es un asistente para generar diferentes tipos de contenido utilizando LLMs mediante sus APIs.")
     
     st.title("ContelIA 🧠")
+    # El panel se dibuja al final para incluir los trabajos enviados en esta ejecución
+    contenedor_trabajos = st.container()
     
     if pagina == "Generador de Contenido":
         generar_contenido_ui()
@@ -134,110 +556,133 @@ def main():
     else:
         st.header("Historial de Generaciones")
         mostrar_historial()
+    
+    with contenedor_trabajos:
+        mostrar_trabajos()
 
 def generar_contenido_ui():
     st.header("Generador de Contenido")
+    actuales = plantillas.actuales()
     
-    tab1, tab2 = st.tabs(["Generación Directa", "Generación de Ideas"])
+    tab1, tab2, tab3 = st.tabs(["Generación Directa", "Generación de Ideas", "Generación por Lotes"])
     
     with tab1:
         st.subheader("Generación Directa de Contenido")
         
+        multiformato = st.checkbox(
+            "Todas las plataformas",
+            value=False,
+            key="multiformato_forma1",
+            help="Genera el mismo brief para varios tipos de contenido a la vez, con un proveedor."
+        )
+        
+        modo = st.radio(
+            "Modo de generación:",
+            MODOS_PROVEEDOR,
+            horizontal=True,
+            key="modo_forma1",
+            disabled=multiformato,
+            help="Carrera envía el prompt a todos los proveedores configurados y se queda con la primera respuesta; Comparar muestra todas las respuestas lado a lado."
+        )
+        
         col1, col2 = st.columns(2)
         
         with col1:
             proveedor = st.selectbox(
                 "Selecciona el proveedor de IA:",
-                ["DeepSeek", "Mistral"],
-                key="proveedor_forma1"
+                PROVEEDORES,
+                key="proveedor_forma1",
+                disabled=modo != MODOS_PROVEEDOR[0] and not multiformato
             )
         
         with col2:
+            # El tipo de contenido se sigue mostrando (desactivado) con todas
+            # las plataformas: un widget que deja de dibujarse pierde su
+            # valor y la selección no volvería al desmarcar la casilla
             tipo_contenido = st.selectbox(
                 "Tipo de contenido:",
-                [
-                    "Selecciona el tipo de contenido que deseas crear",
-                    "Post para Twitter/X", 
-                    "Post para Facebook", 
-                    "Post para Instagram",
-                    "Guión para TikTok",
-                    "Guión para Reels",
-                    "Artículo de blog", 
-                    "Email marketing",
-                    "Infografía",
-                    "Newsletter",
-                    "Podcast script"
-                ],
-                key="tipo_contenido_forma1"
+                ["Selecciona el tipo de contenido que deseas crear"] + actuales.tipos_contenido,
+                key="tipo_contenido_forma1",
+                disabled=multiformato
+            )
+            if multiformato:
+                formatos = st.multiselect(
+                    "Formatos:",
+                    actuales.tipos_contenido,
+                    default=[tipo for tipo in FORMATOS_REDES if tipo in actuales.tipos_contenido],
+                    key="formatos_forma1"
+                )
+                tipo_contenido = formatos[0] if formatos else ""
+        
+        if multiformato:
+            estrategia = st.radio(
+                "Estrategia:",
+                list(ESTRATEGIAS_MULTIFORMATO),
+                horizontal=True,
+                key="estrategia_forma1",
+                help="Una sola respuesta pide todos los formatos en una única llamada; en paralelo se hace una llamada por formato a la vez. Las variantes que superan su límite de caracteres se vuelven a pedir por separado."
             )
         
         tipo_respuesta = st.selectbox(
             "¿Qué tipo de respuesta necesitas?",
-            [
-                "Selecciona el tipo de respuesta que deseas",
-                "Ejemplo concreto",
-                "Recomendaciones",
-                "Ideas creativas",
-                "Estructura para video/post",
-                "Análisis de tendencias",
-                "Fórmulas probadas",
-                "Call to Action (CTA)"
-            ],
+            ["Selecciona el tipo de respuesta que deseas"] + actuales.tipos_respuesta,
             key="tipo_respuesta"
         )
         
         st.subheader("Tu Prompt")
-        prompt_ayuda = {
-            "Post para Twitter/X": "Describe el tema y tono del tweet. Ej: 'Un tweet promocionando un nuevo curso de programación con tono entusiasta'",
-            "Post para Facebook": "Describe el contenido y objetivo. Ej: 'Post anunciando una oferta especial de fin de semana para nuestra tienda de ropa'",
-            "Post para Instagram": "Describe la imagen y el mensaje. Ej: 'Post sobre consejos de fitness con una imagen motivadora'",
-            "Guión para TikTok": "Describe el tema y estilo. Ej: 'Un TikTok educativo de 30 segundos explicando cómo funciona la inteligencia artificial'",
-            "Guión para Reels": "Describe el tema y enfoque. Ej: 'Un Reel mostrando 3 tips de productividad con un tono energético'",
-            "Artículo de blog": "Describe el tema y enfoque. Ej: 'Artículo sobre los beneficios del yoga para la salud mental, enfocado a principiantes'",
-            "Email marketing": "Describe la campaña y objetivo. Ej: 'Email promocionando un webinar gratuito sobre marketing digital'",
-            "Infografía": "Describe el tema y datos clave a incluir. Ej: 'Infografía sobre estadísticas de uso de redes sociales en 2025'",
-            "Newsletter": "Describe el tema y secciones. Ej: 'Newsletter mensual para una tienda de productos ecológicos'",
-            "Podcast script": "Describe el tema y formato. Ej: 'Guión para un episodio de podcast sobre finanzas personales para millennials'"
-        }
-        
         prompt_base = st.text_area(
             "Ingresa tu prompt base:", 
             height=100, 
-            help=prompt_ayuda.get(tipo_contenido, ""),
+            help=actuales.ayuda(tipo_contenido),
             key="prompt_forma1"
         )
         
         if prompt_base:
-            prompt_completo = f"""
-            Crea {tipo_contenido} sobre: {prompt_base}
-            Tipo de respuesta requerida: {tipo_respuesta}
-            El contenido debe ser original, atractivo y optimizado para la plataforma indicada.
-            """
+            prompt_completo = construir_prompt_contenido(tipo_contenido, prompt_base, tipo_respuesta)
         else:
             prompt_completo = ""
             
+        ignorar_cache = st.checkbox("Ignorar caché (forzar una nueva generación)", value=False, key="ignorar_cache_forma1")
+        
         col1, col2 = st.columns([1, 4])
         with col1:
             if st.button("Generar Contenido", use_container_width=True, key="generar_forma1"):
-                if tipo_contenido == "Selecciona el tipo de contenido que deseas crear":
+                if multiformato and not formatos:
+                    st.error("Por favor, selecciona al menos un formato")
+                elif tipo_contenido == "Selecciona el tipo de contenido que deseas crear":
                     st.error("Por favor, selecciona un tipo de contenido")
                 elif tipo_respuesta == "Selecciona el tipo de respuesta que deseas":
                     st.error("Por favor, selecciona un tipo de respuesta")
                 elif not prompt_base:
                     st.error("Por favor, ingresa un prompt")
+                elif multiformato:
+                    if not st.session_state.get(f"{proveedor.lower()}_api_key"):
+                        st.error(f"Por favor, configura tu API key de {proveedor} en la barra lateral")
+                    else:
+                        ejecutar_multiformato(prompt_base, tipo_respuesta, formatos, proveedor, estrategia, ignorar_cache, "ultimo_resultado")
+                elif modo != MODOS_PROVEEDOR[0]:
+                    if not proveedores_configurados():
+                        st.error("Por favor, configura al menos una API key en la barra lateral")
+                    else:
+                        ejecutar_multiproveedor(
+                            modo, MODELOS_TEXTO, mensajes_texto(prompt_completo, tipo_contenido), ignorar_cache,
+                            "ultimo_resultado", tipo_contenido, prompt_completo
+                        )
                 elif not st.session_state.get(f"{proveedor.lower()}_api_key"):
                     st.error(f"Por favor, configura tu API key de {proveedor} en la barra lateral")
                 else:
-                    with st.spinner(f"Generando contenido con {proveedor}..."):
-                        resultado = generar_texto(prompt_completo, proveedor, tipo_contenido)
-                        st.session_state.ultimo_resultado = resultado
-                        guardar_en_historial(tipo_contenido, prompt_completo, resultado)
+                    generar_resultado(
+                        f"Generando contenido con {proveedor}...",
+                        nucleo.generar_texto, nucleo.generar_texto_stream,
+                        (prompt_completo, proveedor, tipo_contenido), ignorar_cache,
+                        "ultimo_resultado", tipo_contenido, prompt_completo
+                    )
                         
     with tab2:
         st.subheader("Generación de Ideas")
         proveedor_ideas = st.selectbox(
             "Selecciona el proveedor de IA:",
-            ["DeepSeek", "Mistral"],
+            PROVEEDORES,
             key="proveedor_forma2"
         )
         
@@ -259,19 +704,29 @@ def generar_contenido_ui():
         with col2:
             objetivo = st.selectbox(
                 "¿Cuál es tu objetivo principal?",
-                [
-                    "Selecciona el objetivo que esperas",
-                    "Aumentar engagement", 
-                    "Educar a la audiencia", 
-                    "Vender un producto/servicio",
-                    "Generar leads",
-                    "Crear autoridad",
-                    "Entretener"
-                ],
+                ["Selecciona el objetivo que esperas"] + actuales.objetivos,
                 key="objetivo"
             )
         
+        ignorar_cache_ideas = st.checkbox("Ignorar caché (forzar una nueva generación)", value=False, key="ignorar_cache_forma2")
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            reutilizar_similares = st.checkbox(
+                "Proponer ideas ya generadas para temas parecidos",
+                value=True,
+                key="reutilizar_ideas",
+                help="Antes de llamar al proveedor se buscan ideas generadas para temas y audiencias similares con el mismo objetivo."
+            )
+        with col2:
+            umbral_similitud = st.slider(
+                "Similitud mínima del tema", 0.3, 1.0, SIMILITUD_UMBRAL, 0.05,
+                key="umbral_ideas",
+                disabled=not reutilizar_similares
+            )
+        
         if st.button("Generar Ideas de Contenido", key="generar_forma2"):
+            st.session_state.pop("ideas_similares", None)
             if not tema_ideas:
                 st.error("Por favor, ingresa un tema para generar ideas")
             elif objetivo == "Selecciona el objetivo que esperas":
@@ -279,39 +734,34 @@ def generar_contenido_ui():
             elif not st.session_state.get(f"{proveedor_ideas.lower()}_api_key"):
                 st.error(f"Por favor, configura tu API key de {proveedor_ideas} en la barra lateral")
             else:
-                prompt_ideas = f"""
-                Eres el experto en estrategia de contenido digital. Para la generación de ideas de contenido sobre: {tema_ideas}
-                La audiencia objetivo es: {audiencia}
-                El objetivo principal que se espera es: {objetivo}
-                
-                Proporciona lo siguiente:
-                1. Definición del tipo de formato que se adapte a las necesidades del tema y la audiencia como: (videos, reels, blogs, infografías, etc.)
-                1. Ideas de contenido para plasmar en los formatos sugeridos.
-                2. Para cada idea, sugiere:
-                   - El formato más adecuado
-                   - Un título atractivo
-                   - Breve descripción del contenido
-                   - Por qué funcionaría bien con la audiencia objetivo
-                
-                Prioriza formatos y temas que se adecuen al tipo de contenido y sugerencias de contenido y frecuencia de publicación del contenido.
-                """
-                
-                with st.spinner(f"Generando ideas con {proveedor_ideas}..."):
-                    resultado_ideas = generar_texto(prompt_ideas, proveedor_ideas, "Ideas de Contenido")
-                    st.session_state.ultimo_resultado = resultado_ideas
-                    guardar_en_historial("Ideas de Contenido", prompt_ideas, resultado_ideas)
+                consulta = {
+                    "tema": tema_ideas, "audiencia": audiencia, "objetivo": objetivo,
+                    "proveedor": proveedor_ideas, "ignorar_cache": ignorar_cache_ideas
+                }
+                similares = buscar_ideas_similares(consulta, umbral_similitud) if reutilizar_similares and not ignorar_cache_ideas else []
+                if similares:
+                    st.session_state.ideas_similares = {"consulta": consulta, "similares": similares}
+                else:
+                    generar_ideas(consulta)
+        
+        propuesta = st.session_state.get("ideas_similares")
+        if propuesta and [propuesta["consulta"][campo] for campo in ("tema", "audiencia", "objetivo")] != [tema_ideas, audiencia, objetivo]:
+            # La propuesta deja de valer si se cambia el tema, la audiencia o el objetivo
+            del st.session_state.ideas_similares
+        elif propuesta:
+            mostrar_ideas_similares(propuesta)
 
+    with tab3:
+        generar_lote_ui()
+    
+    mostrar_comparacion("ultimo_resultado")
+    mostrar_multiformato("ultimo_resultado")
     
     if 'ultimo_resultado' in st.session_state:
         st.subheader("Contenido Generado")
-        if 'historial_versiones' not in st.session_state:
-            st.session_state.historial_versiones = []
-            
-        if not st.session_state.historial_versiones or st.session_state.ultimo_resultado != st.session_state.historial_versiones[-1]['contenido']:
-            st.session_state.historial_versiones.append({
-                'contenido': st.session_state.ultimo_resultado,
-                'timestamp': "Versión actual"
-            })
+        if estado_sesion("historial_versiones") is None:
+            st.session_state.historial_versiones = AlmacenVersiones()
+        st.session_state.historial_versiones.agregar(st.session_state.ultimo_resultado, datetime.now().strftime("%H:%M:%S"))
         
         
         st.write("### Versión actual:")
@@ -333,6 +783,8 @@ def generar_contenido_ui():
             if compartir_opcion != "Seleccionar..." and st.button("Compartir", key="compartir"):
                 compartir_en_redes(compartir_opcion, st.session_state.ultimo_resultado)
         
+        mostrar_versiones("historial_versiones", "ultimo_resultado", "versiones_contenido")
+        
         # st.divider()
         # st.subheader("Generar nueva versión")
         
@@ -382,6 +834,167 @@ def generar_contenido_ui():
         #                 st.session_state.ultimo_resultado = version['contenido']
         #                 st.rerun()
 
+def indice_ideas():
+    # Se importa al usarlo por primera vez: NumPy no hace falta para el resto de la app
+    from ideas_similares import obtener_indice
+    return obtener_indice()
+
+def buscar_ideas_similares(consulta, umbral):
+    with observabilidad.medir("similitud", tipo="Ideas de Contenido") as etiquetas:
+        similares = indice_ideas().buscar(consulta["tema"], consulta["audiencia"], consulta["objetivo"], umbral)
+        etiquetas["cache"] = "acierto" if similares else "fallo"
+    return similares
+
+def generar_ideas(consulta):
+    proveedor = consulta["proveedor"]
+    prompt_ideas = construir_prompt_ideas(consulta["tema"], consulta["audiencia"], consulta["objetivo"])
+    
+    generar_resultado(
+        f"Generando ideas con {proveedor}...",
+        nucleo.generar_texto, nucleo.generar_texto_stream,
+        (prompt_ideas, proveedor, "Ideas de Contenido"), consulta["ignorar_cache"],
+        "ultimo_resultado", "Ideas de Contenido", prompt_ideas,
+        lambda resultado: indice_ideas().agregar(consulta["tema"], consulta["audiencia"], consulta["objetivo"], proveedor, resultado)
+    )
+
+def reutilizar_idea(similar):
+    consulta = st.session_state.pop("ideas_similares")["consulta"]
+    st.session_state.ultimo_resultado = similar["resultado"]
+    guardar_en_historial(
+        "Ideas de Contenido",
+        construir_prompt_ideas(consulta["tema"], consulta["audiencia"], consulta["objetivo"]),
+        similar["resultado"]
+    )
+
+def mostrar_ideas_similares(propuesta):
+    st.info(f"Se encontraron {len(propuesta['similares'])} ideas generadas para temas parecidos. Puedes reutilizar una en lugar de esperar una nueva generación.")
+    for similar in propuesta["similares"]:
+        with st.container(border=True):
+            st.markdown(f"**{similar['tema']}** · {similar['audiencia'] or 'Sin audiencia'} · similitud {similar['similitud']:.0%}")
+            st.caption(f"{similar['proveedor']} · {datetime.fromtimestamp(similar['creado']).strftime('%d/%m/%Y %H:%M')} · {resumir(similar['resultado'])}")
+            st.button("Reutilizar este resultado", key=f"reutilizar_idea_{similar['id']}", on_click=reutilizar_idea, args=(similar,))
+    
+    if st.button("Generar nuevas ideas de todas formas", key="generar_ideas_igualmente"):
+        del st.session_state.ideas_similares
+        generar_ideas(propuesta["consulta"])
+
+FORMATOS_EXPORTACION = {"JSONL": "jsonl", "CSV": "csv", "Markdown (ZIP)": "zip"}
+
+def boton_exportacion(etiqueta, crear_registros, nombre, clave):
+    formato = FORMATOS_EXPORTACION[st.selectbox("Formato:", list(FORMATOS_EXPORTACION), key=f"{clave}_formato")]
+    # El archivo se genera al pulsar el botón, en otro hilo y sin pasar por
+    # memoria entrada a entrada; crear_registros no puede usar st.session_state
+    st.download_button(
+        etiqueta,
+        lambda: exportacion.exportar(crear_registros(), formato),
+        file_name=f"{nombre}.{formato}",
+        mime=exportacion.FORMATOS[formato][1],
+        on_click="ignore",
+        key=clave
+    )
+
+def exportar_importar_historial(historial, sesion, tipo, busqueda):
+    with st.expander("Exportar e importar"):
+        st.caption("Se exportan las entradas que coinciden con los filtros actuales, con el prompt y el texto completos.")
+        boton_exportacion(
+            "Exportar historial",
+            lambda: exportacion.registros_historial(historial, sesion, tipo, busqueda),
+            f"historial_{datetime.now().strftime('%Y%m%d_%H%M')}",
+            "exportar_historial"
+        )
+        
+        st.divider()
+        # La caché de respuestas es común a todas las sesiones: desde la app
+        # solo se importa al historial propio, y cargar la caché queda para el
+        # operador (python exportacion.py importar --cache)
+        archivo = st.file_uploader("Importar una exportación (JSONL o CSV)", type=["jsonl", "csv"], key="archivo_importacion")
+        if archivo and st.button("Importar", key="importar_historial"):
+            archivo.seek(0)
+            try:
+                with st.spinner("Importando..."):
+                    totales = exportacion.importar(
+                        exportacion.leer_registros(archivo, archivo.name), historial, sesion
+                    )
+            except (ValueError, KeyError) as e:
+                st.error(f"Archivo no válido: {str(e)}")
+                return
+            st.success(f"{totales['leidos']} registros leídos y {totales['historial']} añadidos al historial.")
+            if totales["descartados"]:
+                st.warning(
+                    f"{totales['descartados']} entradas importadas no se conservaron: el historial guarda como máximo "
+                    f"{HISTORIAL_MAX_POR_SESION} entradas por sesión y {HISTORIAL_DIAS_RETENCION} días."
+                )
+
+def generar_lote_ui():
+    st.subheader("Generación por Lotes")
+    st.caption(f"Sube un archivo CSV o JSONL con las columnas: tema, tipo_contenido, tipo_respuesta y proveedor ({' o '.join(PROVEEDORES)}).")
+    
+    archivo = st.file_uploader("Archivo de entrada", type=["csv", "jsonl"], key="archivo_lote")
+    
+    columnas = st.columns(1 + len(PROVEEDORES))
+    with columnas[0]:
+        concurrencia = st.slider("Peticiones simultáneas", 1, 16, 4, key="concurrencia_lote")
+    limites_rpm = {}
+    for columna, proveedor in zip(columnas[1:], PROVEEDORES):
+        with columna:
+            limites_rpm[proveedor] = st.number_input(
+                f"Límite {proveedor} (peticiones/min)", min_value=0,
+                value=LIMITES_POR_CLAVE.get(proveedor, {}).get("rpm", 60), key=f"rpm_{proveedor.lower()}_lote"
+            )
+    
+    ignorar_cache = st.checkbox("Ignorar caché (forzar una nueva generación)", value=False, key="ignorar_cache_lote")
+    
+    if not archivo:
+        return
+    
+    contenido = archivo.getvalue()
+    try:
+        filas = lotes.leer_filas(contenido, archivo.name)
+    except (ValueError, KeyError) as e:
+        st.error(f"Archivo no válido: {str(e)}")
+        return
+    
+    # El archivo de salida depende de la sesión y del contenido de entrada:
+    # volver a subir el mismo archivo reanuda el lote desde el último punto de
+    # control, sin compartir resultados con otra sesión que suba el mismo archivo
+    huella = hashlib.sha1(contenido).hexdigest()[:12]
+    huella_sesion = hashlib.sha1(id_sesion().encode("utf-8")).hexdigest()[:12]
+    ruta_salida = os.path.join(DIRECTORIO_DATOS, "lotes", f"{huella_sesion}-{huella}.jsonl")
+    completadas = len(lotes.leer_completadas(ruta_salida))
+    st.info(f"{len(filas)} filas en el archivo, {completadas} ya generadas.")
+    
+    if st.button("Generar Lote", key="generar_lote"):
+        proveedores_sin_clave = {fila["proveedor"] for fila in filas if not st.session_state.get(f"{fila['proveedor'].lower()}_api_key")}
+        if proveedores_sin_clave:
+            st.error(f"Por favor, configura tu API key de {', '.join(sorted(proveedores_sin_clave))} en la barra lateral")
+            return
+        
+        # Los hilos de trabajo no tienen acceso a st.session_state
+        claves = claves_sesion()
+        respaldo = st.session_state.get("respaldo_automatico", False)
+        sesion = id_sesion()
+        
+        def generar(fila):
+            prompt = construir_prompt_contenido(fila["tipo_contenido"], fila["tema"], fila["tipo_respuesta"])
+            return nucleo.generar_texto(prompt, fila["proveedor"], fila["tipo_contenido"], claves, ignorar_cache, respaldo, sesion)
+        
+        barra = st.progress(completadas / len(filas) if filas else 1.0)
+        errores = 0
+        for registro in lotes.procesar_lote(filas, ruta_salida, generar, concurrencia, limites_rpm):
+            completadas += 1
+            errores += bool(registro["error"])
+            barra.progress(min(completadas / len(filas), 1.0), text=f"{completadas}/{len(filas)} filas")
+        
+        if errores:
+            st.warning(f"{errores} filas fallaron; vuelve a pulsar Generar Lote para reintentarlas.")
+        else:
+            st.success("Lote completado")
+    
+    if os.path.exists(ruta_salida):
+        with open(ruta_salida, "rb") as salida:
+            st.download_button("Descargar resultados (JSONL)", salida, file_name=f"lote_{huella}.jsonl", mime="application/jsonl", key="descargar_lote")
+        boton_exportacion("Exportar resultados", lambda: exportacion.registros_lote(ruta_salida), f"lote_{huella}", "exportar_lote")
+
 def compartir_en_redes(red_social, contenido):
     contenido_codificado = urllib.parse.quote_plus(contenido)
     
@@ -415,19 +1028,28 @@ def compartir_en_redes(red_social, contenido):
 def generar_codigo_ui():
     st.header("Generador de Código")
     
+    modo = st.radio(
+        "Modo de generación:",
+        MODOS_PROVEEDOR,
+        horizontal=True,
+        key="modo_codigo",
+        help="Carrera envía la petición a todos los proveedores configurados y se queda con la primera respuesta; Comparar muestra todas las respuestas lado a lado."
+    )
+    
     col1, col2 = st.columns(2)
     
     with col1:
         proveedor = st.selectbox(
             "Selecciona el proveedor de IA:",
-            ["DeepSeek", "Mistral"],
-            key="codigo_proveedor"
+            PROVEEDORES,
+            key="codigo_proveedor",
+            disabled=modo != MODOS_PROVEEDOR[0]
         )
     
     with col2:
         lenguaje = st.selectbox(
             "Lenguaje de programación:",
-            ["Python", "JavaScript", "Java", "C++", "PHP", "Go", "Ruby", "C#", "SQL", "TypeScript", "Swift", "Rust"]
+            plantillas.actuales().lenguajes
         )
     
     st.subheader("Describe tu necesidad de código")
@@ -461,59 +1083,63 @@ def generar_codigo_ui():
         incluir_analisis_rendimiento = False
         incluir_alternativas = False
         
+    ignorar_cache = st.checkbox("Ignorar caché (forzar una nueva generación)", value=False, key="ignorar_cache_codigo")
+    st.checkbox(
+        "Corregir automáticamente los errores de sintaxis",
+        value=True,
+        key="reparar_codigo",
+        disabled=not postprocesado.validable(lenguaje),
+        help="En Python, JSON y SQL se comprueba la sintaxis del código generado; si falla, se pide una sola corrección del bloque con el error."
+    )
+    
     if st.button("Generar Código", use_container_width=True):
         if not solo_codigo and not (incluir_comentarios or incluir_explicacion or incluir_ejemplo or incluir_analisis_complejidad or incluir_analisis_rendimiento or incluir_alternativas):
             st.error("Por favor, selecciona al menos una opción de generación")
         elif not descripcion:
             st.error("Por favor, describe qué código necesitas")
-        elif not st.session_state.get(f"{proveedor.lower()}_api_key"):
+        elif modo == MODOS_PROVEEDOR[0] and not st.session_state.get(f"{proveedor.lower()}_api_key"):
             st.error(f"Por favor, configura tu API key de {proveedor} en la barra lateral")
+        elif modo != MODOS_PROVEEDOR[0] and not proveedores_configurados():
+            st.error("Por favor, configura al menos una API key en la barra lateral")
         else:
-            prompt_completo = f"Genera código en {lenguaje} para la siguiente tarea:\n\n{descripcion}\n\n"
+            opciones = {
+                opcion for opcion, incluida in [
+                    ("comentarios", incluir_comentarios),
+                    ("explicacion", incluir_explicacion),
+                    ("ejemplo", incluir_ejemplo),
+                    ("complejidad", incluir_analisis_complejidad),
+                    ("rendimiento", incluir_analisis_rendimiento),
+                    ("alternativas", incluir_alternativas)
+                ] if incluida
+            }
+            prompt_completo = construir_prompt_codigo(lenguaje, descripcion, solo_codigo, opciones)
+            st.session_state.prompt_codigo = prompt_completo
             
-            if solo_codigo:
-                prompt_completo += "IMPORTANTE: Proporciona SOLO el código, sin explicaciones, comentarios adicionales ni descripciones. El código debe ser completamente funcional y listo para usar."
+            if modo != MODOS_PROVEEDOR[0]:
+                ejecutar_multiproveedor(
+                    modo, MODELOS_CODIGO, mensajes_codigo(prompt_completo, lenguaje), ignorar_cache,
+                    "ultimo_codigo", f"Código {lenguaje}", prompt_completo
+                )
             else:
-                prompt_completo += "Incluye en tu respuesta:\n"
-                
-                if incluir_comentarios:
-                    prompt_completo += "- Comentarios explicativos dentro del código\n"
-                else:
-                    prompt_completo += "- NO incluyas comentarios en el código\n"
-                    
-                if incluir_explicacion:
-                    prompt_completo += "- Una explicación detallada de cómo funciona el código\n"
-                    
-                if incluir_ejemplo:
-                    prompt_completo += "- Un ejemplo de uso con entrada y salida esperada\n"
-                    
-                if incluir_analisis_complejidad:
-                    prompt_completo += "- Un análisis de la complejidad temporal y espacial del código\n"
-                    
-                if incluir_analisis_rendimiento:
-                    prompt_completo += "- Un análisis del rendimiento y posibles optimizaciones\n"
-                    
-                if incluir_alternativas:
-                    prompt_completo += "- Enfoques alternativos para resolver el mismo problema\n"
-            
-            with st.spinner(f"Generando código {lenguaje} con {proveedor}..."):
-                resultado = generar_codigo(prompt_completo, proveedor, lenguaje)
-                st.session_state.ultimo_codigo = resultado
-                guardar_en_historial(f"Código {lenguaje}", prompt_completo, resultado)
+                generar_resultado(
+                    f"Generando código {lenguaje} con {proveedor}...",
+                    nucleo.generar_codigo,
+                    solo_codigo_stream(nucleo.generar_codigo_stream, lenguaje) if solo_codigo else nucleo.generar_codigo_stream,
+                    (prompt_completo, proveedor, lenguaje), ignorar_cache,
+                    "ultimo_codigo", f"Código {lenguaje}", prompt_completo,
+                    procesar=revision_codigo(proveedor, lenguaje, ignorar_cache, solo_codigo)
+                )
+    
+    mostrar_comparacion("ultimo_codigo", lenguaje)
                     
     if 'ultimo_codigo' in st.session_state:
         st.subheader("Código Generado")
         
-        if 'historial_codigo' not in st.session_state:
-            st.session_state.historial_codigo = []
-        
-        if not st.session_state.historial_codigo or st.session_state.ultimo_codigo != st.session_state.historial_codigo[-1]['codigo']:
-            st.session_state.historial_codigo.append({
-                'codigo': st.session_state.ultimo_codigo,
-                'timestamp': "Versión actual"
-            })
+        if estado_sesion("historial_codigo") is None:
+            st.session_state.historial_codigo = AlmacenVersiones()
+        st.session_state.historial_codigo.agregar(st.session_state.ultimo_codigo, datetime.now().strftime("%H:%M:%S"))
         
-        st.code(st.session_state.ultimo_codigo, language=lenguaje.lower())
+        mostrar_codigo(st.session_state.ultimo_codigo, lenguaje, es_codigo=solo_codigo)
         
         col1, col2 = st.columns(2)
         with col1:
@@ -522,6 +1148,17 @@ def generar_codigo_ui():
         
         st.divider()
         st.subheader("Mejorar o Refactorizar Código")
+        modo_conversacion = st.toggle(
+            "Modo conversación",
+            value=True,
+            key="modo_conversacion",
+            help="Cada mejora continúa la conversación anterior en lugar de reenviar el código completo; el proveedor reutiliza el contexto ya procesado"
+        )
+        if modo_conversacion:
+            prefijo, total = conversacion_codigo(lenguaje).tokens()
+            st.caption(f"La conversación ocupa unos {total} tokens, de los que {prefijo} son un prefijo fijo reutilizable; los turnos antiguos se resumen al superar {CONVERSACION_MAX_TOKENS} tokens.")
+        else:
+            st.caption(f"El código actual ocupa unos {estimar_tokens(st.session_state.ultimo_codigo)} tokens; cada mejora lo reenvía completo (máximo por petición: {MAX_TOKENS_ENTRADA} tokens).")
         
         mejora_descripcion = st.text_area(
             "Describe qué aspectos del código quieres mejorar:",
@@ -533,66 +1170,111 @@ def generar_codigo_ui():
         
         with mejora_col1:
             if st.button("Optimizar Rendimiento", key="optimizar"):
-                mejora_especifica = "Optimiza el rendimiento del código manteniendo la misma funcionalidad. Enfócate en mejorar la eficiencia y velocidad de ejecución."
-                if mejora_descripcion:
-                    mejora_especifica += f" Considera estas indicaciones adicionales: {mejora_descripcion}"
-                
-                nuevo_prompt = f"Revisa, mejora y optimiza el siguiente código {lenguaje} para mejorar su rendimiento:\n\n{st.session_state.ultimo_codigo}\n\n{mejora_especifica}"
-                with st.spinner(f"Optimizando código con {proveedor}..."):
-                    resultado = generar_codigo(nuevo_prompt, proveedor, lenguaje)
-                    actualizar_historial_codigo(resultado)
+                mejorar_codigo("optimizar", f"Optimizando código con {proveedor}...", proveedor, lenguaje, mejora_descripcion, ignorar_cache, modo_conversacion)
         
         with mejora_col2:
             if st.button("Mejorar Legibilidad", key="legibilidad"):
-                mejora_especifica = "Mejora la legibilidad y mantenibilidad del código. Enfócate en hacer el código más claro, mejor organizado y más fácil de mantener."
-                if mejora_descripcion:
-                    mejora_especifica += f" Considera estas indicaciones adicionales: {mejora_descripcion}"
-                
-                nuevo_prompt = f"Revisa y refactoriza el siguiente código {lenguaje} para mejorar su legibilidad y mantenibilidad:\n\n{st.session_state.ultimo_codigo}\n\n{mejora_especifica}"
-                with st.spinner(f"Mejorando legibilidad con {proveedor}..."):
-                    resultado = generar_codigo(nuevo_prompt, proveedor, lenguaje)
-                    actualizar_historial_codigo(resultado)
+                mejorar_codigo("legibilidad", f"Mejorando legibilidad con {proveedor}...", proveedor, lenguaje, mejora_descripcion, ignorar_cache, modo_conversacion)
         
         with mejora_col3:
             if st.button("Refactorizar", key="refactorizar"):
-                mejora_especifica = "Refactoriza el código para mejorar su estructura, reducir duplicación y seguir mejores prácticas."
-                if mejora_descripcion:
-                    mejora_especifica += f" Considera estas indicaciones adicionales: {mejora_descripcion}"
-                
-                nuevo_prompt = f"Refactoriza el siguiente código {lenguaje}:\n\n{st.session_state.ultimo_codigo}\n\n{mejora_especifica}"
-                with st.spinner(f"Refactorizando código con {proveedor}..."):
-                    resultado = generar_codigo(nuevo_prompt, proveedor, lenguaje)
-                    actualizar_historial_codigo(resultado)
+                mejorar_codigo("refactorizar", f"Refactorizando código con {proveedor}...", proveedor, lenguaje, mejora_descripcion, ignorar_cache, modo_conversacion)
         
         if st.button("Mejora Personalizada", use_container_width=True, key="mejora_personalizada"):
             if not mejora_descripcion:
                 st.error("Por favor, describe qué aspectos del código quieres mejorar")
             else:
-                nuevo_prompt = f"Revisa y mejora el siguiente código {lenguaje} según estas indicaciones específicas:\n\n{st.session_state.ultimo_codigo}\n\nMejoras solicitadas: {mejora_descripcion}"
-                with st.spinner(f"Mejorando código con {proveedor}..."):
-                    resultado = generar_codigo(nuevo_prompt, proveedor, lenguaje)
-                    actualizar_historial_codigo(resultado)
-        
-        if len(st.session_state.historial_codigo) > 1:
-            st.divider()
-            st.subheader("Versiones Anteriores del Código")
-            
-            for i, version in enumerate(reversed(st.session_state.historial_codigo[:-1]), 1):
-                with st.expander(f"Versión anterior {i}"):
-                    st.code(version['codigo'], language=lenguaje.lower())
-                    st.caption(version['timestamp'])
-                    
-                    if st.button(f"Restaurar esta versión", key=f"restaurar_codigo_{i}"):
-                        st.session_state.ultimo_codigo = version['codigo']
-                        st.rerun()
-
-def actualizar_historial_codigo(nuevo_codigo):
-    if st.session_state.ultimo_codigo != nuevo_codigo:
-        if st.session_state.historial_codigo[-1]['timestamp'] == "Versión actual":
-            st.session_state.historial_codigo[-1]['timestamp'] = "Versión anterior"
+                mejorar_codigo("personalizada", f"Mejorando código con {proveedor}...", proveedor, lenguaje, mejora_descripcion, ignorar_cache, modo_conversacion)
         
-        st.session_state.ultimo_codigo = nuevo_codigo
-        guardar_en_historial(f"Código {st.session_state.get('lenguaje', 'desconocido')}", "Mejora o refactorización", nuevo_codigo)
+        mostrar_versiones("historial_codigo", "ultimo_codigo", "versiones_codigo", lenguaje)
+
+def conversacion_codigo(lenguaje):
+    # La conversación sigue al código mostrado: si se restaura una versión, se
+    # elige otra respuesta en la comparación o se cambia de lenguaje, empieza otra
+    conversacion = estado_sesion("conversacion_codigo")
+    if conversacion is None or conversacion.codigo_actual != st.session_state.ultimo_codigo or conversacion.lenguaje != lenguaje:
+        conversacion = nucleo.iniciar_conversacion(st.session_state.get("prompt_codigo", ""), lenguaje, st.session_state.ultimo_codigo)
+        st.session_state.conversacion_codigo = conversacion
+    return conversacion
+
+def mejorar_codigo(tipo_mejora, mensaje, proveedor, lenguaje, indicaciones, ignorar_cache, modo_conversacion):
+    if modo_conversacion:
+        conversacion = conversacion_codigo(lenguaje)
+        instruccion = nucleo.construir_turno_mejora(tipo_mejora, lenguaje, indicaciones)
+        funciones = nucleo.generar_mejora, nucleo.generar_mejora_stream
+        argumentos = (conversacion, instruccion, proveedor)
+    else:
+        nuevo_prompt = construir_prompt_mejora(tipo_mejora, lenguaje, st.session_state.ultimo_codigo, indicaciones)
+        funciones = nucleo.generar_codigo, nucleo.generar_codigo_stream
+        argumentos = (nuevo_prompt, proveedor, lenguaje)
+    generar_resultado(
+        mensaje, *funciones, argumentos, ignorar_cache,
+        "ultimo_codigo", f"Código {lenguaje}", "Mejora o refactorización",
+        procesar=revision_codigo(proveedor, lenguaje, ignorar_cache, False)
+    )
+
+def mostrar_versiones(clave_versiones, clave_actual, clave_widget, lenguaje=None):
+    # Se muestra una sola versión anterior a la vez, como diferencias con la
+    # actual, en lugar de reconstruir y pintar todas las copias completas
+    versiones = estado_sesion(clave_versiones)
+    if len(versiones) < 2:
+        return
+    
+    st.divider()
+    st.subheader("Versiones Anteriores")
+    anteriores = list(range(len(versiones) - 2, -1, -1))
+    indice = st.selectbox(
+        "Comparar la versión actual con:",
+        anteriores,
+        format_func=lambda i: f"Versión {i + 1} ({versiones.etiqueta(i)})",
+        key=f"{clave_widget}_seleccion"
+    )
+    
+    if st.toggle("Ver la versión completa", key=f"{clave_widget}_completa"):
+        if lenguaje:
+            st.code(versiones.obtener(indice), language=lenguaje.lower())
+        else:
+            st.write(versiones.obtener(indice))
+    else:
+        diferencias = versiones.diferencias(indice)
+        if diferencias:
+            st.code(diferencias, language="diff")
+        else:
+            st.caption("Sin diferencias de texto con la versión actual")
+    
+    if st.button("Restaurar esta versión", key=f"{clave_widget}_restaurar"):
+        st.session_state[clave_actual] = versiones.obtener(indice)
+        st.rerun()
+
+def ejecutar():
+    observabilidad.iniciar_servidor()
+    
+    if not gestor_memoria.entrar(id_conexion()):
+        st.error("El servidor está atendiendo el máximo de sesiones. Inténtalo de nuevo en unos minutos.")
+        st.stop()
+    # Antes de pintar nada, para que la cookie de una sesión nueva se escriba al principio
+    id_sesion()
+    
+    estado_perfil = st.session_state.get("perfil_estado") if PERFILADO else None
+    if estado_perfil == "armado":
+        st.session_state.perfil_estado = "listo"
+    elif estado_perfil == "listo":
+        st.session_state.perfil_estado = None
+    
+    # Cada ejecución del script es una petición, con su propio identificador en los registros
+    with observabilidad.peticion(), observabilidad.perfilar(estado_perfil == "listo") as perfil:
+        try:
+            with observabilidad.medir("render"):
+                main()
+        finally:
+            if estado_perfil == "listo":
+                st.session_state.ultimo_perfil = perfil
+    # Cuenta la memoria de la sesión y mueve a disco lo que sobre del tope
+    gestor_memoria.revisar(id_conexion(), st.session_state, gestor_trabajos.en_uso(id_sesion()))
+    if perfil.get("ruta"):
+        st.toast(f"Perfil guardado en {perfil['ruta']}")
+    # Con la página ya enviada, se cargan los SDK de los proveedores con clave
+    precargar(proveedores_configurados())
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    ejecutar()
\ No newline at end of file
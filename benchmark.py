@@ -0,0 +1,329 @@
+import argparse
+import importlib.util
+import json
+import multiprocessing
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+# Pruebas de carga contra el proveedor simulado (proveedor_simulado.py): N
+# usuarios concurrentes lanzan peticiones al núcleo o a la interfaz de
+# Streamlit (AppTest) y se informa de latencias, tiempo hasta el primer token,
+# rendimiento y memoria por sesión. No llama a ninguna API de pago.
+#
+#   python benchmark.py --usuarios 16 --peticiones 10 --latencia 0.3 --salida bench.json
+#   python benchmark.py --escenarios "" --arranque
+
+ESCENARIOS = ["texto", "texto_stream", "codigo", "codigo_stream", "app"]
+DIRECTORIO = os.path.dirname(os.path.abspath(__file__))
+RUTA_APP = os.path.join(DIRECTORIO, "app.py")
+TEMAS_REPETIDOS = 5
+REPETICIONES_ARRANQUE = 3
+MODULOS_MOSTRADOS = 8
+
+# Se ejecuta en un proceso nuevo: tiempo hasta la primera página de una sesión y de un rerun
+CODIGO_RENDER = """
+import json, sys, time
+inicio = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+sesion = AppTest.from_file(sys.argv[1], default_timeout=120)
+sesion.run()
+primer_render = time.perf_counter() - inicio
+inicio = time.perf_counter()
+sesion.run()
+print(json.dumps({"primer_render": primer_render, "rerun": time.perf_counter() - inicio}))
+"""
+
+def puerto_libre():
+    with socket.socket() as conexion:
+        conexion.bind(("127.0.0.1", 0))
+        return conexion.getsockname()[1]
+
+def preparar_entorno(args):
+    # La configuración se lee al importar los módulos, así que el entorno se
+    # prepara antes de importar el núcleo
+    url = f"http://127.0.0.1:{puerto_libre()}"
+    os.environ["CONTELIA_URL_DEEPSEEK"] = url
+    os.environ["CONTELIA_URL_MISTRAL"] = url
+    os.environ.setdefault("CONTELIA_DATOS", tempfile.mkdtemp(prefix="contelia-bench-"))
+    if not args.con_limites:
+        sin_limite = {proveedor: {"rpm": 10**9, "tpm": 10**12} for proveedor in ["DeepSeek", "Mistral"]}
+        os.environ["CONTELIA_LIMITES_PROVEEDOR"] = json.dumps(sin_limite)
+        os.environ["CONTELIA_LIMITES_POR_CLAVE"] = json.dumps(sin_limite)
+        os.environ["CONTELIA_MAX_COLA"] = str(10**6)
+    os.environ["DEEPSEEK_API_KEY"] = os.environ["MISTRAL_API_KEY"] = "simulada"
+    # AppTest ejecuta la app fuera de un servidor y Streamlit avisa en cada hilo
+    os.environ.setdefault("STREAMLIT_LOGGER_LEVEL", "error")
+
+    from proveedor_simulado import simulacion_desde, iniciar_en_segundo_plano
+    return iniciar_en_segundo_plano(simulacion_desde(args), puerto=int(url.rsplit(":", 1)[1]))
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def tema(usuario, numero, aciertos):
+    # Con probabilidad "aciertos" se repite un tema de un conjunto pequeño y la
+    # petición puede resolverse desde la caché de respuestas
+    if random.random() < aciertos:
+        return f"tema repetido {random.randrange(TEMAS_REPETIDOS)}"
+    return f"tema {usuario}-{numero}-{uuid.uuid4().hex[:8]}"
+
+def peticion_nucleo(escenario, proveedor, claves, texto):
+    import nucleo
+    from resiliencia import ErrorGeneracion
+
+    inicio = time.perf_counter()
+    primer_token = None
+    try:
+        if escenario in ("texto", "texto_stream"):
+            prompt = nucleo.construir_prompt_contenido("Post para Twitter/X", texto, "Ejemplo concreto")
+            argumentos = (prompt, proveedor, "Post para Twitter/X", claves, False, False, "benchmark")
+        else:
+            prompt = nucleo.construir_prompt_codigo("Python", texto, True)
+            argumentos = (prompt, proveedor, "Python", claves, False, False, "benchmark")
+
+        if escenario == "texto":
+            nucleo.generar_texto(*argumentos)
+        elif escenario == "codigo":
+            nucleo.generar_codigo(*argumentos)
+        else:
+            generar = nucleo.generar_texto_stream if escenario == "texto_stream" else nucleo.generar_codigo_stream
+            for _ in generar(*argumentos):
+                if primer_token is None:
+                    primer_token = time.perf_counter() - inicio
+        error = None
+    except ErrorGeneracion as e:
+        error = type(e).__name__
+    return {"duracion": time.perf_counter() - inicio, "primer_token": primer_token, "error": error}
+
+def usuario_nucleo(escenario, usuario, args):
+    import nucleo
+    claves = nucleo.claves_entorno()
+    return [
+        peticion_nucleo(escenario, args.proveedor, claves, tema(usuario, numero, args.aciertos))
+        for numero in range(args.peticiones)
+    ], None
+
+def usuario_app(escenario, usuario, args):
+    # AppTest no admite varias sesiones en paralelo dentro de un mismo proceso,
+    # así que cada usuario simulado se ejecuta en su propio proceso
+    from streamlit.testing.v1 import AppTest
+
+    # Una ejecución previa importa los módulos de la app, para que la memoria
+    # medida corresponda solo a la sesión
+    AppTest.from_file(RUTA_APP, default_timeout=120).run()
+    tracemalloc.start()
+
+    sesion = AppTest.from_file(RUTA_APP, default_timeout=120)
+    sesion.session_state["deepseek_api_key"] = "simulada"
+    sesion.session_state["mistral_api_key"] = "simulada"
+    # Se mide la generación completa dentro de la ejecución, no solo el envío del trabajo
+    sesion.session_state["segundo_plano"] = False
+    sesion.run()
+    sesion.selectbox(key="proveedor_forma1").select(args.proveedor)
+    sesion.selectbox(key="tipo_contenido_forma1").select("Post para Twitter/X")
+    sesion.selectbox(key="tipo_respuesta").select("Ejemplo concreto")
+
+    resultados = []
+    for numero in range(args.peticiones):
+        sesion.text_area(key="prompt_forma1").input(tema(usuario, numero, args.aciertos))
+        inicio = time.perf_counter()
+        sesion.button(key="generar_forma1").click().run()
+        error = None
+        if sesion.exception:
+            error = "Excepcion"
+        elif sesion.error:
+            error = "ErrorGeneracion"
+        resultados.append({"duracion": time.perf_counter() - inicio, "primer_token": None, "error": error})
+
+    memoria = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return resultados, memoria
+
+def ejecutar_escenario(escenario, args):
+    if escenario == "app":
+        ejecutor = ProcessPoolExecutor(max_workers=args.usuarios, mp_context=multiprocessing.get_context("spawn"))
+        ejecutar_usuario = usuario_app
+    else:
+        ejecutor = ThreadPoolExecutor(max_workers=args.usuarios)
+        ejecutar_usuario = usuario_nucleo
+
+    inicio = time.perf_counter()
+    with ejecutor:
+        futuros = [ejecutor.submit(ejecutar_usuario, escenario, usuario, args) for usuario in range(args.usuarios)]
+        respuestas = [futuro.result() for futuro in futuros]
+    duracion = time.perf_counter() - inicio
+
+    peticiones = [peticion for resultados, _ in respuestas for peticion in resultados]
+    correctas = [peticion for peticion in peticiones if peticion["error"] is None]
+    latencias = [peticion["duracion"] for peticion in correctas]
+    primeros = [peticion["primer_token"] for peticion in correctas if peticion["primer_token"] is not None]
+    memorias = [memoria for _, memoria in respuestas if memoria is not None]
+    errores = {}
+    for peticion in peticiones:
+        if peticion["error"]:
+            errores[peticion["error"]] = errores.get(peticion["error"], 0) + 1
+    return {
+        "escenario": escenario,
+        "usuarios": args.usuarios,
+        "peticiones": len(peticiones),
+        "errores": errores,
+        "latencia_p50": percentil(latencias, 50),
+        "latencia_p95": percentil(latencias, 95),
+        "latencia_p99": percentil(latencias, 99),
+        "primer_token_p50": percentil(primeros, 50),
+        "primer_token_p95": percentil(primeros, 95),
+        "peticiones_por_segundo": len(correctas) / duracion if duracion else 0.0,
+        "memoria_por_sesion_kb": sum(memorias) / len(memorias) / 1024 if memorias else None,
+        "duracion": duracion
+    }
+
+def medir_importaciones():
+    # Con -X importtime Python escribe en stderr una línea por módulo con su
+    # tiempo propio y acumulado en µs; la sangría indica quién lo importó
+    inicio = time.perf_counter()
+    salida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=DIRECTORIO, capture_output=True, text=True, check=True
+    ).stderr
+    proceso = time.perf_counter() - inicio
+
+    total = 0.0
+    directos = {}
+    paquetes = {}
+    for linea in salida.splitlines():
+        if not linea.startswith("import time:") or "[us]" in linea:
+            continue
+        propio, acumulado, nombre = linea.removeprefix("import time:").split("|")
+        nivel = (len(nombre) - len(nombre.lstrip()) - 1) // 2
+        nombre = nombre.strip()
+        if nivel == 0 and nombre == "app":
+            total = int(acumulado) / 1e6
+        elif nivel == 1:
+            # Módulos que importa app.py directamente (los que no había importado ya otro)
+            directos[nombre] = int(acumulado) / 1e6
+        paquete = nombre.split(".")[0]
+        paquetes[paquete] = paquetes.get(paquete, 0.0) + int(propio) / 1e6
+    return {"proceso": proceso, "importacion": total, "modulos": directos, "paquetes": paquetes}
+
+def medir_render():
+    salida = subprocess.run(
+        [sys.executable, "-c", CODIGO_RENDER, RUTA_APP],
+        cwd=DIRECTORIO, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(salida.strip().splitlines()[-1])
+
+def medir_arranque(repeticiones=REPETICIONES_ARRANQUE):
+    # Arranque en frío de un proceso nuevo (como un pod recién creado); se
+    # toma la mediana de varias repeticiones porque la primera calienta la
+    # caché de disco del sistema
+    importaciones = [medir_importaciones() for _ in range(repeticiones)]
+    renders = [medir_render() for _ in range(repeticiones)]
+    return {
+        "repeticiones": repeticiones,
+        "proceso": statistics.median([medida["proceso"] for medida in importaciones]),
+        "importacion": statistics.median([medida["importacion"] for medida in importaciones]),
+        "primer_render": statistics.median([medida["primer_render"] for medida in renders]),
+        "rerun": statistics.median([medida["rerun"] for medida in renders]),
+        "modulos": {
+            nombre: statistics.median([medida["modulos"].get(nombre, 0.0) for medida in importaciones])
+            for nombre in importaciones[0]["modulos"]
+        },
+        "paquetes": {
+            nombre: statistics.median([medida["paquetes"].get(nombre, 0.0) for medida in importaciones])
+            for nombre in importaciones[0]["paquetes"]
+        }
+    }
+
+def formato(valor, escala=1000, sufijo=" ms"):
+    return "-" if valor is None else f"{valor * escala:.0f}{sufijo}"
+
+def imprimir(resultados):
+    print(f"{'escenario':<14} {'ok/total':>9} {'p50':>8} {'p95':>8} {'p99':>8} {'ttft p50':>9} {'ttft p95':>9} {'pet/s':>7} {'KB/sesión':>10}")
+    for resultado in resultados:
+        errores = sum(resultado["errores"].values())
+        print(
+            f"{resultado['escenario']:<14} {resultado['peticiones'] - errores:>4}/{resultado['peticiones']:<4} "
+            f"{formato(resultado['latencia_p50']):>8} {formato(resultado['latencia_p95']):>8} {formato(resultado['latencia_p99']):>8} "
+            f"{formato(resultado['primer_token_p50']):>9} {formato(resultado['primer_token_p95']):>9} "
+            f"{resultado['peticiones_por_segundo']:>7.1f} {formato(resultado['memoria_por_sesion_kb'], 1, ''):>10}"
+        )
+        if resultado["errores"]:
+            print(f"{'':<14} errores: {resultado['errores']}")
+
+def imprimir_arranque(arranque):
+    print(
+        f"arranque (mediana de {arranque['repeticiones']}): importar app {formato(arranque['importacion'])} · "
+        f"proceso completo {formato(arranque['proceso'])} · primera página {formato(arranque['primer_render'])} · "
+        f"rerun {formato(arranque['rerun'])}"
+    )
+    for titulo, tiempos in [("importados por app.py (acumulado)", arranque["modulos"]), ("por paquete (tiempo propio)", arranque["paquetes"])]:
+        print(f"  {titulo}:")
+        for nombre, segundos in sorted(tiempos.items(), key=lambda par: -par[1])[:MODULOS_MOSTRADOS]:
+            print(f"    {nombre:<28} {formato(segundos):>8}")
+
+def main(argumentos=None):
+    from proveedor_simulado import argumentos_simulacion
+
+    parser = argparse.ArgumentParser(description="Pruebas de carga de ContelIA contra un proveedor simulado")
+    parser.add_argument("--escenarios", default=",".join(ESCENARIOS), help=f"Lista separada por comas: {', '.join(ESCENARIOS)}")
+    parser.add_argument("--usuarios", type=int, default=8, help="Usuarios simulados concurrentes")
+    parser.add_argument("--peticiones", type=int, default=5, help="Peticiones por usuario")
+    parser.add_argument("--proveedor", default="DeepSeek", choices=["DeepSeek", "Mistral"])
+    parser.add_argument("--aciertos", type=float, default=0.0, help="Fracción de peticiones con un tema repetido (aciertos de caché)")
+    parser.add_argument("--con-limites", action="store_true", help="Mantener los límites configurados del planificador")
+    parser.add_argument("--arranque", action="store_true", help="Medir también el arranque en frío: importaciones y primera página de la app")
+    parser.add_argument("--salida", help="Archivo JSON donde guardar los resultados")
+    argumentos_simulacion(parser)
+    args = parser.parse_args(argumentos)
+
+    escenarios = [escenario.strip() for escenario in args.escenarios.split(",") if escenario.strip()]
+    desconocidos = set(escenarios) - set(ESCENARIOS)
+    if desconocidos:
+        parser.error(f"Escenarios desconocidos: {', '.join(sorted(desconocidos))}")
+
+    url = preparar_entorno(args)
+    print(f"Proveedor simulado en {url}", file=sys.stderr)
+
+    arranque = None
+    if args.arranque:
+        if importlib.util.find_spec("streamlit") is None:
+            print("Medición de arranque omitida: streamlit no está instalado", file=sys.stderr)
+        else:
+            print("Midiendo el arranque...", file=sys.stderr)
+            arranque = medir_arranque()
+            imprimir_arranque(arranque)
+
+    resultados = []
+    for escenario in escenarios:
+        if escenario == "app" and importlib.util.find_spec("streamlit") is None:
+            print("Escenario app omitido: streamlit no está instalado", file=sys.stderr)
+            continue
+        print(f"Ejecutando {escenario}...", file=sys.stderr)
+        resultados.append(ejecutar_escenario(escenario, args))
+
+    if resultados:
+        imprimir(resultados)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            json.dump({
+                "parametros": vars(args),
+                "resultados": resultados,
+                "arranque": arranque,
+                "momento": time.strftime("%Y-%m-%dT%H:%M:%S")
+            }, archivo, ensure_ascii=False, indent=2)
+    return 1 if any(resultado["errores"] for resultado in resultados) and not (args.tasa_errores or args.tasa_429) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,202 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from configuracion import DIRECTORIO_DATOS, CACHE_TTL_SEGUNDOS, CACHE_MAX_BYTES, CACHE_MAX_ENTRADAS
+
+def clave_cache(proveedor, modelo, mensajes):
+    contenido = json.dumps([proveedor, modelo, mensajes], ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()
+
+class Vuelo:
+    # Petición en curso hacia el proveedor que comparten las solicitudes idénticas
+    def __init__(self):
+        self.evento = threading.Event()
+        self.resultado = None
+        self.error = None
+
+class CacheRespuestas:
+    def __init__(self, ruta=None, ttl=CACHE_TTL_SEGUNDOS, max_bytes=CACHE_MAX_BYTES, max_entradas=CACHE_MAX_ENTRADAS):
+        if ruta is None:
+            os.makedirs(DIRECTORIO_DATOS, exist_ok=True)
+            ruta = os.path.join(DIRECTORIO_DATOS, "respuestas.sqlite")
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entradas = max_entradas
+        self.lock = threading.Lock()
+        self.en_vuelo = {}
+
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("""
+            CREATE TABLE IF NOT EXISTS respuestas (
+                clave TEXT PRIMARY KEY,
+                respuesta TEXT NOT NULL,
+                tamano INTEGER NOT NULL,
+                creado REAL NOT NULL,
+                accedido REAL NOT NULL
+            )
+        """)
+        self.conexion.execute("CREATE INDEX IF NOT EXISTS idx_respuestas_accedido ON respuestas (accedido)")
+        self.conexion.commit()
+
+    def obtener(self, clave):
+        ahora = time.time()
+        with self.lock:
+            fila = self.conexion.execute(
+                "SELECT respuesta, creado FROM respuestas WHERE clave = ?", (clave,)
+            ).fetchone()
+            if fila is None:
+                return None
+            if ahora - fila[1] > self.ttl:
+                self.conexion.execute("DELETE FROM respuestas WHERE clave = ?", (clave,))
+                self.conexion.commit()
+                return None
+            self.conexion.execute("UPDATE respuestas SET accedido = ? WHERE clave = ?", (ahora, clave))
+            self.conexion.commit()
+            return fila[0]
+
+    def guardar(self, clave, respuesta):
+        ahora = time.time()
+        with self.lock:
+            self.conexion.execute(
+                "INSERT OR REPLACE INTO respuestas (clave, respuesta, tamano, creado, accedido) VALUES (?, ?, ?, ?, ?)",
+                (clave, respuesta, len(respuesta.encode("utf-8")), ahora, ahora)
+            )
+            self.desalojar(ahora)
+            self.conexion.commit()
+
+    def guardar_varias(self, respuestas):
+        # Carga masiva de pares (clave, respuesta) con un único desalojo al final
+        ahora = time.time()
+        with self.lock:
+            self.conexion.executemany(
+                "INSERT OR REPLACE INTO respuestas (clave, respuesta, tamano, creado, accedido) VALUES (?, ?, ?, ?, ?)",
+                [(clave, respuesta, len(respuesta.encode("utf-8")), ahora, ahora) for clave, respuesta in respuestas]
+            )
+            self.desalojar(ahora)
+            self.conexion.commit()
+
+    def desalojar(self, ahora):
+        # Se eliminan las entradas caducadas y después las menos usadas
+        # hasta respetar los límites de tamaño y número de entradas
+        self.conexion.execute("DELETE FROM respuestas WHERE creado < ?", (ahora - self.ttl,))
+        entradas, total = self.conexion.execute(
+            "SELECT COUNT(*), COALESCE(SUM(tamano), 0) FROM respuestas"
+        ).fetchone()
+        if entradas <= self.max_entradas and total <= self.max_bytes:
+            return
+
+        sobrantes = []
+        for clave, tamano in self.conexion.execute("SELECT clave, tamano FROM respuestas ORDER BY accedido ASC"):
+            if entradas <= self.max_entradas and total <= self.max_bytes:
+                break
+            sobrantes.append((clave,))
+            entradas -= 1
+            total -= tamano
+        self.conexion.executemany("DELETE FROM respuestas WHERE clave = ?", sobrantes)
+
+    def limpiar(self):
+        with self.lock:
+            self.conexion.execute("DELETE FROM respuestas")
+            self.conexion.commit()
+
+    def unirse_o_liderar(self, clave):
+        with self.lock:
+            vuelo = self.en_vuelo.get(clave)
+            if vuelo is not None:
+                return vuelo, False
+            vuelo = Vuelo()
+            self.en_vuelo[clave] = vuelo
+            return vuelo, True
+
+    def terminar_vuelo(self, clave, vuelo):
+        with self.lock:
+            if self.en_vuelo.get(clave) is vuelo:
+                del self.en_vuelo[clave]
+        vuelo.evento.set()
+
+    def obtener_o_generar(self, clave, generar, ignorar_cache=False):
+        if ignorar_cache:
+            resultado = generar()
+            self.guardar(clave, resultado)
+            return resultado, False
+
+        while True:
+            resultado = self.obtener(clave)
+            if resultado is not None:
+                return resultado, True
+
+            vuelo, lider = self.unirse_o_liderar(clave)
+            if not lider:
+                vuelo.evento.wait()
+                if vuelo.error is not None:
+                    raise vuelo.error
+                if vuelo.resultado is not None:
+                    return vuelo.resultado, True
+                # El líder se canceló sin resultado: se vuelve a intentar
+                continue
+
+            try:
+                vuelo.resultado = generar()
+                self.guardar(clave, vuelo.resultado)
+                return vuelo.resultado, False
+            except Exception as e:
+                vuelo.error = e
+                raise
+            finally:
+                self.terminar_vuelo(clave, vuelo)
+
+    def transmitir(self, clave, generar_stream, ignorar_cache=False):
+        if ignorar_cache:
+            partes = []
+            for fragmento in generar_stream():
+                partes.append(fragmento)
+                yield fragmento
+            self.guardar(clave, "".join(partes))
+            return
+
+        while True:
+            resultado = self.obtener(clave)
+            if resultado is not None:
+                yield resultado
+                return
+
+            vuelo, lider = self.unirse_o_liderar(clave)
+            if not lider:
+                vuelo.evento.wait()
+                if vuelo.error is not None:
+                    raise vuelo.error
+                if vuelo.resultado is not None:
+                    yield vuelo.resultado
+                    return
+                continue
+
+            try:
+                partes = []
+                for fragmento in generar_stream():
+                    partes.append(fragmento)
+                    yield fragmento
+                vuelo.resultado = "".join(partes)
+                self.guardar(clave, vuelo.resultado)
+                return
+            except Exception as e:
+                vuelo.error = e
+                raise
+            finally:
+                # Si el generador se cierra antes de terminar, el vuelo queda
+                # sin resultado y las solicitudes en espera lo reintentan
+                self.terminar_vuelo(clave, vuelo)
+
+cache = None
+lock_cache = threading.Lock()
+
+def obtener_cache():
+    global cache
+    with lock_cache:
+        if cache is None:
+            cache = CacheRespuestas()
+        return cache
@@ -0,0 +1,128 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import httpx
+
+from configuracion import TIEMPO_ESPERA_SEGUNDOS, TIEMPO_CONEXION_SEGUNDOS, URL_DEEPSEEK, URL_MISTRAL
+
+URLS_BASE = {
+    "DeepSeek": URL_DEEPSEEK,
+    "Mistral": URL_MISTRAL
+}
+
+# Cada cliente mantiene su propio pool de conexiones keep-alive; el número de
+# clientes también está acotado, así que los sockets abiertos por proceso tienen tope
+LIMITES_CONEXION = httpx.Limits(max_connections=20, max_keepalive_connections=10, keepalive_expiry=60)
+MAX_CLIENTES = 32
+
+# Los reintentos los gestiona resiliencia.py, por eso se desactivan los del SDK
+TIEMPO_ESPERA = httpx.Timeout(TIEMPO_ESPERA_SEGUNDOS, connect=TIEMPO_CONEXION_SEGUNDOS)
+
+def clase_cliente(proveedor, asincrono=False):
+    # Los SDK se importan la primera vez que se usa cada proveedor: cargar
+    # openai y mistralai al arrancar cuesta más de un segundo aunque la
+    # sesión solo use uno de ellos
+    if proveedor == "DeepSeek":
+        from openai import AsyncOpenAI, OpenAI
+        return AsyncOpenAI if asincrono else OpenAI
+    if proveedor == "Mistral":
+        from mistralai import Mistral
+        return Mistral
+    raise ValueError(f"Proveedor no soportado: {proveedor}")
+
+precargados = set()
+lock_precarga = threading.Lock()
+
+def precargar(proveedores):
+    # Importa en un hilo aparte los SDK de los proveedores configurados, para
+    # que la primera generación no espere a la importación
+    with lock_precarga:
+        pendientes = [proveedor for proveedor in proveedores if proveedor in URLS_BASE and proveedor not in precargados]
+        precargados.update(pendientes)
+    if pendientes:
+        threading.Thread(
+            target=lambda: [clase_cliente(proveedor) for proveedor in pendientes],
+            name="contelia-precarga", daemon=True
+        ).start()
+
+def huella_clave(api_key):
+    return hashlib.sha256((api_key or "").encode("utf-8")).hexdigest()[:16]
+
+class RegistroClientes:
+    def __init__(self, limites=LIMITES_CONEXION, max_clientes=MAX_CLIENTES):
+        self.limites = limites
+        self.max_clientes = max_clientes
+        self.clientes = OrderedDict()
+        self.lock = threading.Lock()
+
+    def crear(self, proveedor, api_key, base_url):
+        http_client = httpx.Client(limits=self.limites, timeout=TIEMPO_ESPERA)
+        try:
+            Cliente = clase_cliente(proveedor)
+            if proveedor == "DeepSeek":
+                cliente = Cliente(api_key=api_key, base_url=base_url, http_client=http_client, timeout=TIEMPO_ESPERA, max_retries=0)
+            else:
+                cliente = Cliente(api_key=api_key, server_url=base_url, client=http_client, timeout_ms=int(TIEMPO_ESPERA_SEGUNDOS * 1000))
+        except Exception:
+            http_client.close()
+            raise
+        return cliente, http_client
+
+    def obtener(self, proveedor, api_key, base_url=None):
+        base_url = base_url or URLS_BASE.get(proveedor)
+        clave = (proveedor, huella_clave(api_key), base_url)
+
+        with self.lock:
+            if clave in self.clientes:
+                self.clientes.move_to_end(clave)
+                return self.clientes[clave][0]
+
+        # La importación del SDK y la creación del cliente quedan fuera del
+        # lock para no bloquear a las sesiones que ya tienen el suyo; si otro
+        # hilo ha creado el mismo cliente entretanto, se usa el suyo
+        cliente, http_client = self.crear(proveedor, api_key, base_url)
+        with self.lock:
+            if clave in self.clientes:
+                self.clientes.move_to_end(clave)
+                existente = self.clientes[clave][0]
+            else:
+                self.clientes[clave] = (cliente, http_client)
+                existente = None
+                # Los clientes expulsados o descartados pueden estar a mitad
+                # de una petición en otro hilo: no se cierran aquí, el pool se
+                # libera cuando el recolector los recoge
+                while len(self.clientes) > self.max_clientes:
+                    self.clientes.popitem(last=False)
+        if existente is not None:
+            http_client.close()
+            return existente
+        return cliente
+
+    def descartar(self, proveedor, api_key=None):
+        huella = huella_clave(api_key) if api_key is not None else None
+
+        with self.lock:
+            claves = [
+                clave for clave in self.clientes
+                if clave[0] == proveedor and (huella is None or clave[1] == huella)
+            ]
+            for clave in claves:
+                del self.clientes[clave]
+        return len(claves)
+
+    def cerrar(self):
+        with self.lock:
+            for _, http_client in self.clientes.values():
+                http_client.close()
+            self.clientes.clear()
+
+# El módulo se importa una sola vez por proceso, por lo que el registro se
+# comparte entre reruns de Streamlit y entre sesiones
+registro = RegistroClientes()
+
+def obtener_cliente(proveedor, api_key, base_url=None):
+    return registro.obtener(proveedor, api_key, base_url)
+
+def descartar_cliente(proveedor, api_key=None):
+    return registro.descartar(proveedor, api_key)
@@ -0,0 +1,127 @@
+import json
+import os
+
+# Directorio local donde se guardan los datos persistentes de la aplicación
+DIRECTORIO_DATOS = os.environ.get("CONTELIA_DATOS", ".contelia")
+
+# Caché de respuestas
+CACHE_TTL_SEGUNDOS = int(os.environ.get("CONTELIA_CACHE_TTL", 7 * 24 * 3600))
+CACHE_MAX_BYTES = int(os.environ.get("CONTELIA_CACHE_MAX_BYTES", 50 * 1024 * 1024))
+CACHE_MAX_ENTRADAS = int(os.environ.get("CONTELIA_CACHE_MAX_ENTRADAS", 5000))
+
+# URL base de cada proveedor; se cambian para apuntar a un servidor compatible
+# (p. ej. proveedor_simulado.py en pruebas de carga)
+URL_DEEPSEEK = os.environ.get("CONTELIA_URL_DEEPSEEK", "https://api.deepseek.com")
+URL_MISTRAL = os.environ.get("CONTELIA_URL_MISTRAL", "https://api.mistral.ai")
+
+# Resiliencia de las llamadas a los proveedores
+TIEMPO_ESPERA_SEGUNDOS = float(os.environ.get("CONTELIA_TIMEOUT", 60))
+TIEMPO_CONEXION_SEGUNDOS = float(os.environ.get("CONTELIA_TIMEOUT_CONEXION", 5))
+REINTENTOS = int(os.environ.get("CONTELIA_REINTENTOS", 3))
+ESPERA_BASE_SEGUNDOS = float(os.environ.get("CONTELIA_ESPERA_BASE", 0.5))
+ESPERA_MAXIMA_SEGUNDOS = float(os.environ.get("CONTELIA_ESPERA_MAXIMA", 8))
+CIRCUITO_UMBRAL_FALLOS = int(os.environ.get("CONTELIA_CIRCUITO_FALLOS", 5))
+CIRCUITO_RECUPERACION_SEGUNDOS = float(os.environ.get("CONTELIA_CIRCUITO_RECUPERACION", 30))
+
+# Historial de generaciones
+HISTORIAL_BACKEND = os.environ.get("CONTELIA_HISTORIAL", "sqlite")
+HISTORIAL_MAX_POR_SESION = int(os.environ.get("CONTELIA_HISTORIAL_MAX", 500))
+HISTORIAL_DIAS_RETENCION = float(os.environ.get("CONTELIA_HISTORIAL_DIAS", 90))
+MAX_VERSIONES = int(os.environ.get("CONTELIA_MAX_VERSIONES", 20))
+# Cada cuántas versiones se guarda una copia completa; el resto se guardan como diferencias
+VERSIONES_INTERVALO_COMPLETA = int(os.environ.get("CONTELIA_VERSIONES_INTERVALO", 5))
+
+# Presupuesto de tokens por petición y precios (USD por millón de tokens;
+# entrada_cache es el precio de la entrada servida desde la caché de contexto)
+MAX_TOKENS_ENTRADA = int(os.environ.get("CONTELIA_MAX_TOKENS_ENTRADA", 16000))
+MAX_TOKENS_SALIDA = int(os.environ.get("CONTELIA_MAX_TOKENS_SALIDA", 4096))
+PRECIOS_MODELOS = {
+    "deepseek-chat": {"entrada": 0.27, "entrada_cache": 0.07, "salida": 1.10},
+    "deepseek-coder": {"entrada": 0.27, "entrada_cache": 0.07, "salida": 1.10},
+    "mistral-large-latest": {"entrada": 2.0, "salida": 6.0}
+}
+PRECIOS_MODELOS.update(json.loads(os.environ.get("CONTELIA_PRECIOS", "{}")))
+
+# Planificador de peticiones: límites por proveedor (todas las claves) y por clave de API
+LIMITES_PROVEEDOR = {
+    "DeepSeek": {"rpm": 300, "tpm": 1_000_000},
+    "Mistral": {"rpm": 120, "tpm": 500_000}
+}
+LIMITES_PROVEEDOR.update(json.loads(os.environ.get("CONTELIA_LIMITES_PROVEEDOR", "{}")))
+LIMITES_POR_CLAVE = {
+    "DeepSeek": {"rpm": 60, "tpm": 300_000},
+    "Mistral": {"rpm": 60, "tpm": 200_000}
+}
+LIMITES_POR_CLAVE.update(json.loads(os.environ.get("CONTELIA_LIMITES_POR_CLAVE", "{}")))
+# Tokens de salida que se reservan por petición, además de los de entrada estimados
+TOKENS_SALIDA_ESPERADOS = int(os.environ.get("CONTELIA_TOKENS_SALIDA_ESPERADOS", 1000))
+MAX_COLA = int(os.environ.get("CONTELIA_MAX_COLA", 200))
+TIEMPO_MAX_COLA_SEGUNDOS = float(os.environ.get("CONTELIA_TIEMPO_MAX_COLA", 120))
+
+# API HTTP (servidor_api.py)
+API_HOST = os.environ.get("CONTELIA_API_HOST", "127.0.0.1")
+API_PUERTO = int(os.environ.get("CONTELIA_API_PUERTO", 8600))
+# Si se define, las peticiones deben incluir "Authorization: Bearer <token>"
+API_TOKEN = os.environ.get("CONTELIA_API_TOKEN", "")
+# Hilos para las llamadas bloqueantes al núcleo (caché, proveedores, planificador)
+API_HILOS = int(os.environ.get("CONTELIA_API_HILOS", 32))
+API_MAX_CUERPO_BYTES = int(os.environ.get("CONTELIA_API_MAX_CUERPO", 1024 * 1024))
+# Tamaño máximo de la línea de petición y las cabeceras juntas
+API_MAX_CABECERAS_BYTES = int(os.environ.get("CONTELIA_API_MAX_CABECERAS", 16 * 1024))
+
+# Plantillas de prompts: archivo JSON o YAML opcional que sustituye a las
+# secciones por defecto de plantillas.py; se recarga al cambiar su fecha
+PLANTILLAS_RUTA = os.environ.get("CONTELIA_PLANTILLAS", "")
+PLANTILLAS_INTERVALO_RECARGA = float(os.environ.get("CONTELIA_PLANTILLAS_INTERVALO", 5))
+
+# Conversaciones de mejora de código: al superar el presupuesto, los turnos
+# antiguos se resumen y solo se conservan completos los más recientes
+CONVERSACION_MAX_TOKENS = int(os.environ.get("CONTELIA_CONVERSACION_MAX_TOKENS", MAX_TOKENS_ENTRADA * 3 // 4))
+CONVERSACION_TURNOS_RECIENTES = int(os.environ.get("CONTELIA_CONVERSACION_TURNOS", 1))
+# Observabilidad: con un puerto distinto de 0, cada proceso (p. ej. cada
+# worker de Streamlit) expone sus métricas en http://host:puerto/metricas
+METRICAS_HOST = os.environ.get("CONTELIA_METRICAS_HOST", "127.0.0.1")
+METRICAS_PUERTO = int(os.environ.get("CONTELIA_METRICAS_PUERTO", 0))
+# Registro estructurado: una línea JSON por etapa medida, con el id de petición
+LOG_JSON = os.environ.get("CONTELIA_LOG_JSON", "") == "1"
+# Permite perfilar con cProfile una única ejecución de la app desde la barra lateral
+PERFILADO = os.environ.get("CONTELIA_PERFILADO", "") == "1"
+
+# Reutilización de ideas parecidas (ideas_similares.py): similitud coseno
+# mínima entre temas y entre audiencias, candidatos que se muestran e ideas
+# que se conservan
+SIMILITUD_UMBRAL = float(os.environ.get("CONTELIA_SIMILITUD_UMBRAL", 0.8))
+SIMILITUD_UMBRAL_AUDIENCIA = float(os.environ.get("CONTELIA_SIMILITUD_UMBRAL_AUDIENCIA", 0.5))
+SIMILITUD_TOP_K = int(os.environ.get("CONTELIA_SIMILITUD_TOP_K", 3))
+SIMILITUD_MAX_ENTRADAS = int(os.environ.get("CONTELIA_SIMILITUD_MAX_ENTRADAS", 5000))
+# Grupos de palabras que se tratan como la misma al comparar temas, en JSON,
+# p. ej. [["principiante", "novato", "básico"], ["curso", "taller"]]
+SIMILITUD_SINONIMOS = json.loads(os.environ.get("CONTELIA_SIMILITUD_SINONIMOS", "[]"))
+
+# Generaciones en segundo plano (trabajos.py): hilos compartidos por todas las
+# sesiones, trabajos simultáneos por sesión y trabajos terminados que se conservan
+TRABAJOS_HILOS = int(os.environ.get("CONTELIA_TRABAJOS_HILOS", 16))
+TRABAJOS_MAX_ACTIVOS = int(os.environ.get("CONTELIA_TRABAJOS_MAX_ACTIVOS", 4))
+TRABAJOS_CONSERVAR = int(os.environ.get("CONTELIA_TRABAJOS_CONSERVAR", 20))
+TRABAJOS_RETENCION_SEGUNDOS = float(os.environ.get("CONTELIA_TRABAJOS_RETENCION", 3600))
+# Cada cuánto se refresca el panel de trabajos mientras hay alguno en curso
+TRABAJOS_INTERVALO_SEGUNDOS = float(os.environ.get("CONTELIA_TRABAJOS_INTERVALO", 1))
+
+# Generación para varias plataformas a la vez: reintentos de cada variante que
+# no cumple su límite de caracteres y llamadas simultáneas en el modo paralelo
+MULTIFORMATO_REINTENTOS = int(os.environ.get("CONTELIA_MULTIFORMATO_REINTENTOS", 2))
+MULTIFORMATO_HILOS = int(os.environ.get("CONTELIA_MULTIFORMATO_HILOS", 8))
+
+# Postprocesado del código generado (postprocesado.py): validaciones de
+# sintaxis que se recuerdan por huella del contenido
+VALIDACION_CACHE_ENTRADAS = int(os.environ.get("CONTELIA_VALIDACION_CACHE_ENTRADAS", 2048))
+
+# Memoria de las sesiones (memoria_sesiones.py): bytes de st.session_state por
+# sesión antes de mover a disco las entradas menos usadas, sesiones
+# simultáneas por worker (0 = sin límite) y segundos sin actividad tras los
+# que se olvida una sesión. La vista de memoria por sesión solo aparece con
+# CONTELIA_MEMORIA_ADMIN=1
+SESION_MAX_BYTES = int(os.environ.get("CONTELIA_SESION_MAX_BYTES", 8 * 1024 * 1024))
+SESIONES_MAX = int(os.environ.get("CONTELIA_SESIONES_MAX", 0))
+SESIONES_INACTIVIDAD_SEGUNDOS = float(os.environ.get("CONTELIA_SESIONES_INACTIVIDAD", 1800))
+MEMORIA_ADMIN = os.environ.get("CONTELIA_MEMORIA_ADMIN", "") == "1"
@@ -0,0 +1,66 @@
+import plantillas
+from configuracion import CONVERSACION_MAX_TOKENS, CONVERSACION_TURNOS_RECIENTES
+from historial import resumir
+from tokens import estimar_tokens_mensajes
+
+class Conversacion:
+    # Hilo de mejoras sobre un mismo código. El prompt de sistema, la tarea
+    # original y el código base van siempre primero y no cambian entre
+    # peticiones, y cada turno solo añade la instrucción nueva: los
+    # proveedores con caché de contexto (p. ej. DeepSeek) cobran ese prefijo
+    # como acierto de caché y lo procesan mucho más rápido
+    def __init__(self, sistema, tarea, codigo, lenguaje, max_tokens=CONVERSACION_MAX_TOKENS, recientes=CONVERSACION_TURNOS_RECIENTES):
+        self.sistema = sistema
+        self.tarea = tarea
+        self.codigo_base = codigo
+        self.lenguaje = lenguaje
+        self.max_tokens = max_tokens
+        self.recientes = recientes
+        self.aplicadas = []
+        self.turnos = []
+
+    @property
+    def codigo_actual(self):
+        return self.turnos[-1][1] if self.turnos else self.codigo_base
+
+    def prefijo(self):
+        tarea = self.tarea
+        if self.aplicadas:
+            mejoras = "\n".join(f"- {mejora}" for mejora in self.aplicadas)
+            tarea += "\n\n" + plantillas.actuales().render("conversacion_resumen", mejoras=mejoras)
+        return [
+            {"role": "system", "content": self.sistema},
+            {"role": "user", "content": tarea},
+            {"role": "assistant", "content": self.codigo_base}
+        ]
+
+    def mensajes(self, instruccion):
+        mensajes = self.prefijo()
+        for pedido, respuesta in self.turnos:
+            mensajes.append({"role": "user", "content": pedido})
+            mensajes.append({"role": "assistant", "content": respuesta})
+        mensajes.append({"role": "user", "content": instruccion})
+        return mensajes
+
+    def compactar(self, instruccion):
+        # Al superar el presupuesto, los turnos antiguos se pliegan de una vez
+        # en el prefijo (su último código pasa a ser el código base y sus
+        # instrucciones quedan resumidas), así el prefijo cambia solo en ese
+        # momento y vuelve a ser reutilizable en las siguientes mejoras
+        if estimar_tokens_mensajes(self.mensajes(instruccion)) > self.max_tokens:
+            self.plegar(len(self.turnos) - self.recientes)
+            while self.turnos and estimar_tokens_mensajes(self.mensajes(instruccion)) > self.max_tokens:
+                self.plegar(1)
+        return self.mensajes(instruccion)
+
+    def plegar(self, cantidad):
+        for pedido, respuesta in self.turnos[:max(cantidad, 0)]:
+            self.aplicadas.append(resumir(pedido.split("\n\n")[0]))
+            self.codigo_base = respuesta
+        del self.turnos[:max(cantidad, 0)]
+
+    def agregar(self, instruccion, respuesta):
+        self.turnos.append((instruccion, respuesta))
+
+    def tokens(self):
+        return estimar_tokens_mensajes(self.prefijo()), estimar_tokens_mensajes(self.mensajes(""))
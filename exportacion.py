@@ -0,0 +1,241 @@
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+import tempfile
+import unicodedata
+import zipfile
+from datetime import datetime, timezone
+from itertools import islice
+
+from cache_respuestas import clave_cache
+from configuracion import HISTORIAL_MAX_POR_SESION, HISTORIAL_DIAS_RETENCION
+
+# Exportación e importación en bloque del historial y de los resultados de
+# lotes. Los registros se leen y se escriben uno a uno sobre un archivo
+# temporal, así que exportar miles de entradas no construye el contenido
+# completo en memoria; al importar, las entradas vuelven al historial de la
+# sesión. Solo la línea de comandos (--cache), que usa el operador, las añade
+# también a la caché de respuestas, compartida por todas las sesiones, si se
+# conoce el proveedor
+
+COLUMNAS = ["id", "tipo", "creado", "proveedor", "tipo_contenido", "tema", "tipo_respuesta", "prompt", "resultado"]
+CAMPOS_TEXTO = ["tipo", "tipo_contenido", "proveedor", "tema", "tipo_respuesta", "prompt", "resultado"]
+TAMANO_BLOQUE = 500
+
+# Los resultados pueden superar el límite por defecto del módulo csv (128 KB)
+csv.field_size_limit(sys.maxsize)
+
+def fecha_iso(marca):
+    return datetime.fromtimestamp(marca, timezone.utc).isoformat()
+
+def leer_fecha(valor):
+    if valor in (None, ""):
+        return datetime.now(timezone.utc).timestamp()
+    if isinstance(valor, (int, float)):
+        return float(valor)
+    fecha = datetime.fromisoformat(valor)
+    if fecha.tzinfo is None:
+        fecha = fecha.replace(tzinfo=timezone.utc)
+    return fecha.timestamp()
+
+def registros_historial(historial, sesion, tipo=None, busqueda=None):
+    for entrada in historial.iterar(sesion, tipo, busqueda):
+        yield {**entrada, "creado": fecha_iso(entrada["creado"])}
+
+def registros_lote(ruta):
+    # Filas resueltas del archivo de salida de lotes.py, con el mismo prompt
+    # que se envió al proveedor
+    from nucleo import construir_prompt_contenido
+
+    with open(ruta, encoding="utf-8") as archivo:
+        for linea in archivo:
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                continue
+            if registro.get("error") or registro.get("resultado") is None:
+                continue
+            yield {
+                "id": registro["id"],
+                "tipo": registro["tipo_contenido"],
+                "proveedor": registro["proveedor"],
+                "tipo_contenido": registro["tipo_contenido"],
+                "tema": registro["tema"],
+                "tipo_respuesta": registro["tipo_respuesta"],
+                "prompt": construir_prompt_contenido(registro["tipo_contenido"], registro["tema"], registro["tipo_respuesta"]),
+                "resultado": registro["resultado"]
+            }
+
+def escribir_jsonl(registros, destino):
+    texto = io.TextIOWrapper(destino, encoding="utf-8", newline="\n")
+    for registro in registros:
+        texto.write(json.dumps(registro, ensure_ascii=False) + "\n")
+    texto.flush()
+    texto.detach()
+
+def escribir_csv(registros, destino):
+    # Con BOM para que Excel reconozca UTF-8
+    texto = io.TextIOWrapper(destino, encoding="utf-8-sig", newline="")
+    escritor = csv.DictWriter(texto, fieldnames=COLUMNAS, extrasaction="ignore")
+    escritor.writeheader()
+    escritor.writerows(registros)
+    texto.flush()
+    texto.detach()
+
+def nombre_archivo(texto):
+    texto = unicodedata.normalize("NFKD", texto.lower()).encode("ascii", "ignore").decode("ascii")
+    return re.sub(r"[^a-z0-9]+", "-", texto).strip("-")[:40] or "entrada"
+
+def escribir_markdown_zip(registros, destino):
+    # Un archivo Markdown por entrada, con los metadatos como front matter
+    with zipfile.ZipFile(destino, "w", zipfile.ZIP_DEFLATED) as archivo:
+        for numero, registro in enumerate(registros, 1):
+            metadatos = "".join(
+                f"{columna}: {json.dumps(registro[columna], ensure_ascii=False)}\n"
+                for columna in COLUMNAS if columna not in ("prompt", "resultado") and registro.get(columna) is not None
+            )
+            archivo.writestr(
+                f"{numero:05d}-{nombre_archivo(registro['tipo'])}.md",
+                f"---\n{metadatos}---\n\n{registro['resultado']}\n\n<!-- prompt:\n{registro['prompt'].replace('-->', '- ->')}\n-->\n"
+            )
+
+FORMATOS = {
+    "jsonl": (escribir_jsonl, "application/jsonl"),
+    "csv": (escribir_csv, "text/csv"),
+    "zip": (escribir_markdown_zip, "application/zip")
+}
+
+def exportar(registros, formato, destino=None):
+    # Sin destino se escribe en un archivo temporal, que se devuelve abierto
+    # para lectura desde el principio: st.download_button acepta un
+    # BufferedReader pero no el BufferedRandom de TemporaryFile
+    escribir, _ = FORMATOS[formato]
+    if destino is not None:
+        escribir(registros, destino)
+        return destino
+    temporal = tempfile.TemporaryFile()
+    escribir(registros, temporal)
+    temporal.seek(0)
+    return io.BufferedReader(temporal.detach())
+
+def filas_jsonl(texto):
+    for numero, linea in enumerate(texto, 1):
+        if linea.strip():
+            try:
+                yield numero, json.loads(linea)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"La línea {numero} no es JSON válido: {e}")
+
+def leer_registros(archivo, nombre):
+    # Recorre una exportación JSONL o CSV (o la salida de un lote) sin leerla
+    # entera; cada registro necesita al menos tipo o tipo_contenido y resultado
+    from nucleo import construir_prompt_contenido
+
+    texto = io.TextIOWrapper(archivo, encoding="utf-8-sig", newline="" if nombre.lower().endswith(".csv") else None)
+    if nombre.lower().endswith(".csv"):
+        lector = csv.DictReader(texto)
+        filas = ((lector.line_num, fila) for fila in lector)
+    else:
+        filas = filas_jsonl(texto)
+
+    for numero, fila in filas:
+        if not isinstance(fila, dict):
+            raise ValueError(f"La línea {numero} no es un objeto")
+        if fila.get("error"):
+            continue
+        tipo = fila.get("tipo") or fila.get("tipo_contenido")
+        if not tipo or not fila.get("resultado"):
+            raise ValueError(f"La línea {numero} no tiene tipo o resultado")
+        no_texto = [columna for columna in CAMPOS_TEXTO if fila.get(columna) is not None and not isinstance(fila[columna], str)]
+        if no_texto:
+            raise ValueError(f"La línea {numero} tiene campos que no son texto: {', '.join(no_texto)}")
+        try:
+            creado = leer_fecha(fila.get("creado"))
+        except (TypeError, ValueError):
+            raise ValueError(f"La línea {numero} tiene una fecha no válida: {fila['creado']!r}")
+        prompt = fila.get("prompt")
+        if not prompt and fila.get("tema") and fila.get("tipo_respuesta"):
+            prompt = construir_prompt_contenido(tipo, fila["tema"], fila["tipo_respuesta"])
+        yield {
+            **{columna: valor for columna, valor in fila.items() if columna in COLUMNAS and valor not in (None, "")},
+            "tipo": tipo,
+            "prompt": prompt or "",
+            "creado": creado
+        }
+
+def clave_registro(registro):
+    # Solo se puede reconstruir la clave de caché de contenido generado con
+    # un proveedor conocido, a partir del mismo prompt y las plantillas actuales
+    from nucleo import MODELOS_TEXTO, mensajes_texto
+
+    proveedor = registro.get("proveedor")
+    if proveedor not in MODELOS_TEXTO or not registro.get("tipo_contenido") or not registro["prompt"]:
+        return None
+    return clave_cache(proveedor, MODELOS_TEXTO[proveedor], mensajes_texto(registro["prompt"], registro["tipo_contenido"]))
+
+def importar(registros, historial, sesion, cache=None):
+    # Se procesa por bloques: cada uno es una transacción en el historial y
+    # en la caché. La retención del historial (entradas por sesión y días)
+    # puede descartar lo importado, incluso lo de bloques anteriores, así que
+    # al final se cuenta lo que se ha conservado
+    totales = {"leidos": 0, "historial": 0, "descartados": 0, "cache": 0}
+    insertadas = []
+    registros = iter(registros)
+    while True:
+        bloque = list(islice(registros, TAMANO_BLOQUE))
+        if not bloque:
+            totales["historial"] = historial.conservadas(sesion, insertadas)
+            totales["descartados"] = len(insertadas) - totales["historial"]
+            return totales
+        totales["leidos"] += len(bloque)
+        insertadas += historial.importar(sesion, bloque)
+        if cache is not None:
+            respuestas = [(clave, registro["resultado"]) for registro in bloque for clave in [clave_registro(registro)] if clave]
+            if respuestas:
+                cache.guardar_varias(respuestas)
+                totales["cache"] += len(respuestas)
+
+def main(argumentos=None):
+    from cache_respuestas import obtener_cache
+    from historial import obtener_historial
+
+    parser = argparse.ArgumentParser(description="Exportación e importación en bloque del historial y de los resultados de lotes")
+    subcomandos = parser.add_subparsers(dest="accion", required=True)
+    exportacion = subcomandos.add_parser("exportar", help="Exporta el historial de una sesión o el resultado de un lote")
+    exportacion.add_argument("salida", help="Archivo de destino, o - para la salida estándar")
+    exportacion.add_argument("--formato", choices=list(FORMATOS), default="jsonl")
+    origen = exportacion.add_mutually_exclusive_group(required=True)
+    origen.add_argument("--sesion", help="Identificador de la sesión (cookie contelia_sesion de la app)")
+    origen.add_argument("--lote", help="Archivo JSONL de resultados generado por lotes.py")
+    exportacion.add_argument("--tipo", help="Exporta solo las entradas de este tipo")
+    importacion = subcomandos.add_parser("importar", help="Importa una exportación JSONL o CSV al historial de una sesión")
+    importacion.add_argument("entrada")
+    importacion.add_argument("--sesion", required=True)
+    importacion.add_argument("--cache", action="store_true", help="Añade también los resultados a la caché de respuestas")
+    args = parser.parse_args(argumentos)
+
+    if args.accion == "exportar":
+        registros = registros_lote(args.lote) if args.lote else registros_historial(obtener_historial(), args.sesion, args.tipo)
+        if args.salida == "-":
+            exportar(registros, args.formato, sys.stdout.buffer)
+        else:
+            with open(args.salida, "wb") as salida:
+                exportar(registros, args.formato, salida)
+        return 0
+
+    with open(args.entrada, "rb") as entrada:
+        try:
+            totales = importar(leer_registros(entrada, args.entrada), obtener_historial(), args.sesion, obtener_cache() if args.cache else None)
+        except (ValueError, KeyError) as e:
+            print(f"Archivo no válido: {e}", file=sys.stderr)
+            return 1
+    print(f"{totales['leidos']} registros leídos, {totales['historial']} añadidos al historial, {totales['cache']} a la caché", file=sys.stderr)
+    if totales["descartados"]:
+        print(f"{totales['descartados']} no se conservaron por la retención del historial ({HISTORIAL_MAX_POR_SESION} entradas por sesión, {HISTORIAL_DIAS_RETENCION} días)", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
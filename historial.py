@@ -0,0 +1,313 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from configuracion import DIRECTORIO_DATOS, HISTORIAL_BACKEND, HISTORIAL_MAX_POR_SESION, HISTORIAL_DIAS_RETENCION
+
+LONGITUD_RESUMEN = 200
+
+def resumir(texto, longitud=LONGITUD_RESUMEN):
+    texto = " ".join((texto or "").split())
+    return texto if len(texto) <= longitud else texto[:longitud - 1] + "…"
+
+def huella(tipo, prompt, resultado):
+    # Identifica el contenido de una entrada para no duplicarla al importar
+    return hashlib.sha1("\0".join((tipo, prompt, resultado)).encode("utf-8")).hexdigest()
+
+class HistorialMemoria:
+    # Backend sin persistencia, útil para pruebas o despliegues sin disco
+    def __init__(self, max_por_sesion=HISTORIAL_MAX_POR_SESION, dias_retencion=HISTORIAL_DIAS_RETENCION):
+        self.max_por_sesion = max_por_sesion
+        self.dias_retencion = dias_retencion
+        self.entradas = {}
+        self.siguiente_id = 1
+        self.lock = threading.Lock()
+
+    def agregar(self, sesion, tipo, prompt, resultado):
+        with self.lock:
+            identificador = self.siguiente_id
+            self.siguiente_id += 1
+            self.entradas[identificador] = {
+                "id": identificador, "sesion": sesion, "tipo": tipo, "creado": time.time(),
+                "prompt": prompt, "resultado": resultado, "resumen": resumir(resultado)
+            }
+            self.aplicar_retencion(sesion)
+            return identificador
+
+    def filtrar(self, sesion, tipo=None, busqueda=None):
+        busqueda = (busqueda or "").lower()
+        return [
+            entrada for entrada in self.entradas.values()
+            if entrada["sesion"] == sesion
+            and (not tipo or entrada["tipo"] == tipo)
+            and (not busqueda or busqueda in entrada["prompt"].lower() or busqueda in entrada["resultado"].lower())
+        ]
+
+    def contar(self, sesion, tipo=None, busqueda=None):
+        with self.lock:
+            return len(self.filtrar(sesion, tipo, busqueda))
+
+    def listar(self, sesion, pagina=0, tamano=10, tipo=None, busqueda=None):
+        with self.lock:
+            entradas = sorted(self.filtrar(sesion, tipo, busqueda), key=lambda entrada: entrada["id"], reverse=True)
+            return [
+                {clave: entrada[clave] for clave in ("id", "tipo", "creado", "resumen")}
+                for entrada in entradas[pagina * tamano:(pagina + 1) * tamano]
+            ]
+
+    def obtener(self, sesion, identificador):
+        with self.lock:
+            entrada = self.entradas.get(identificador)
+            return dict(entrada) if entrada and entrada["sesion"] == sesion else None
+
+    def tipos(self, sesion):
+        with self.lock:
+            return sorted({entrada["tipo"] for entrada in self.entradas.values() if entrada["sesion"] == sesion})
+
+    def eliminar(self, sesion, identificador):
+        with self.lock:
+            if identificador in self.entradas and self.entradas[identificador]["sesion"] == sesion:
+                del self.entradas[identificador]
+
+    def iterar(self, sesion, tipo=None, busqueda=None):
+        with self.lock:
+            entradas = sorted(self.filtrar(sesion, tipo, busqueda), key=lambda entrada: entrada["id"])
+        for entrada in entradas:
+            yield {clave: entrada[clave] for clave in ("id", "tipo", "creado", "prompt", "resultado")}
+
+    def importar(self, sesion, entradas):
+        # Devuelve los ids insertados; las entradas ya presentes (mismo tipo,
+        # prompt y resultado) no se duplican
+        with self.lock:
+            existentes = {(entrada["tipo"], entrada["prompt"], entrada["resultado"]) for entrada in self.entradas.values() if entrada["sesion"] == sesion}
+            insertadas = []
+            for entrada in entradas:
+                if (entrada["tipo"], entrada["prompt"], entrada["resultado"]) in existentes:
+                    continue
+                identificador = self.siguiente_id
+                self.siguiente_id += 1
+                self.entradas[identificador] = {
+                    "id": identificador, "sesion": sesion, "tipo": entrada["tipo"], "creado": entrada["creado"],
+                    "prompt": entrada["prompt"], "resultado": entrada["resultado"], "resumen": resumir(entrada["resultado"])
+                }
+                existentes.add((entrada["tipo"], entrada["prompt"], entrada["resultado"]))
+                insertadas.append(identificador)
+            self.aplicar_retencion(sesion)
+            return insertadas
+
+    def conservadas(self, sesion, identificadores):
+        # Cuántas de estas entradas siguen en el historial tras la retención
+        with self.lock:
+            return sum(1 for identificador in identificadores if identificador in self.entradas)
+
+    def aplicar_retencion(self, sesion):
+        # Como en SQLite: primero las caducadas y después las más antiguas que sobren
+        limite = time.time() - self.dias_retencion * 86400
+        propias = []
+        for entrada in sorted(self.entradas.values(), key=lambda entrada: entrada["id"]):
+            if entrada["sesion"] != sesion:
+                continue
+            if entrada["creado"] < limite:
+                del self.entradas[entrada["id"]]
+            else:
+                propias.append(entrada)
+        for entrada in propias[:max(len(propias) - self.max_por_sesion, 0)]:
+            del self.entradas[entrada["id"]]
+
+class HistorialSQLite:
+    def __init__(self, ruta=None, max_por_sesion=HISTORIAL_MAX_POR_SESION, dias_retencion=HISTORIAL_DIAS_RETENCION):
+        if ruta is None:
+            os.makedirs(DIRECTORIO_DATOS, exist_ok=True)
+            ruta = os.path.join(DIRECTORIO_DATOS, "historial.sqlite")
+        self.max_por_sesion = max_por_sesion
+        self.dias_retencion = dias_retencion
+        self.lock = threading.Lock()
+
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self.conexion.row_factory = sqlite3.Row
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.executescript("""
+            CREATE TABLE IF NOT EXISTS historial (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                sesion TEXT NOT NULL,
+                tipo TEXT NOT NULL,
+                creado REAL NOT NULL,
+                resumen TEXT NOT NULL,
+                prompt TEXT NOT NULL,
+                resultado TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_historial_sesion ON historial (sesion, id);
+        """)
+        self.migrar()
+        self.busqueda_completa = self.crear_indice_texto()
+        self.conexion.commit()
+
+    def migrar(self):
+        # Huella del contenido para detectar duplicados al importar con un
+        # índice; los historiales creados antes de la columna se completan una vez
+        columnas = [fila[1] for fila in self.conexion.execute("PRAGMA table_info(historial)")]
+        if "huella" not in columnas:
+            self.conexion.execute("ALTER TABLE historial ADD COLUMN huella TEXT")
+            self.conexion.executemany(
+                "UPDATE historial SET huella = ? WHERE id = ?",
+                [(huella(tipo, prompt, resultado), identificador) for identificador, tipo, prompt, resultado in self.conexion.execute("SELECT id, tipo, prompt, resultado FROM historial").fetchall()]
+            )
+        self.conexion.execute("CREATE INDEX IF NOT EXISTS idx_historial_huella ON historial (sesion, huella)")
+
+    def crear_indice_texto(self):
+        # Búsqueda de texto completo con FTS5 si la versión de SQLite lo incluye
+        try:
+            self.conexion.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS historial_fts USING fts5(
+                    prompt, resultado, content='historial', content_rowid='id'
+                );
+                CREATE TRIGGER IF NOT EXISTS historial_ai AFTER INSERT ON historial BEGIN
+                    INSERT INTO historial_fts (rowid, prompt, resultado) VALUES (new.id, new.prompt, new.resultado);
+                END;
+                CREATE TRIGGER IF NOT EXISTS historial_ad AFTER DELETE ON historial BEGIN
+                    INSERT INTO historial_fts (historial_fts, rowid, prompt, resultado) VALUES ('delete', old.id, old.prompt, old.resultado);
+                END;
+            """)
+            return True
+        except sqlite3.OperationalError:
+            return False
+
+    def agregar(self, sesion, tipo, prompt, resultado):
+        with self.lock:
+            cursor = self.conexion.execute(
+                "INSERT INTO historial (sesion, tipo, creado, resumen, prompt, resultado, huella) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (sesion, tipo, time.time(), resumir(resultado), prompt, resultado, huella(tipo, prompt, resultado))
+            )
+            self.aplicar_retencion(sesion)
+            self.conexion.commit()
+            return cursor.lastrowid
+
+    def condiciones(self, sesion, tipo, busqueda):
+        sql = ["h.sesion = ?"]
+        parametros = [sesion]
+        if tipo:
+            sql.append("h.tipo = ?")
+            parametros.append(tipo)
+        if busqueda:
+            if self.busqueda_completa:
+                # Cada palabra se busca como prefijo y entre comillas para evitar la sintaxis de FTS
+                consulta = " ".join('"' + palabra.replace('"', '""') + '"*' for palabra in busqueda.split())
+                sql.append("h.id IN (SELECT rowid FROM historial_fts WHERE historial_fts MATCH ?)")
+                parametros.append(consulta)
+            else:
+                sql.append("(h.prompt LIKE ? OR h.resultado LIKE ?)")
+                parametros += [f"%{busqueda}%"] * 2
+        return " AND ".join(sql), parametros
+
+    def contar(self, sesion, tipo=None, busqueda=None):
+        where, parametros = self.condiciones(sesion, tipo, busqueda)
+        with self.lock:
+            return self.conexion.execute(f"SELECT COUNT(*) FROM historial h WHERE {where}", parametros).fetchone()[0]
+
+    def listar(self, sesion, pagina=0, tamano=10, tipo=None, busqueda=None):
+        # Solo se leen las columnas ligeras; el texto completo se carga con obtener()
+        where, parametros = self.condiciones(sesion, tipo, busqueda)
+        with self.lock:
+            filas = self.conexion.execute(
+                f"SELECT h.id, h.tipo, h.creado, h.resumen FROM historial h WHERE {where} ORDER BY h.id DESC LIMIT ? OFFSET ?",
+                parametros + [tamano, pagina * tamano]
+            ).fetchall()
+        return [dict(fila) for fila in filas]
+
+    def obtener(self, sesion, identificador):
+        with self.lock:
+            fila = self.conexion.execute(
+                "SELECT id, tipo, creado, resumen, prompt, resultado FROM historial WHERE id = ? AND sesion = ?",
+                (identificador, sesion)
+            ).fetchone()
+        return dict(fila) if fila else None
+
+    def tipos(self, sesion):
+        with self.lock:
+            filas = self.conexion.execute(
+                "SELECT DISTINCT tipo FROM historial WHERE sesion = ? ORDER BY tipo", (sesion,)
+            ).fetchall()
+        return [fila[0] for fila in filas]
+
+    def eliminar(self, sesion, identificador):
+        with self.lock:
+            self.conexion.execute("DELETE FROM historial WHERE id = ? AND sesion = ?", (identificador, sesion))
+            self.conexion.commit()
+
+    def iterar(self, sesion, tipo=None, busqueda=None, bloque=200):
+        # Todas las entradas con el texto completo, en orden de creación y
+        # leídas por bloques para no cargar el historial entero
+        where, parametros = self.condiciones(sesion, tipo, busqueda)
+        ultimo = 0
+        while True:
+            with self.lock:
+                filas = self.conexion.execute(
+                    f"SELECT h.id, h.tipo, h.creado, h.prompt, h.resultado FROM historial h WHERE {where} AND h.id > ? ORDER BY h.id LIMIT ?",
+                    parametros + [ultimo, bloque]
+                ).fetchall()
+            for fila in filas:
+                yield dict(fila)
+            if len(filas) < bloque:
+                return
+            ultimo = filas[-1]["id"]
+
+    def importar(self, sesion, entradas):
+        # Inserta en una sola transacción y en el orden recibido y devuelve
+        # los ids insertados; las entradas ya presentes (misma huella) no se
+        # duplican al importar dos veces el mismo archivo
+        with self.lock:
+            insertadas = []
+            for entrada in entradas:
+                contenido = huella(entrada["tipo"], entrada["prompt"], entrada["resultado"])
+                cursor = self.conexion.execute(
+                    """INSERT INTO historial (sesion, tipo, creado, resumen, prompt, resultado, huella)
+                    SELECT ?, ?, ?, ?, ?, ?, ? WHERE NOT EXISTS (
+                        SELECT 1 FROM historial WHERE sesion = ? AND huella = ?
+                    )""",
+                    (sesion, entrada["tipo"], entrada["creado"], resumir(entrada["resultado"]), entrada["prompt"], entrada["resultado"], contenido,
+                     sesion, contenido)
+                )
+                if cursor.rowcount:
+                    insertadas.append(cursor.lastrowid)
+            self.aplicar_retencion(sesion)
+            self.conexion.commit()
+            return insertadas
+
+    def conservadas(self, sesion, identificadores, bloque=500):
+        # Cuántas de estas entradas siguen en el historial tras la retención
+        total = 0
+        with self.lock:
+            for inicio in range(0, len(identificadores), bloque):
+                parte = identificadores[inicio:inicio + bloque]
+                total += self.conexion.execute(
+                    f"SELECT COUNT(*) FROM historial WHERE sesion = ? AND id IN ({','.join('?' * len(parte))})",
+                    [sesion] + parte
+                ).fetchone()[0]
+        return total
+
+    def aplicar_retencion(self, sesion):
+        self.conexion.execute(
+            "DELETE FROM historial WHERE sesion = ? AND creado < ?",
+            (sesion, time.time() - self.dias_retencion * 86400)
+        )
+        self.conexion.execute(
+            "DELETE FROM historial WHERE sesion = ? AND id NOT IN (SELECT id FROM historial WHERE sesion = ? ORDER BY id DESC LIMIT ?)",
+            (sesion, sesion, self.max_por_sesion)
+        )
+
+BACKENDS = {
+    "sqlite": HistorialSQLite,
+    "memoria": HistorialMemoria
+}
+
+historial = None
+lock_historial = threading.Lock()
+
+def obtener_historial():
+    global historial
+    with lock_historial:
+        if historial is None:
+            historial = BACKENDS[HISTORIAL_BACKEND]()
+        return historial
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+import zlib
+
+import numpy as np
+
+from configuracion import (
+    DIRECTORIO_DATOS, SIMILITUD_UMBRAL, SIMILITUD_UMBRAL_AUDIENCIA, SIMILITUD_TOP_K, SIMILITUD_MAX_ENTRADAS, SIMILITUD_SINONIMOS
+)
+
+# Índice local de ideas ya generadas para reutilizar resultados de temas
+# parecidos ("cursos de python para principiantes" / "curso de Python para
+# principiantes") que la caché exacta de respuestas no detecta. Cada tema se
+# representa con n-gramas de caracteres en un vector de tamaño fijo (hashing
+# trick), así que no hace falta un modelo de embeddings; la búsqueda es un
+# producto matricial con NumPy sobre las ideas del mismo objetivo. Tema y
+# audiencia se comparan por separado: si compartieran vector, una audiencia
+# larga y común haría parecidos temas que no tienen nada que ver
+
+DIMENSION = 1024
+LONGITUD_NGRAMA = 3
+PALABRAS_VACIAS = set("""
+    a al como con de del el en la las lo los mi mis o para por que se sin sobre su sus tu tus un una unos unas y
+""".split())
+def singular(palabra):
+    return palabra[:-1] if len(palabra) > 3 and palabra.endswith("s") else palabra
+
+def palabras(texto):
+    # Minúsculas, sin tildes y en singular, para que "Python básico" y
+    # "python basicos" coincidan
+    texto = unicodedata.normalize("NFKD", (texto or "").lower())
+    texto = "".join(caracter for caracter in texto if not unicodedata.combining(caracter))
+    return [singular(palabra) for palabra in re.findall(r"\w+", texto) if palabra not in PALABRAS_VACIAS]
+
+# Sinónimos configurados por el operador (CONTELIA_SIMILITUD_SINONIMOS): cada
+# palabra de un grupo se reduce a la primera, ya normalizada
+SINONIMOS = {
+    palabra: palabras(grupo[0])[0]
+    for grupo in SIMILITUD_SINONIMOS if grupo and palabras(grupo[0])
+    for termino in grupo for palabra in palabras(termino)
+}
+
+def normalizar(texto):
+    return [SINONIMOS.get(palabra, palabra) for palabra in palabras(texto)]
+
+def vectorizar(texto, dimension=DIMENSION):
+    vector = np.zeros(dimension, dtype=np.float32)
+    for palabra in normalizar(texto):
+        # Los espacios marcan el inicio y el final de la palabra
+        palabra = f" {palabra} "
+        for inicio in range(max(len(palabra) - LONGITUD_NGRAMA + 1, 1)):
+            vector[zlib.crc32(palabra[inicio:inicio + LONGITUD_NGRAMA].encode("utf-8")) % dimension] += 1
+    # Frecuencias amortiguadas y norma 1: el producto escalar es el coseno
+    np.log1p(vector, out=vector)
+    norma = np.linalg.norm(vector)
+    return vector / norma if norma else vector
+
+def huella(resultado):
+    return hashlib.sha1(resultado.encode("utf-8")).hexdigest()
+
+class GrupoObjetivo:
+    # Vectores de tema y de audiencia de un mismo objetivo en dos matrices
+    # que crecen por bloques
+    def __init__(self, dimension):
+        self.temas = np.zeros((16, dimension), dtype=np.float32)
+        self.audiencias = np.zeros((16, dimension), dtype=np.float32)
+        self.ids = []
+
+    def agregar(self, identificador, tema, audiencia):
+        if len(self.ids) == len(self.temas):
+            self.temas = np.concatenate([self.temas, np.zeros_like(self.temas)])
+            self.audiencias = np.concatenate([self.audiencias, np.zeros_like(self.audiencias)])
+        self.temas[len(self.ids)] = tema
+        self.audiencias[len(self.ids)] = audiencia
+        self.ids.append(identificador)
+
+    def buscar(self, tema, audiencia, k, umbral, umbral_audiencia):
+        # Las k ideas con el tema más parecido entre las que también tienen
+        # una audiencia parecida; una audiencia vacía, en la consulta o en la
+        # idea guardada, vale para cualquiera
+        if not self.ids:
+            return []
+        similitudes = self.temas[:len(self.ids)] @ tema
+        if audiencia.any():
+            guardadas = self.audiencias[:len(self.ids)]
+            audiencias = np.where(guardadas.any(axis=1), guardadas @ audiencia, 1.0)
+        else:
+            audiencias = np.ones(len(self.ids), dtype=np.float32)
+        validas = np.flatnonzero((similitudes >= umbral) & (audiencias >= umbral_audiencia))
+        if not len(validas):
+            return []
+        mejores = validas[np.argsort(-similitudes[validas], kind="stable")[:k]]
+        return [(self.ids[indice], float(similitudes[indice])) for indice in mejores]
+
+class IndiceIdeas:
+    def __init__(self, ruta=None, max_entradas=SIMILITUD_MAX_ENTRADAS, dimension=DIMENSION):
+        if ruta is None:
+            os.makedirs(DIRECTORIO_DATOS, exist_ok=True)
+            ruta = os.path.join(DIRECTORIO_DATOS, "ideas.sqlite")
+        self.max_entradas = max_entradas
+        self.dimension = dimension
+        self.lock = threading.Lock()
+        self.grupos = None
+
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("""
+            CREATE TABLE IF NOT EXISTS ideas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                objetivo TEXT NOT NULL,
+                tema TEXT NOT NULL,
+                audiencia TEXT NOT NULL,
+                proveedor TEXT NOT NULL,
+                resultado TEXT NOT NULL,
+                creado REAL NOT NULL
+            )
+        """)
+        self.migrar()
+        self.conexion.commit()
+
+    def migrar(self):
+        # Huella del resultado para no indexar dos veces la misma idea (p. ej.
+        # servida desde la caché de respuestas); los índices creados antes de
+        # esta columna se completan una sola vez
+        columnas = [fila[1] for fila in self.conexion.execute("PRAGMA table_info(ideas)")]
+        if "huella" not in columnas:
+            self.conexion.execute("ALTER TABLE ideas ADD COLUMN huella TEXT")
+            self.conexion.executemany(
+                "UPDATE ideas SET huella = ? WHERE id = ?",
+                [(huella(resultado), identificador) for identificador, resultado in self.conexion.execute("SELECT id, resultado FROM ideas").fetchall()]
+            )
+        self.conexion.execute("CREATE INDEX IF NOT EXISTS idx_ideas_huella ON ideas (objetivo, huella)")
+
+    def cargar(self):
+        # Los vectores no se guardan: se recalculan al primer uso en el proceso
+        if self.grupos is not None:
+            return
+        self.grupos = {}
+        for identificador, objetivo, tema, audiencia in self.conexion.execute("SELECT id, objetivo, tema, audiencia FROM ideas ORDER BY id"):
+            self.grupo(objetivo).agregar(identificador, vectorizar(tema, self.dimension), vectorizar(audiencia, self.dimension))
+
+    def grupo(self, objetivo):
+        if objetivo not in self.grupos:
+            self.grupos[objetivo] = GrupoObjetivo(self.dimension)
+        return self.grupos[objetivo]
+
+    def agregar(self, tema, audiencia, objetivo, proveedor, resultado):
+        # Devuelve None si la misma idea ya estaba en el índice
+        with self.lock:
+            self.cargar()
+            if self.conexion.execute("SELECT 1 FROM ideas WHERE objetivo = ? AND huella = ?", (objetivo, huella(resultado))).fetchone():
+                return None
+            cursor = self.conexion.execute(
+                "INSERT INTO ideas (objetivo, tema, audiencia, proveedor, resultado, creado, huella) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (objetivo, tema, audiencia, proveedor, resultado, time.time(), huella(resultado))
+            )
+            self.grupo(objetivo).agregar(cursor.lastrowid, vectorizar(tema, self.dimension), vectorizar(audiencia, self.dimension))
+            sobrantes = self.conexion.execute("SELECT COUNT(*) FROM ideas").fetchone()[0] - self.max_entradas
+            if sobrantes > 0:
+                # Se eliminan las más antiguas y el índice se reconstruye en el siguiente uso
+                self.conexion.execute("DELETE FROM ideas WHERE id IN (SELECT id FROM ideas ORDER BY id LIMIT ?)", (sobrantes,))
+                self.grupos = None
+            self.conexion.commit()
+            return cursor.lastrowid
+
+    def buscar(self, tema, audiencia, objetivo, umbral=SIMILITUD_UMBRAL, k=SIMILITUD_TOP_K, umbral_audiencia=SIMILITUD_UMBRAL_AUDIENCIA):
+        # Las k ideas del mismo objetivo con similitud coseno del tema >= umbral
+        # y de la audiencia >= umbral_audiencia
+        vector_tema = vectorizar(tema, self.dimension)
+        vector_audiencia = vectorizar(audiencia, self.dimension)
+        with self.lock:
+            self.cargar()
+            grupo = self.grupos.get(objetivo)
+            candidatos = grupo.buscar(vector_tema, vector_audiencia, k, umbral, umbral_audiencia) if grupo else []
+            if not candidatos:
+                return []
+            filas = {
+                fila[0]: fila for fila in self.conexion.execute(
+                    f"SELECT id, tema, audiencia, proveedor, resultado, creado FROM ideas WHERE id IN ({','.join('?' * len(candidatos))})",
+                    [identificador for identificador, _ in candidatos]
+                )
+            }
+        return [
+            {
+                "id": identificador, "tema": filas[identificador][1], "audiencia": filas[identificador][2],
+                "proveedor": filas[identificador][3], "resultado": filas[identificador][4],
+                "creado": filas[identificador][5], "similitud": similitud
+            }
+            for identificador, similitud in candidatos if identificador in filas
+        ]
+
+indice = None
+lock_indice = threading.Lock()
+
+def obtener_indice():
+    global indice
+    with lock_indice:
+        if indice is None:
+            indice = IndiceIdeas()
+        return indice
@@ -0,0 +1,172 @@
+import argparse
+import csv
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+COLUMNAS_REQUERIDAS = ["tema", "tipo_contenido", "tipo_respuesta"]
+PROVEEDOR_POR_DEFECTO = "DeepSeek"
+
+class LimitadorFrecuencia:
+    # Reparte las peticiones de un proveedor de forma uniforme dentro del minuto
+    def __init__(self, peticiones_por_minuto):
+        self.intervalo = 60.0 / peticiones_por_minuto if peticiones_por_minuto else 0
+        self.siguiente = 0.0
+        self.lock = threading.Lock()
+
+    def esperar(self):
+        if not self.intervalo:
+            return
+        with self.lock:
+            ahora = time.monotonic()
+            turno = max(ahora, self.siguiente)
+            self.siguiente = turno + self.intervalo
+        if turno > ahora:
+            time.sleep(turno - ahora)
+
+def leer_filas(contenido, nombre):
+    if isinstance(contenido, bytes):
+        contenido = contenido.decode("utf-8-sig")
+
+    if nombre.lower().endswith((".jsonl", ".ndjson")):
+        filas = []
+        for linea in contenido.splitlines():
+            if linea.strip():
+                try:
+                    filas.append(json.loads(linea))
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"La fila {len(filas) + 1} no es JSON válido: {e}")
+    else:
+        filas = list(csv.DictReader(io.StringIO(contenido)))
+
+    for numero, fila in enumerate(filas, 1):
+        if not isinstance(fila, dict):
+            raise ValueError(f"La fila {numero} no es un objeto")
+        faltantes = [columna for columna in COLUMNAS_REQUERIDAS if not fila.get(columna)]
+        if faltantes:
+            raise ValueError(f"La fila {numero} no tiene valor para: {', '.join(faltantes)}")
+        fila["proveedor"] = fila.get("proveedor") or PROVEEDOR_POR_DEFECTO
+        no_texto = [columna for columna in COLUMNAS_REQUERIDAS + ["proveedor"] if not isinstance(fila[columna], str)]
+        if no_texto:
+            raise ValueError(f"La fila {numero} tiene columnas que no son texto: {', '.join(no_texto)}")
+    return filas
+
+def id_fila(indice, fila):
+    contenido = json.dumps([fila[columna] for columna in COLUMNAS_REQUERIDAS + ["proveedor"]], ensure_ascii=False)
+    return f"{indice}-{hashlib.sha1(contenido.encode('utf-8')).hexdigest()[:10]}"
+
+def leer_completadas(ruta_salida):
+    # Filas ya resueltas en una ejecución anterior (punto de control)
+    completadas = set()
+    if not os.path.exists(ruta_salida):
+        return completadas
+    with open(ruta_salida, encoding="utf-8") as archivo:
+        for linea in archivo:
+            try:
+                registro = json.loads(linea)
+            except json.JSONDecodeError:
+                # Última línea truncada por una caída
+                continue
+            if not registro.get("error"):
+                completadas.add(registro["id"])
+    return completadas
+
+def procesar_lote(filas, ruta_salida, generar, concurrencia=4, limites_rpm=None):
+    limites_rpm = limites_rpm or {}
+    limitadores = {proveedor: LimitadorFrecuencia(rpm) for proveedor, rpm in limites_rpm.items()}
+    completadas = leer_completadas(ruta_salida)
+    pendientes = [
+        (id_fila(indice, fila), indice, fila)
+        for indice, fila in enumerate(filas)
+        if id_fila(indice, fila) not in completadas
+    ]
+
+    def ejecutar(identificador, indice, fila):
+        limitador = limitadores.get(fila["proveedor"])
+        if limitador:
+            limitador.esperar()
+        inicio = time.monotonic()
+        registro = {"id": identificador, "fila": indice, **fila}
+        try:
+            registro["resultado"] = generar(fila)
+            registro["error"] = None
+        except Exception as e:
+            registro["resultado"] = None
+            registro["error"] = str(e)
+        registro["duracion"] = round(time.monotonic() - inicio, 3)
+        return registro
+
+    directorio = os.path.dirname(ruta_salida)
+    if directorio:
+        os.makedirs(directorio, exist_ok=True)
+
+    # Se mantienen como mucho 2 * concurrencia tareas enviadas para no
+    # cargar en memoria todo el lote de golpe
+    with open(ruta_salida, "a", encoding="utf-8") as salida, ThreadPoolExecutor(max_workers=concurrencia) as ejecutor:
+        restantes = iter(pendientes)
+        en_curso = set()
+        while True:
+            for tarea in restantes:
+                en_curso.add(ejecutor.submit(ejecutar, *tarea))
+                if len(en_curso) >= 2 * concurrencia:
+                    break
+            if not en_curso:
+                break
+
+            terminadas, en_curso = wait(en_curso, return_when=FIRST_COMPLETED)
+            for futuro in terminadas:
+                registro = futuro.result()
+                salida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                salida.flush()
+                yield registro
+
+def parsear_limites(valores):
+    limites = {}
+    for valor in valores or []:
+        proveedor, _, rpm = valor.partition("=")
+        limites[proveedor] = float(rpm)
+    return limites
+
+def main(argumentos=None):
+    from nucleo import construir_prompt_contenido, generar_texto, claves_entorno
+    from tokens import contabilidad
+
+    parser = argparse.ArgumentParser(description="Generación de contenido por lotes desde CSV o JSONL")
+    parser.add_argument("entrada", help="Archivo CSV o JSONL con columnas tema, tipo_contenido, tipo_respuesta y proveedor")
+    parser.add_argument("salida", help="Archivo JSONL de resultados; si existe se reanuda desde el último punto de control")
+    parser.add_argument("--concurrencia", type=int, default=4)
+    parser.add_argument("--rpm", action="append", metavar="PROVEEDOR=N", help="Peticiones por minuto por proveedor, p. ej. DeepSeek=60")
+    parser.add_argument("--ignorar-cache", action="store_true")
+    parser.add_argument("--respaldo", action="store_true", help="Usar el otro proveedor configurado si el de la fila falla")
+    args = parser.parse_args(argumentos)
+
+    claves = claves_entorno()
+
+    def generar(fila):
+        prompt = construir_prompt_contenido(fila["tipo_contenido"], fila["tema"], fila["tipo_respuesta"])
+        return generar_texto(prompt, fila["proveedor"], fila["tipo_contenido"], claves, args.ignorar_cache, args.respaldo, "cli")
+
+    with open(args.entrada, "rb") as archivo:
+        try:
+            filas = leer_filas(archivo.read(), args.entrada)
+        except ValueError as e:
+            print(f"Archivo no válido: {e}", file=sys.stderr)
+            return 1
+
+    errores = 0
+    for registro in procesar_lote(filas, args.salida, generar, args.concurrencia, parsear_limites(args.rpm)):
+        estado = "ERROR" if registro["error"] else "OK"
+        errores += bool(registro["error"])
+        print(f"[{estado}] fila {registro['fila']} ({registro['duracion']} s)", file=sys.stderr)
+    
+    for proveedor, agregado in contabilidad.resumen_proveedores().items():
+        print(f"{proveedor}: {agregado['llamadas']} llamadas, {agregado['entrada']} tokens de entrada, {agregado['salida']} de salida, ${agregado['coste']:.4f}", file=sys.stderr)
+    return 1 if errores else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
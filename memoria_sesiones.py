@@ -0,0 +1,273 @@
+import os
+import pickle
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from configuracion import (
+    DIRECTORIO_DATOS, SESION_MAX_BYTES, SESIONES_MAX, SESIONES_INACTIVIDAD_SEGUNDOS
+)
+from observabilidad import metricas
+
+# Memoria de las sesiones de Streamlit dentro de un worker. Cada sesión tiene
+# un tope de bytes en st.session_state: al superarlo, las entradas grandes
+# que no se han usado en la ejecución actual (versiones, comparaciones,
+# conversaciones) pasan a disco por orden de último uso y vuelven a memoria
+# al pedirlas. Con el tope por sesión y el máximo de sesiones, la memoria del
+# worker queda acotada. Streamlit libera el estado de las sesiones que se
+# desconectan; aquí solo se olvida su registro y lo que tuvieran en disco
+# cuando llevan inactivas más que el plazo de reconexión de Streamlit y ya no
+# tienen conexión abierta
+
+INTERVALO_LIMPIEZA_SEGUNDOS = 60
+
+def sesion_activa(sesion):
+    # True si la sesión tiene la conexión abierta; None si no hay runtime,
+    # p. ej. en modo bare
+    from streamlit import runtime
+
+    if not runtime.exists():
+        return None
+    return runtime.get_instance().is_active_session(sesion)
+
+def plazo_reconexion():
+    # Segundos que Streamlit conserva una sesión desconectada por si el
+    # navegador vuelve; pasado ese plazo ya no se puede reanudar
+    import streamlit as st
+
+    try:
+        return st.get_option("server.disconnectedSessionTTL")
+    except RuntimeError:
+        return 0
+
+def tamano(valor):
+    # Estimación de los bytes que ocupa un objeto con todo lo que contiene;
+    # cada objeto se cuenta una sola vez aunque aparezca varias veces
+    vistos = set()
+    pendientes = [valor]
+    total = 0
+    while pendientes:
+        objeto = pendientes.pop()
+        if id(objeto) in vistos:
+            continue
+        vistos.add(id(objeto))
+        total += sys.getsizeof(objeto)
+        if isinstance(objeto, (str, bytes, bytearray, int, float, bool, type(None))):
+            continue
+        if isinstance(objeto, dict):
+            pendientes.extend(objeto.keys())
+            pendientes.extend(objeto.values())
+        elif isinstance(objeto, (list, tuple, set, frozenset)):
+            pendientes.extend(objeto)
+        else:
+            if hasattr(objeto, "__dict__"):
+                pendientes.append(vars(objeto))
+            for atributo in getattr(type(objeto), "__slots__", ()):
+                if hasattr(objeto, atributo):
+                    pendientes.append(getattr(objeto, atributo))
+    return total
+
+class DepositoDisco:
+    # Entradas de sesión movidas a disco, serializadas con pickle: solo se
+    # leen objetos que escribió este mismo proceso
+    def __init__(self, ruta=None):
+        if ruta is None:
+            os.makedirs(DIRECTORIO_DATOS, exist_ok=True)
+            ruta = os.path.join(DIRECTORIO_DATOS, "sesiones.sqlite")
+        self.lock = threading.Lock()
+        self.conexion = sqlite3.connect(ruta, check_same_thread=False, timeout=10)
+        self.conexion.execute("PRAGMA journal_mode=WAL")
+        self.conexion.execute("""
+            CREATE TABLE IF NOT EXISTS entradas (
+                sesion TEXT NOT NULL,
+                clave TEXT NOT NULL,
+                datos BLOB NOT NULL,
+                guardado REAL NOT NULL,
+                PRIMARY KEY (sesion, clave)
+            )
+        """)
+        self.conexion.commit()
+
+    def guardar(self, sesion, clave, valor):
+        datos = pickle.dumps(valor, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.conexion.execute(
+                "INSERT OR REPLACE INTO entradas (sesion, clave, datos, guardado) VALUES (?, ?, ?, ?)",
+                (sesion, clave, datos, time.time())
+            )
+            self.conexion.commit()
+        return len(datos)
+
+    def sacar(self, sesion, clave):
+        with self.lock:
+            fila = self.conexion.execute("SELECT datos FROM entradas WHERE sesion = ? AND clave = ?", (sesion, clave)).fetchone()
+            self.conexion.execute("DELETE FROM entradas WHERE sesion = ? AND clave = ?", (sesion, clave))
+            self.conexion.commit()
+        return pickle.loads(fila[0]) if fila else None
+
+    def descartar(self, sesion, claves):
+        with self.lock:
+            self.conexion.executemany("DELETE FROM entradas WHERE sesion = ? AND clave = ?", [(sesion, clave) for clave in claves])
+            self.conexion.commit()
+
+    def eliminar(self, sesiones):
+        with self.lock:
+            self.conexion.executemany("DELETE FROM entradas WHERE sesion = ?", [(sesion,) for sesion in sesiones])
+            self.conexion.commit()
+
+    def eliminar_antiguas(self, limite):
+        # Entradas de procesos anteriores o de sesiones que ya no existen
+        with self.lock:
+            self.conexion.execute("DELETE FROM entradas WHERE guardado < ?", (limite,))
+            self.conexion.commit()
+
+class RegistroSesion:
+    __slots__ = ("inicio", "ultimo_acceso", "memoria", "por_clave", "usos", "en_disco")
+
+    def __init__(self):
+        self.inicio = time.time()
+        self.ultimo_acceso = self.inicio
+        self.memoria = 0
+        # Bytes de cada entrada del estado en la última revisión
+        self.por_clave = {}
+        # Último uso de las entradas que pueden ir a disco
+        self.usos = {}
+        # Entradas en disco y sus bytes serializados
+        self.en_disco = {}
+
+class GestorMemoria:
+    def __init__(self, max_bytes=SESION_MAX_BYTES, max_sesiones=SESIONES_MAX, inactividad=SESIONES_INACTIVIDAD_SEGUNDOS):
+        self.max_bytes = max_bytes
+        self.max_sesiones = max_sesiones
+        self.inactividad = inactividad
+        self.sesiones = OrderedDict()
+        self.deposito = None
+        self.limpiado = 0.0
+        self.lock = threading.Lock()
+
+    def obtener_deposito(self):
+        with self.lock:
+            if self.deposito is None:
+                self.deposito = DepositoDisco()
+                self.deposito.eliminar_antiguas(time.time() - self.inactividad)
+            return self.deposito
+
+    def entrar(self, sesion):
+        # Se llama al empezar cada ejecución; devuelve False si el worker ya
+        # atiende el máximo de sesiones y esta es nueva
+        self.limpiar()
+        with self.lock:
+            registro = self.sesiones.get(sesion)
+            if registro is None:
+                if self.max_sesiones and len(self.sesiones) >= self.max_sesiones:
+                    return False
+                registro = self.sesiones[sesion] = RegistroSesion()
+            registro.ultimo_acceso = time.time()
+            self.sesiones.move_to_end(sesion)
+            return True
+
+    def recuperar(self, sesion, estado, clave):
+        # Acceso a una entrada que puede estar en disco; la marca como usada
+        with self.lock:
+            registro = self.sesiones.get(sesion)
+            if registro is None:
+                return estado.get(clave)
+            registro.usos[clave] = time.time()
+            en_disco = registro.en_disco.pop(clave, None) is not None
+        if en_disco:
+            valor = self.obtener_deposito().sacar(sesion, clave)
+            # Si la app ya la había vuelto a escribir, la copia de disco sobra
+            if valor is not None and clave not in estado:
+                estado[clave] = valor
+        return estado.get(clave)
+
+    def revisar(self, sesion, estado, en_uso=()):
+        # Al final de cada ejecución: mide el estado de la sesión y, si supera
+        # el tope, mueve a disco las entradas menos usadas que no se han
+        # tocado en esta ejecución. Los objetos de en_uso (los que modifica un
+        # trabajo en segundo plano) no se mueven: el trabajo seguiría
+        # escribiendo en una copia que ya no está en la sesión
+        en_uso = {id(objeto) for objeto in en_uso}
+        por_clave = {clave: tamano(estado[clave]) for clave in list(estado.keys())}
+        with self.lock:
+            registro = self.sesiones.get(sesion)
+            if registro is None:
+                return
+            candidatas = sorted(
+                (uso, clave) for clave, uso in registro.usos.items()
+                if uso < registro.ultimo_acceso and clave in por_clave
+            )
+            sustituidas = [clave for clave in registro.en_disco if clave in por_clave]
+            for clave in sustituidas:
+                del registro.en_disco[clave]
+        if sustituidas:
+            self.obtener_deposito().descartar(sesion, sustituidas)
+        memoria = sum(por_clave.values())
+        for _, clave in candidatas:
+            if not self.max_bytes or memoria <= self.max_bytes:
+                break
+            if id(estado[clave]) in en_uso:
+                continue
+            bytes_disco = self.obtener_deposito().guardar(sesion, clave, estado[clave])
+            del estado[clave]
+            memoria -= por_clave.pop(clave)
+            with self.lock:
+                registro.en_disco[clave] = bytes_disco
+        with self.lock:
+            registro.memoria = memoria
+            registro.por_clave = por_clave
+
+    def limpiar(self):
+        ahora = time.time()
+        with self.lock:
+            if ahora - self.limpiado < INTERVALO_LIMPIEZA_SEGUNDOS:
+                return
+            self.limpiado = ahora
+        # Una sesión desconectada puede reconectarse dentro del plazo de
+        # Streamlit, así que nunca se olvida antes; una pestaña abierta sin
+        # interacción sigue siendo una sesión viva y conserva lo que tenga en disco
+        inactividad = max(self.inactividad, plazo_reconexion())
+        with self.lock:
+            inactivas = [sesion for sesion, registro in self.sesiones.items() if ahora - registro.ultimo_acceso > inactividad]
+        inactivas = [sesion for sesion in inactivas if not sesion_activa(sesion)]
+        with self.lock:
+            # Las que hayan vuelto a ejecutarse entretanto se conservan
+            inactivas = [sesion for sesion in inactivas if sesion in self.sesiones and ahora - self.sesiones[sesion].ultimo_acceso > inactividad]
+            con_disco = [sesion for sesion in inactivas if self.sesiones[sesion].en_disco]
+            for sesion in inactivas:
+                del self.sesiones[sesion]
+        if con_disco:
+            self.obtener_deposito().eliminar(con_disco)
+
+    def resumen(self):
+        ahora = time.time()
+        with self.lock:
+            return sorted((
+                {
+                    "sesion": sesion,
+                    "memoria": registro.memoria,
+                    "disco": sum(registro.en_disco.values()),
+                    "entradas": len(registro.por_clave),
+                    "mayores": sorted(registro.por_clave.items(), key=lambda par: -par[1])[:3],
+                    "inactiva": ahora - registro.ultimo_acceso,
+                    "duracion": ahora - registro.inicio
+                }
+                for sesion, registro in self.sesiones.items()
+            ), key=lambda sesion: -sesion["memoria"])
+
+# Compartido por todas las sesiones del proceso, igual que el gestor de trabajos
+gestor = GestorMemoria()
+
+def metricas_sesiones():
+    resumen = gestor.resumen()
+    return [
+        ("contelia_sesiones", "gauge", "Sesiones registradas en el worker", [({}, len(resumen))]),
+        ("contelia_sesiones_bytes", "gauge", "Bytes del estado de las sesiones por ubicación", [
+            ({"ubicacion": "memoria"}, sum(sesion["memoria"] for sesion in resumen)),
+            ({"ubicacion": "disco"}, sum(sesion["disco"] for sesion in resumen))
+        ])
+    ]
+
+metricas.registrar_colector(metricas_sesiones)
@@ -0,0 +1,434 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from cache_respuestas import obtener_cache, clave_cache
+from clientes import obtener_cliente
+from conversaciones import Conversacion
+from configuracion import MAX_TOKENS_SALIDA, MULTIFORMATO_REINTENTOS, MULTIFORMATO_HILOS
+from observabilidad import medir, observar
+from planificador import planificador
+import plantillas
+import postprocesado
+import proveedores_async
+from resiliencia import (
+    ErrorGeneracion, circuito, llamar_con_reintentos, transmitir_con_reintentos,
+    con_respaldo, transmitir_con_respaldo
+)
+from tokens import registrar_uso, verificar_presupuesto, estimar_tokens_mensajes
+
+# Núcleo de generación sin dependencias de Streamlit: lo usan la interfaz
+# (app.py), el procesado por lotes (lotes.py) y la API HTTP (servidor_api.py)
+
+PROVEEDORES = ["DeepSeek", "Mistral"]
+
+MODELOS_TEXTO = {
+    "DeepSeek": "deepseek-chat",
+    "Mistral": "mistral-large-latest"
+}
+
+MODELOS_CODIGO = {
+    "DeepSeek": "deepseek-coder",
+    "Mistral": "mistral-large-latest"
+}
+
+def claves_entorno():
+    return {proveedor: os.environ.get(f"{proveedor.upper()}_API_KEY", "") for proveedor in PROVEEDORES}
+
+def conectar_api(proveedor, api_key):
+    with medir("cliente", proveedor=proveedor):
+        return obtener_cliente(proveedor, api_key)
+
+def crear_completado(cliente, proveedor, modelo, mensajes, sesion=None, tipo=""):
+    with medir("envio", proveedor=proveedor, modelo=modelo, tipo=tipo):
+        if proveedor == "Mistral":
+            respuesta = cliente.chat.complete(model=modelo, messages=mensajes, max_tokens=MAX_TOKENS_SALIDA)
+        else:
+            respuesta = cliente.chat.completions.create(model=modelo, messages=mensajes, max_tokens=MAX_TOKENS_SALIDA, stream=False)
+    registrar_uso(sesion, proveedor, modelo, respuesta.usage)
+    return respuesta.choices[0].message.content
+
+def transmitir_completado(cliente, proveedor, modelo, mensajes, sesion=None, tipo=""):
+    # Generador de fragmentos de texto a medida que llegan del proveedor; el
+    # envío se mide hasta recibir las cabeceras de la respuesta
+    with medir("envio", proveedor=proveedor, modelo=modelo, tipo=tipo):
+        if proveedor == "Mistral":
+            respuesta = cliente.chat.stream(model=modelo, messages=mensajes, max_tokens=MAX_TOKENS_SALIDA)
+        else:
+            respuesta = cliente.chat.completions.create(
+                model=modelo, messages=mensajes, max_tokens=MAX_TOKENS_SALIDA,
+                stream=True, stream_options={"include_usage": True}
+            )
+
+    # El consumo llega en el último fragmento del stream
+    uso = None
+    partes = []
+    try:
+        # Al cerrar el generador (p. ej. al detener la ejecución) se cierra la conexión
+        with respuesta:
+            for evento in respuesta:
+                fragmento = evento.data if proveedor == "Mistral" else evento
+                uso = getattr(fragmento, "usage", None) or uso
+                if not fragmento.choices:
+                    continue
+                contenido = fragmento.choices[0].delta.content
+                if isinstance(contenido, str) and contenido:
+                    partes.append(contenido)
+                    yield contenido
+    finally:
+        registrar_uso(sesion, proveedor, modelo, uso, mensajes, "".join(partes))
+
+def mensajes_texto(prompt, tipo_contenido):
+    return [
+        {"role": "system", "content": plantillas.actuales().sistema_texto(tipo_contenido)},
+        {"role": "user", "content": prompt}
+    ]
+
+def mensajes_codigo(descripcion, lenguaje):
+    actuales = plantillas.actuales()
+    return [
+        {"role": "system", "content": actuales.sistema_codigo(lenguaje)},
+        {"role": "user", "content": actuales.render("mensaje_codigo", lenguaje=lenguaje, descripcion=descripcion)}
+    ]
+
+def mensajes_reparacion(lenguaje, codigo, error):
+    actuales = plantillas.actuales()
+    return [
+        {"role": "system", "content": actuales.sistema_codigo(lenguaje)},
+        {"role": "user", "content": actuales.render("reparar_codigo", lenguaje=lenguaje, error=error, codigo=codigo)}
+    ]
+
+def construir_prompt_contenido(tipo_contenido, prompt_base, tipo_respuesta):
+    return plantillas.actuales().render("contenido", tipo_contenido=tipo_contenido, tema=prompt_base, tipo_respuesta=tipo_respuesta)
+
+def mensajes_multiformato(tema, tipo_respuesta, tipos_contenido):
+    actuales = plantillas.actuales()
+    formatos = []
+    for tipo_contenido in tipos_contenido:
+        formato = actuales.render("multiformato_formato", tipo_contenido=tipo_contenido, indicaciones=actuales.sistema_texto(tipo_contenido))
+        maximo = actuales.max_caracteres(tipo_contenido)
+        if maximo:
+            formato += actuales.render("multiformato_limite", maximo=maximo)
+        formatos.append(formato)
+    return [
+        {"role": "system", "content": actuales.sistema_multiformato()},
+        {"role": "user", "content": actuales.render("multiformato", formatos="\n".join(formatos), tema=tema, tipo_respuesta=tipo_respuesta)}
+    ]
+
+def mensajes_correccion(tipo_contenido, texto):
+    actuales = plantillas.actuales()
+    return [
+        {"role": "system", "content": actuales.sistema_texto(tipo_contenido)},
+        {"role": "user", "content": actuales.render(
+            "corregir_longitud", tipo_contenido=tipo_contenido, longitud=len(texto),
+            maximo=actuales.max_caracteres(tipo_contenido), texto=texto
+        )}
+    ]
+
+def construir_prompt_ideas(tema_ideas, audiencia, objetivo):
+    return plantillas.actuales().render("ideas", tema=tema_ideas, audiencia=audiencia, objetivo=objetivo)
+
+def construir_prompt_codigo(lenguaje, descripcion, solo_codigo=False, opciones=()):
+    actuales = plantillas.actuales()
+    prompt_completo = actuales.render("codigo", lenguaje=lenguaje, descripcion=descripcion)
+
+    if solo_codigo:
+        return prompt_completo + actuales.render("codigo_solo")
+
+    prompt_completo += actuales.render("codigo_incluye")
+    if "comentarios" not in opciones:
+        prompt_completo += actuales.render("codigo_sin_comentarios")
+    for opcion, texto in actuales.opciones_codigo.items():
+        if opcion in opciones:
+            prompt_completo += texto
+    return prompt_completo
+
+def construir_prompt_mejora(tipo_mejora, lenguaje, codigo, indicaciones=""):
+    actuales = plantillas.actuales()
+    if tipo_mejora == "personalizada":
+        return actuales.render("mejora_personalizada", lenguaje=lenguaje, codigo=codigo, indicaciones=indicaciones)
+
+    mejora = actuales.mejoras_codigo[tipo_mejora]
+    instruccion = mejora["instruccion"]
+    if indicaciones:
+        instruccion += actuales.render("mejora_indicaciones", indicaciones=indicaciones)
+    return actuales.render("mejora", encabezado=mejora["encabezado"].format(lenguaje=lenguaje), codigo=codigo, instruccion=instruccion)
+
+def construir_turno_mejora(tipo_mejora, lenguaje, indicaciones=""):
+    # Instrucción de un turno de conversación: el código ya va en los mensajes anteriores
+    actuales = plantillas.actuales()
+    if tipo_mejora == "personalizada":
+        return actuales.render("mejora_turno_personalizada", lenguaje=lenguaje, indicaciones=indicaciones)
+
+    instruccion = actuales.mejoras_codigo[tipo_mejora]["instruccion"]
+    if indicaciones:
+        instruccion += actuales.render("mejora_indicaciones", indicaciones=indicaciones)
+    return actuales.render("mejora_turno", instruccion=instruccion, lenguaje=lenguaje)
+
+def iniciar_conversacion(descripcion, lenguaje, codigo):
+    # El prefijo coincide con los mensajes de la generación inicial, así que
+    # la primera mejora ya reutiliza la caché de contexto del proveedor
+    sistema, tarea = mensajes_codigo(descripcion, lenguaje)
+    return Conversacion(sistema["content"], tarea["content"], codigo, lenguaje)
+
+def orden_proveedores(proveedor, claves, respaldo):
+    # Con respaldo activo, si el proveedor elegido falla se prueba con los demás configurados
+    if not respaldo:
+        return [proveedor]
+    return [proveedor] + [otro for otro in PROVEEDORES if otro != proveedor and claves.get(otro)]
+
+def esperar_turno(sesion, proveedor, api_key, mensajes, al_esperar):
+    with medir("cola", proveedor=proveedor):
+        planificador.adquirir(sesion, proveedor, api_key, estimar_tokens_mensajes(mensajes), al_esperar)
+
+def con_turno(sesion, proveedor, api_key, mensajes, al_esperar, funcion):
+    # Cada intento espera su turno en el planificador compartido por todas las sesiones
+    esperar_turno(sesion, proveedor, api_key, mensajes, al_esperar)
+    return funcion()
+
+def transmitir_con_turno(sesion, proveedor, api_key, mensajes, al_esperar, crear_stream):
+    esperar_turno(sesion, proveedor, api_key, mensajes, al_esperar)
+    yield from crear_stream()
+
+def completar(proveedor, modelos, mensajes, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None, tipo=""):
+    verificar_presupuesto(mensajes)
+
+    def llamar(proveedor_actual):
+        api_key = claves.get(proveedor_actual, '')
+        cliente = conectar_api(proveedor_actual, api_key)
+        modelo = modelos[proveedor_actual]
+        with medir("completado", proveedor=proveedor_actual, modelo=modelo, tipo=tipo, cache="fallo") as etiquetas:
+            resultado, en_cache = obtener_cache().obtener_o_generar(
+                clave_cache(proveedor_actual, modelo, mensajes),
+                lambda: llamar_con_reintentos(proveedor_actual, lambda: con_turno(
+                    sesion, proveedor_actual, api_key, mensajes, al_esperar,
+                    lambda: crear_completado(cliente, proveedor_actual, modelo, mensajes, sesion, tipo)
+                )),
+                ignorar_cache
+            )
+            if en_cache:
+                etiquetas["cache"] = "acierto"
+        return resultado
+
+    return con_respaldo(orden_proveedores(proveedor, claves, respaldo), llamar)
+
+def transmitir(proveedor, modelos, mensajes, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None, tipo=""):
+    verificar_presupuesto(mensajes)
+
+    def crear_stream(proveedor_actual):
+        api_key = claves.get(proveedor_actual, '')
+        cliente = conectar_api(proveedor_actual, api_key)
+        modelo = modelos[proveedor_actual]
+        inicio = time.perf_counter()
+        # Si la caché responde, el stream del proveedor no llega a crearse
+        origen = {"cache": "acierto"}
+
+        def generar_stream():
+            origen["cache"] = "fallo"
+            return transmitir_con_reintentos(proveedor_actual, lambda: transmitir_con_turno(
+                sesion, proveedor_actual, api_key, mensajes, al_esperar,
+                lambda: transmitir_completado(cliente, proveedor_actual, modelo, mensajes, sesion, tipo)
+            ))
+
+        with medir("completado", proveedor=proveedor_actual, modelo=modelo, tipo=tipo) as etiquetas:
+            try:
+                primero = True
+                for fragmento in obtener_cache().transmitir(clave_cache(proveedor_actual, modelo, mensajes), generar_stream, ignorar_cache):
+                    if primero:
+                        primero = False
+                        observar(time.perf_counter() - inicio, etapa="primer_token", proveedor=proveedor_actual, modelo=modelo, tipo=tipo, cache=origen["cache"])
+                    yield fragmento
+            finally:
+                etiquetas["cache"] = origen["cache"]
+
+    yield from transmitir_con_respaldo(orden_proveedores(proveedor, claves, respaldo), crear_stream)
+
+def generar_texto(prompt, proveedor, tipo_contenido, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    return completar(proveedor, MODELOS_TEXTO, mensajes_texto(prompt, tipo_contenido), claves, ignorar_cache, respaldo, sesion, al_esperar, tipo_contenido)
+
+def generar_texto_stream(prompt, proveedor, tipo_contenido, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    yield from transmitir(proveedor, MODELOS_TEXTO, mensajes_texto(prompt, tipo_contenido), claves, ignorar_cache, respaldo, sesion, al_esperar, tipo_contenido)
+
+def generar_codigo(descripcion, proveedor, lenguaje, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    return completar(proveedor, MODELOS_CODIGO, mensajes_codigo(descripcion, lenguaje), claves, ignorar_cache, respaldo, sesion, al_esperar, f"Código {lenguaje}")
+
+def generar_codigo_stream(descripcion, proveedor, lenguaje, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    yield from transmitir(proveedor, MODELOS_CODIGO, mensajes_codigo(descripcion, lenguaje), claves, ignorar_cache, respaldo, sesion, al_esperar, f"Código {lenguaje}")
+
+def revisar_codigo(texto, proveedor, lenguaje, claves, solo_codigo=False, reparar=True, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    # Con "solo código" se queda solo con los bloques de código. Si la
+    # sintaxis no es válida se hace una única petición de reparación con el
+    # bloque que falla y su error, y la respuesta se usa solo si ya es válida.
+    # Devuelve {"resultado", "error", "reparado"}
+    # Solo se valida el código de bloques ```: con "solo código", lo extraído
+    # de ellos; una respuesta sin bloques puede ser solo prosa
+    es_codigo = False
+    if solo_codigo:
+        es_codigo = bool(postprocesado.extraer_bloques(texto))
+        texto = postprocesado.extraer_codigo(texto, lenguaje)
+    fallo = postprocesado.validar_respuesta(texto, lenguaje, es_codigo)
+    if fallo is None:
+        return {"resultado": texto, "error": None, "reparado": False}
+    codigo, error = fallo
+    if not reparar:
+        return {"resultado": texto, "error": error, "reparado": False}
+
+    try:
+        respuesta = completar(
+            proveedor, MODELOS_CODIGO, mensajes_reparacion(lenguaje, codigo, error),
+            claves, ignorar_cache, respaldo, sesion, al_esperar, f"Reparación {lenguaje}"
+        )
+    except ErrorGeneracion:
+        return {"resultado": texto, "error": error, "reparado": False}
+    reparado = postprocesado.extraer_codigo(respuesta, lenguaje)
+    if postprocesado.validar(reparado, lenguaje):
+        return {"resultado": texto, "error": error, "reparado": False}
+
+    if codigo.strip("\n") == texto.strip("\n"):
+        return {"resultado": reparado, "error": None, "reparado": True}
+    return {"resultado": texto.replace(codigo, reparado + "\n", 1), "error": None, "reparado": True}
+
+def generar_mejora(conversacion, instruccion, proveedor, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    resultado = completar(proveedor, MODELOS_CODIGO, conversacion.compactar(instruccion), claves, ignorar_cache, respaldo, sesion, al_esperar, f"Código {conversacion.lenguaje}")
+    conversacion.agregar(instruccion, resultado)
+    return resultado
+
+def generar_mejora_stream(conversacion, instruccion, proveedor, claves, ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None):
+    partes = []
+    for fragmento in transmitir(proveedor, MODELOS_CODIGO, conversacion.compactar(instruccion), claves, ignorar_cache, respaldo, sesion, al_esperar, f"Código {conversacion.lenguaje}"):
+        partes.append(fragmento)
+        yield fragmento
+    # Un stream cortado a medias no se añade a la conversación
+    conversacion.agregar(instruccion, "".join(partes))
+
+def generar_en_paralelo(modo, modelos, mensajes, claves, ignorar_cache=False, sesion=None, al_esperar=None, tipo=""):
+    # modo "carrera": la primera respuesta correcta; modo "comparar": todas las respuestas
+    verificar_presupuesto(mensajes)
+    cache = obtener_cache()
+    resultados = []
+    solicitudes = []
+    for proveedor in PROVEEDORES:
+        # Los proveedores sin clave o con el circuito abierto no participan
+        if not claves.get(proveedor) or circuito(proveedor).estado() == "abierto":
+            continue
+        respuesta = None if ignorar_cache else cache.obtener(clave_cache(proveedor, modelos[proveedor], mensajes))
+        if respuesta is not None:
+            resultados.append({"proveedor": proveedor, "resultado": respuesta, "error": None, "duracion": 0.0})
+            observar(0.0, etapa="completado", proveedor=proveedor, modelo=modelos[proveedor], tipo=tipo, cache="acierto")
+        else:
+            solicitudes.append((proveedor, claves[proveedor], modelos[proveedor], mensajes, sesion))
+
+    if not resultados and not solicitudes:
+        raise ErrorGeneracion("Ningún proveedor configurado está disponible en este momento")
+
+    if modo == "carrera" and resultados:
+        # Una respuesta en caché gana la carrera sin llamar a ningún proveedor
+        return resultados[:1]
+
+    for solicitud in solicitudes:
+        esperar_turno(sesion, solicitud[0], solicitud[1], mensajes, al_esperar)
+
+    if modo == "carrera":
+        try:
+            resultados = [{**proveedores_async.ejecutar(proveedores_async.carrera(solicitudes)), "error": None}]
+        except proveedores_async.ErrorCarrera as e:
+            raise ErrorGeneracion(str(e)) from e
+        generados = resultados
+    else:
+        generados = proveedores_async.ejecutar(proveedores_async.comparar(solicitudes)) if solicitudes else []
+        resultados += generados
+
+    for resultado in generados:
+        # El error llega como texto desde proveedores_async, sin su clase
+        observar(
+            resultado["duracion"], etapa="completado", proveedor=resultado["proveedor"], modelo=modelos[resultado["proveedor"]],
+            tipo=tipo, cache="fallo", error="ErrorGeneracion" if resultado["error"] else ""
+        )
+
+    for resultado in resultados:
+        if resultado["error"] is None:
+            cache.guardar(clave_cache(resultado["proveedor"], modelos[resultado["proveedor"]], mensajes), resultado["resultado"])
+    return resultados
+
+def extraer_variantes(respuesta, tipos_contenido):
+    # Los modelos a veces envuelven el JSON en un bloque ``` o añaden texto
+    # alrededor; las variantes que falten o no sean texto se generan aparte
+    inicio, fin = respuesta.find("{"), respuesta.rfind("}")
+    try:
+        datos = json.loads(respuesta[inicio:fin + 1]) if 0 <= inicio < fin else {}
+    except ValueError:
+        datos = {}
+    if not isinstance(datos, dict):
+        return {}
+    return {
+        tipo_contenido: datos[tipo_contenido].strip() for tipo_contenido in tipos_contenido
+        if isinstance(datos.get(tipo_contenido), str) and datos[tipo_contenido].strip()
+    }
+
+def validar_variante(tipo_contenido, texto):
+    maximo = plantillas.actuales().max_caracteres(tipo_contenido)
+    if maximo and len(texto) > maximo:
+        return f"Tiene {len(texto)} caracteres y el máximo para {tipo_contenido} es {maximo}"
+    return None
+
+def en_paralelo(funcion, elementos):
+    # Cada hilo recibe una copia del contexto para conservar el id de la petición en las métricas
+    if not elementos:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(MULTIFORMATO_HILOS, len(elementos))) as ejecutor:
+        futuros = {elemento: ejecutor.submit(contextvars.copy_context().run, funcion, elemento) for elemento in elementos}
+        return {elemento: futuro.result() for elemento, futuro in futuros.items()}
+
+def generar_multiformato(tema, tipo_respuesta, tipos_contenido, proveedor, claves, estrategia="json", ignorar_cache=False, respaldo=False, sesion=None, al_esperar=None, reintentos=MULTIFORMATO_REINTENTOS):
+    # Un mismo brief para varios tipos de contenido. Con la estrategia "json"
+    # una sola completación devuelve todas las variantes; con "paralelo" se
+    # hace una llamada por tipo, todas a la vez. Devuelve, por tipo,
+    # {"resultado", "error", "aviso", "intentos"}: "error" si la variante no
+    # pudo generarse y "aviso" si sigue sin cumplir su límite tras los reintentos
+    if not tipos_contenido:
+        raise ErrorGeneracion("Selecciona al menos un formato")
+
+    variantes = {}
+    if estrategia == "json":
+        respuesta = completar(
+            proveedor, MODELOS_TEXTO, mensajes_multiformato(tema, tipo_respuesta, tipos_contenido),
+            claves, ignorar_cache, respaldo, sesion, al_esperar, "Multiformato"
+        )
+        variantes = extraer_variantes(respuesta, tipos_contenido)
+
+    def generar(tipo_contenido):
+        try:
+            return generar_texto(construir_prompt_contenido(tipo_contenido, tema, tipo_respuesta), proveedor, tipo_contenido, claves, ignorar_cache, respaldo, sesion)
+        except ErrorGeneracion as e:
+            return e
+
+    variantes.update(en_paralelo(generar, [tipo_contenido for tipo_contenido in tipos_contenido if tipo_contenido not in variantes]))
+    resultados = {}
+    for tipo_contenido in tipos_contenido:
+        texto = variantes[tipo_contenido]
+        if isinstance(texto, ErrorGeneracion):
+            resultados[tipo_contenido] = {"resultado": None, "error": str(texto), "aviso": None, "intentos": 1}
+        else:
+            resultados[tipo_contenido] = {"resultado": texto, "error": None, "aviso": validar_variante(tipo_contenido, texto), "intentos": 1}
+
+    def corregir(tipo_contenido):
+        # Solo se repite la variante que no cumple; la caché se ignora para no
+        # recibir de nuevo una respuesta ya rechazada
+        variante = resultados[tipo_contenido]
+        while variante["aviso"] and variante["intentos"] <= reintentos:
+            try:
+                texto = completar(
+                    proveedor, MODELOS_TEXTO, mensajes_correccion(tipo_contenido, variante["resultado"]),
+                    claves, True, respaldo, sesion, None, tipo_contenido
+                ).strip()
+            except ErrorGeneracion:
+                # Se conserva la última versión con su aviso
+                return
+            variante["resultado"] = texto
+            variante["intentos"] += 1
+            variante["aviso"] = validar_variante(tipo_contenido, texto)
+
+    en_paralelo(corregir, [tipo_contenido for tipo_contenido, variante in resultados.items() if variante["aviso"]])
+    return resultados
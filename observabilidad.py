@@ -0,0 +1,239 @@
+import asyncio
+import contextvars
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import sys
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from http import HTTPStatus
+
+from configuracion import DIRECTORIO_DATOS, METRICAS_HOST, METRICAS_PUERTO, LOG_JSON
+from servidor_http import ErrorPeticion, leer_peticion, enviar
+
+# Medición de las etapas de cada generación (creación del cliente, cola,
+# envío, primer token, respuesta completa, escritura en el historial y
+# render de la app) como histogramas en formato de texto de Prometheus.
+# Las métricas son por proceso, igual que la caché de clientes y el planificador
+
+LIMITES_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+ETIQUETAS = ("etapa", "proveedor", "modelo", "tipo", "cache", "error")
+TIPO_CONTENIDO_METRICAS = "text/plain; version=0.0.4; charset=utf-8"
+LINEAS_PERFIL = 40
+
+# Identificador de la petición en curso (una ejecución de la app o una petición a la API)
+peticion_actual = contextvars.ContextVar("peticion_actual", default=None)
+
+eventos = logging.getLogger("contelia.eventos")
+if LOG_JSON:
+    manejador = logging.StreamHandler(sys.stderr)
+    manejador.setFormatter(logging.Formatter("%(message)s"))
+    eventos.addHandler(manejador)
+    eventos.setLevel(logging.INFO)
+    eventos.propagate = False
+
+def escapar(valor):
+    return str(valor).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def muestra(nombre, etiquetas, valor):
+    etiquetas = ",".join(f'{clave}="{escapar(texto)}"' for clave, texto in etiquetas)
+    return f"{nombre}{{{etiquetas}}} {valor}" if etiquetas else f"{nombre} {valor}"
+
+class Histograma:
+    def __init__(self, limites):
+        self.cubetas = [0] * len(limites)
+        self.limites = limites
+        self.suma = 0.0
+        self.cuenta = 0
+
+    def observar(self, valor):
+        indice = bisect_left(self.limites, valor)
+        if indice < len(self.cubetas):
+            self.cubetas[indice] += 1
+        self.suma += valor
+        self.cuenta += 1
+
+class Metricas:
+    def __init__(self, limites=LIMITES_SEGUNDOS):
+        self.limites = limites
+        self.histogramas = {}
+        self.errores = {}
+        # Funciones que aportan métricas de otros módulos (consumo, cola) al exportar
+        self.colectores = []
+        self.lock = threading.Lock()
+
+    def observar(self, segundos, etiquetas):
+        clave = tuple(str(etiquetas.get(nombre) or "") for nombre in ETIQUETAS)
+        with self.lock:
+            if clave not in self.histogramas:
+                self.histogramas[clave] = Histograma(self.limites)
+            self.histogramas[clave].observar(segundos)
+            if etiquetas.get("error"):
+                clave_error = (etiquetas["etapa"], etiquetas.get("proveedor") or "", etiquetas["error"])
+                self.errores[clave_error] = self.errores.get(clave_error, 0) + 1
+
+    def registrar_colector(self, colector):
+        self.colectores.append(colector)
+
+    def exportar(self):
+        lineas = [
+            "# HELP contelia_etapa_segundos Duración de cada etapa de una generación",
+            "# TYPE contelia_etapa_segundos histogram"
+        ]
+        with self.lock:
+            for clave, histograma in sorted(self.histogramas.items()):
+                etiquetas = list(zip(ETIQUETAS, clave))
+                acumulado = 0
+                for limite, cantidad in zip(self.limites, histograma.cubetas):
+                    acumulado += cantidad
+                    lineas.append(muestra("contelia_etapa_segundos_bucket", etiquetas + [("le", limite)], acumulado))
+                lineas.append(muestra("contelia_etapa_segundos_bucket", etiquetas + [("le", "+Inf")], histograma.cuenta))
+                lineas.append(muestra("contelia_etapa_segundos_sum", etiquetas, histograma.suma))
+                lineas.append(muestra("contelia_etapa_segundos_count", etiquetas, histograma.cuenta))
+
+            lineas += [
+                "# HELP contelia_errores_total Errores por etapa, proveedor y clase de error",
+                "# TYPE contelia_errores_total counter"
+            ]
+            for (etapa, proveedor, clase), cantidad in sorted(self.errores.items()):
+                lineas.append(muestra("contelia_errores_total", [("etapa", etapa), ("proveedor", proveedor), ("clase", clase)], cantidad))
+            colectores = list(self.colectores)
+
+        for colector in colectores:
+            for nombre, tipo, ayuda, muestras in colector():
+                lineas += [f"# HELP {nombre} {ayuda}", f"# TYPE {nombre} {tipo}"]
+                lineas += [muestra(nombre, etiquetas.items(), valor) for etiquetas, valor in muestras]
+        return "\n".join(lineas) + "\n"
+
+metricas = Metricas()
+
+def registrar_evento(evento, **campos):
+    if not LOG_JSON:
+        return
+    eventos.info(json.dumps({
+        "momento": round(time.time(), 3), "evento": evento, "peticion": peticion_actual.get(), **campos
+    }, ensure_ascii=False, default=str))
+
+def observar(segundos, **etiquetas):
+    metricas.observar(segundos, etiquetas)
+    registrar_evento("etapa", segundos=round(segundos, 6), **{clave: valor for clave, valor in etiquetas.items() if valor})
+
+@contextmanager
+def medir(etapa, **etiquetas):
+    # Devuelve las etiquetas para que el bloque pueda completarlas (p. ej. si
+    # hubo acierto de caché); las excepciones se registran con su clase
+    etiquetas["etapa"] = etapa
+    inicio = time.perf_counter()
+    try:
+        yield etiquetas
+    except GeneratorExit:
+        # Stream cerrado antes de terminar (el usuario detuvo la ejecución o se desconectó)
+        etiquetas["error"] = "Cancelado"
+        raise
+    except BaseException as e:
+        etiquetas["error"] = type(e).__name__
+        raise
+    finally:
+        observar(time.perf_counter() - inicio, **etiquetas)
+
+@contextmanager
+def peticion(identificador=None):
+    identificador = identificador or uuid.uuid4().hex[:16]
+    token = peticion_actual.set(identificador)
+    try:
+        yield identificador
+    finally:
+        peticion_actual.reset(token)
+
+@contextmanager
+def perfilar(activo=True):
+    # Perfila con cProfile el hilo actual durante el bloque y guarda el
+    # resultado en DIRECTORIO_DATOS/perfiles (se abre con snakeviz o pstats)
+    resultado = {}
+    if not activo:
+        yield resultado
+        return
+
+    perfil = cProfile.Profile()
+    try:
+        perfil.enable()
+    except ValueError as e:
+        # Solo puede haber un perfilador activo por proceso
+        resultado["error"] = str(e)
+        yield resultado
+        return
+    try:
+        yield resultado
+    finally:
+        perfil.disable()
+        directorio = os.path.join(DIRECTORIO_DATOS, "perfiles")
+        os.makedirs(directorio, exist_ok=True)
+        ruta = os.path.join(directorio, f"{time.strftime('%Y%m%d-%H%M%S')}-{peticion_actual.get() or uuid.uuid4().hex[:16]}.prof")
+        perfil.dump_stats(ruta)
+        salida = io.StringIO()
+        pstats.Stats(perfil, stream=salida).sort_stats("cumulative").print_stats(LINEAS_PERFIL)
+        resultado.update(ruta=ruta, resumen=salida.getvalue())
+        registrar_evento("perfil", ruta=ruta)
+
+async def atender(lector, escritor):
+    try:
+        while True:
+            try:
+                solicitud = await leer_peticion(lector, 0)
+            except ErrorPeticion as e:
+                await enviar(escritor, e.estado, str(e).encode("utf-8"), TIPO_CONTENIDO_METRICAS, mantener=False)
+                break
+            if solicitud is None:
+                break
+            metodo, ruta, _, _, mantener = solicitud
+            if metodo == "GET" and ruta == "/metricas":
+                await enviar(escritor, HTTPStatus.OK, metricas.exportar().encode("utf-8"), TIPO_CONTENIDO_METRICAS, mantener)
+            else:
+                await enviar(escritor, HTTPStatus.NOT_FOUND, b"Ruta desconocida\n", TIPO_CONTENIDO_METRICAS, mantener)
+            if not mantener:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        escritor.close()
+
+servidor_metricas = None
+lock_servidor = threading.Lock()
+
+def iniciar_servidor(host=METRICAS_HOST, puerto=METRICAS_PUERTO):
+    # Arranca una sola vez por proceso, en un hilo con su propio bucle; con el
+    # puerto a 0 no se expone nada. Devuelve la URL o "" si no se pudo iniciar
+    global servidor_metricas
+    with lock_servidor:
+        if servidor_metricas is not None or not puerto:
+            return servidor_metricas or ""
+
+        listo = threading.Event()
+        fallo = []
+
+        def ejecutar():
+            bucle = asyncio.new_event_loop()
+            try:
+                bucle.run_until_complete(asyncio.start_server(atender, host, puerto))
+            except OSError as e:
+                fallo.append(e)
+                listo.set()
+                return
+            listo.set()
+            bucle.run_forever()
+
+        threading.Thread(target=ejecutar, name="contelia-metricas", daemon=True).start()
+        listo.wait()
+        if fallo:
+            # P. ej. otro worker ya usa el puerto: la app sigue funcionando sin endpoint
+            logging.getLogger("contelia").warning(f"No se pudo iniciar el servidor de métricas en {host}:{puerto}: {fallo[0]}")
+            servidor_metricas = ""
+        else:
+            servidor_metricas = f"http://{host}:{puerto}/metricas"
+        return servidor_metricas
@@ -0,0 +1,221 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+from clientes import huella_clave
+from configuracion import (
+    LIMITES_PROVEEDOR, LIMITES_POR_CLAVE, TOKENS_SALIDA_ESPERADOS, MAX_COLA, TIEMPO_MAX_COLA_SEGUNDOS
+)
+from observabilidad import metricas
+from resiliencia import ErrorGeneracion
+
+MUESTRAS_ESPERA = 1000
+INTERVALO_LIMPIEZA_SEGUNDOS = 60
+
+class ColaLlena(ErrorGeneracion):
+    pass
+
+class CuboTokens:
+    def __init__(self, por_minuto):
+        self.capacidad = float(por_minuto)
+        self.recarga = por_minuto / 60.0
+        self.disponibles = self.capacidad
+        self.actualizado = time.monotonic()
+
+    def recargar(self, ahora):
+        # Un instante anterior a la última recarga (el cubo se creó durante el
+        # despacho) no resta tokens
+        if ahora <= self.actualizado:
+            return
+        self.disponibles = min(self.capacidad, self.disponibles + (ahora - self.actualizado) * self.recarga)
+        self.actualizado = ahora
+
+    def espera(self, cantidad, ahora):
+        # Segundos hasta poder consumir la cantidad; una petición mayor que la
+        # capacidad se deja pasar con el cubo lleno para no bloquearla para siempre
+        self.recargar(ahora)
+        cantidad = min(cantidad, self.capacidad)
+        if self.disponibles >= cantidad:
+            return 0.0
+        return (cantidad - self.disponibles) / self.recarga
+
+    def consumir(self, cantidad):
+        self.disponibles -= min(cantidad, self.capacidad)
+
+    def lleno(self, ahora):
+        self.recargar(ahora)
+        return self.disponibles >= self.capacidad
+
+class Turno:
+    def __init__(self, sesion, proveedor, huella, tokens):
+        self.sesion = sesion
+        self.proveedor = proveedor
+        self.huella = huella
+        self.tokens = tokens
+        self.creado = time.monotonic()
+        self.concedido = False
+
+class Planificador:
+    # Cada sesión tiene una cola FIFO por proveedor y las colas se atienden por
+    # turnos (round-robin), de modo que un lote grande no bloquea a los demás y
+    # una petición que espera a un proveedor saturado no retiene las de la
+    # misma sesión para otro proveedor
+    def __init__(self, limites_proveedor=LIMITES_PROVEEDOR, limites_clave=LIMITES_POR_CLAVE, max_cola=MAX_COLA):
+        self.limites_proveedor = limites_proveedor
+        self.limites_clave = limites_clave
+        self.max_cola = max_cola
+        self.condicion = threading.Condition()
+        self.colas = OrderedDict()
+        self.cubos = {}
+        self.esperas = {}
+        self.concedidos = {}
+        self.rechazados = {}
+        self.limpiado = time.monotonic()
+
+    def limpiar_cubos(self, ahora):
+        # Un cubo lleno no guarda nada que no se pueda reconstruir, así que los
+        # de claves que ya no se usan se olvidan; se revisan cada minuto
+        if ahora - self.limpiado < INTERVALO_LIMPIEZA_SEGUNDOS:
+            return
+        self.limpiado = ahora
+        for clave, (peticiones, tokens) in list(self.cubos.items()):
+            if peticiones.lleno(ahora) and tokens.lleno(ahora):
+                del self.cubos[clave]
+
+    def cubos_de(self, proveedor, huella):
+        cubos = []
+        for clave, limites in (((proveedor,), self.limites_proveedor.get(proveedor)), ((proveedor, huella), self.limites_clave.get(proveedor))):
+            if not limites:
+                continue
+            if clave not in self.cubos:
+                self.cubos[clave] = (CuboTokens(limites["rpm"]), CuboTokens(limites["tpm"]))
+            cubos.append(self.cubos[clave])
+        return cubos
+
+    def espera_turno(self, turno, ahora):
+        espera = 0.0
+        for peticiones, tokens in self.cubos_de(turno.proveedor, turno.huella):
+            espera = max(espera, peticiones.espera(1, ahora), tokens.espera(turno.tokens, ahora))
+        return espera
+
+    def despachar(self):
+        # Recorre las colas en orden de turno; la cola atendida pasa al final
+        ahora = time.monotonic()
+        espera_minima = None
+        for clave in list(self.colas):
+            cola = self.colas[clave]
+            turno = cola[0]
+            espera = self.espera_turno(turno, ahora)
+            if espera > 0:
+                espera_minima = espera if espera_minima is None else min(espera_minima, espera)
+                continue
+            for peticiones, tokens in self.cubos_de(turno.proveedor, turno.huella):
+                peticiones.consumir(1)
+                tokens.consumir(turno.tokens)
+            turno.concedido = True
+            cola.popleft()
+            if cola:
+                self.colas.move_to_end(clave)
+            else:
+                del self.colas[clave]
+            self.registrar_espera(turno, ahora - turno.creado)
+        self.condicion.notify_all()
+        return espera_minima
+
+    def registrar_espera(self, turno, espera):
+        self.esperas.setdefault(turno.proveedor, deque(maxlen=MUESTRAS_ESPERA)).append(espera)
+        self.concedidos[turno.proveedor] = self.concedidos.get(turno.proveedor, 0) + 1
+
+    def posicion(self, turno):
+        # Posición aproximada según el reparto por turnos entre las sesiones
+        # que esperan al mismo proveedor
+        propia = self.colas.get((turno.sesion, turno.proveedor))
+        if not propia or turno not in propia:
+            return 0
+        indice = propia.index(turno)
+        delante = indice
+        for (sesion, proveedor), cola in self.colas.items():
+            if sesion != turno.sesion and proveedor == turno.proveedor:
+                delante += min(len(cola), indice + 1)
+        return delante + 1
+
+    def en_cola(self):
+        return sum(len(cola) for cola in self.colas.values())
+
+    def adquirir(self, sesion, proveedor, api_key, tokens_entrada, al_esperar=None, tiempo_maximo=TIEMPO_MAX_COLA_SEGUNDOS):
+        turno = Turno(sesion, proveedor, huella_clave(api_key), tokens_entrada + TOKENS_SALIDA_ESPERADOS)
+        limite = time.monotonic() + tiempo_maximo
+        ultima_posicion = None
+        clave = (sesion, proveedor)
+
+        with self.condicion:
+            if self.en_cola() >= self.max_cola:
+                self.rechazados[proveedor] = self.rechazados.get(proveedor, 0) + 1
+                raise ColaLlena("Hay demasiadas peticiones en espera; inténtalo de nuevo en unos segundos")
+            self.limpiar_cubos(turno.creado)
+            self.colas.setdefault(clave, deque()).append(turno)
+
+            while True:
+                espera = self.despachar()
+                if turno.concedido:
+                    if ultima_posicion is not None and al_esperar:
+                        # Posición 0: la petición sale de la cola
+                        self.condicion.release()
+                        try:
+                            al_esperar(0)
+                        finally:
+                            self.condicion.acquire()
+                    return time.monotonic() - turno.creado
+
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    self.colas[clave].remove(turno)
+                    if not self.colas[clave]:
+                        del self.colas[clave]
+                    self.rechazados[proveedor] = self.rechazados.get(proveedor, 0) + 1
+                    raise ColaLlena(f"Se agotó el tiempo de espera en la cola de {proveedor}")
+
+                posicion = self.posicion(turno)
+                if al_esperar and posicion != ultima_posicion:
+                    ultima_posicion = posicion
+                    # El aviso se emite sin el candado para no bloquear a otros hilos
+                    self.condicion.release()
+                    try:
+                        al_esperar(posicion)
+                    finally:
+                        self.condicion.acquire()
+                    continue
+                self.condicion.wait(min(restante, espera if espera is not None else 0.5, 0.5))
+
+    def metricas(self):
+        with self.condicion:
+            resultado = {}
+            for proveedor in set(self.esperas) | set(self.rechazados) | {turno.proveedor for cola in self.colas.values() for turno in cola}:
+                esperas = sorted(self.esperas.get(proveedor, []))
+                resultado[proveedor] = {
+                    "en_cola": sum(1 for cola in self.colas.values() for turno in cola if turno.proveedor == proveedor),
+                    "concedidos": self.concedidos.get(proveedor, 0),
+                    "rechazados": self.rechazados.get(proveedor, 0),
+                    "espera_media": sum(esperas) / len(esperas) if esperas else 0.0,
+                    "espera_p95": esperas[int(len(esperas) * 0.95)] if esperas else 0.0,
+                    "espera_maxima": esperas[-1] if esperas else 0.0
+                }
+            return resultado
+
+planificador = Planificador()
+
+def metricas_cola():
+    resumen = planificador.metricas()
+    return [
+        ("contelia_cola_peticiones", "gauge", "Peticiones esperando turno", [
+            ({"proveedor": proveedor}, datos["en_cola"]) for proveedor, datos in resumen.items()
+        ]),
+        ("contelia_cola_concedidas_total", "counter", "Peticiones que obtuvieron turno", [
+            ({"proveedor": proveedor}, datos["concedidos"]) for proveedor, datos in resumen.items()
+        ]),
+        ("contelia_cola_rechazadas_total", "counter", "Peticiones rechazadas por cola llena o tiempo agotado", [
+            ({"proveedor": proveedor}, datos["rechazados"]) for proveedor, datos in resumen.items()
+        ])
+    ]
+
+metricas.registrar_colector(metricas_cola)
@@ -0,0 +1,349 @@
+import copy
+import hashlib
+import json
+import os
+import string
+import threading
+import time
+
+from configuracion import PLANTILLAS_RUTA, PLANTILLAS_INTERVALO_RECARGA
+
+TIPO_IDEAS = "Ideas de Contenido"
+
+PLANTILLAS_POR_DEFECTO = {
+    "version": "5",
+    "sistema_generico": "Eres un asistente útil y creativo.",
+    "sistema_multiformato": "Eres un equipo de marketing digital que adapta un mismo mensaje a varias plataformas a la vez, respetando el tono, el formato y los límites de cada una. Respondes únicamente con un objeto JSON válido.",
+    "sistema_ideas": "Eres un estratega de contenido digital. Propones ideas concretas y accionables, con formatos, títulos y frecuencia de publicación adaptados a la audiencia y al objetivo indicados.",
+    "contenido": {
+        "Post para Twitter/X": {
+            "sistema": "Eres un experto en marketing digital especializado en crear tweets virales. Genera contenido conciso y atractivo en 280 caracteres o menos.",
+            "ayuda": "Describe el tema y tono del tweet. Ej: 'Un tweet promocionando un nuevo curso de programación con tono entusiasta'",
+            "max_caracteres": 280
+        },
+        "Post para Facebook": {
+            "sistema": "Eres un experto en marketing de redes sociales especializado en Facebook. Crea contenido atractivo con el tono y formato adecuados para esta plataforma.",
+            "ayuda": "Describe el contenido y objetivo. Ej: 'Post anunciando una oferta especial de fin de semana para nuestra tienda de ropa'"
+        },
+        "Post para Instagram": {
+            "sistema": "Eres un experto en marketing visual para Instagram. Crea contenido atractivo con hashtags relevantes y llamadas a la acción.",
+            "ayuda": "Describe la imagen y el mensaje. Ej: 'Post sobre consejos de fitness con una imagen motivadora'"
+        },
+        "Guión para TikTok": {
+            "sistema": "Eres un creador de contenido para TikTok. Genera un guión breve y entretenido que capture la atención en los primeros segundos.",
+            "ayuda": "Describe el tema y estilo. Ej: 'Un TikTok educativo de 30 segundos explicando cómo funciona la inteligencia artificial'"
+        },
+        "Guión para Reels": {
+            "sistema": "Eres un creador de Reels de Instagram. Genera un guión de menos de 60 segundos con un gancho inicial, escenas indicadas, texto en pantalla y una llamada a la acción final.",
+            "ayuda": "Describe el tema y enfoque. Ej: 'Un Reel mostrando 3 tips de productividad con un tono energético'"
+        },
+        "Artículo de blog": {
+            "sistema": "Eres un redactor profesional de blogs. Genera un artículo bien estructurado con introducción, desarrollo y conclusión sobre el tema solicitado.",
+            "ayuda": "Describe el tema y enfoque. Ej: 'Artículo sobre los beneficios del yoga para la salud mental, enfocado a principiantes'"
+        },
+        "Email marketing": {
+            "sistema": "Eres un experto en email marketing. Genera un correo persuasivo con asunto atractivo, introducción, beneficios y llamada a la acción clara.",
+            "ayuda": "Describe la campaña y objetivo. Ej: 'Email promocionando un webinar gratuito sobre marketing digital'"
+        },
+        "Infografía": {
+            "sistema": "Eres un diseñador de información. Genera el contenido de una infografía: título, secciones breves con datos clave, sugerencias de iconos o gráficos y una fuente o llamada a la acción al pie.",
+            "ayuda": "Describe el tema y datos clave a incluir. Ej: 'Infografía sobre estadísticas de uso de redes sociales en 2025'"
+        },
+        "Newsletter": {
+            "sistema": "Eres un editor de newsletters. Genera un boletín con asunto, saludo, secciones con titulares y resúmenes breves, y un cierre con llamada a la acción.",
+            "ayuda": "Describe el tema y secciones. Ej: 'Newsletter mensual para una tienda de productos ecológicos'"
+        },
+        "Podcast script": {
+            "sistema": "Eres un guionista de podcasts. Genera un guión con introducción, bloques temáticos con preguntas o puntos de conversación, transiciones y despedida, indicando el tiempo aproximado de cada parte.",
+            "ayuda": "Describe el tema y formato. Ej: 'Guión para un episodio de podcast sobre finanzas personales para millennials'"
+        }
+    },
+    "tipos_respuesta": [
+        "Ejemplo concreto",
+        "Recomendaciones",
+        "Ideas creativas",
+        "Estructura para video/post",
+        "Análisis de tendencias",
+        "Fórmulas probadas",
+        "Call to Action (CTA)"
+    ],
+    "objetivos": [
+        "Aumentar engagement",
+        "Educar a la audiencia",
+        "Vender un producto/servicio",
+        "Generar leads",
+        "Crear autoridad",
+        "Entretener"
+    ],
+    "sistema_codigo": "Eres un experto programador de {lenguaje}. Proporciona soluciones de código eficientes, bien comentadas y siguiendo las mejores prácticas.",
+    "lenguajes": {
+        "Python": "Sigue PEP 8 y usa la biblioteca estándar siempre que sea suficiente.",
+        "JavaScript": "Usa sintaxis moderna (ES2020 o posterior) y evita variables globales.",
+        "Java": "Sigue las convenciones de nombres de Java y maneja las excepciones de forma explícita.",
+        "C++": "Usa C++17 o posterior, RAII y contenedores de la biblioteca estándar en lugar de memoria manual.",
+        "PHP": "Usa PHP 8, tipos declarados y consultas preparadas para cualquier acceso a base de datos.",
+        "Go": "Sigue el estilo de gofmt y devuelve los errores en lugar de usar panic.",
+        "Ruby": "Sigue la guía de estilo de la comunidad y prefiere los métodos de Enumerable.",
+        "C#": "Usa .NET moderno, async/await para E/S y las convenciones de nombres de C#.",
+        "SQL": "Usa SQL estándar, indica el motor si usas funciones específicas y evita SELECT *.",
+        "TypeScript": "Usa tipos estrictos y evita any.",
+        "Swift": "Usa Swift moderno, opcionales de forma segura y evita los desempaquetados forzados.",
+        "Rust": "Escribe código idiomático y seguro, maneja los errores con Result y evita unwrap en código de producción."
+    },
+    "usuario": {
+        "contenido": """Crea {tipo_contenido} sobre: {tema}
+Tipo de respuesta requerida: {tipo_respuesta}
+El contenido debe ser original, atractivo y optimizado para la plataforma indicada.""",
+        "ideas": """Eres el experto en estrategia de contenido digital. Para la generación de ideas de contenido sobre: {tema}
+La audiencia objetivo es: {audiencia}
+El objetivo principal que se espera es: {objetivo}
+
+Proporciona lo siguiente:
+1. Definición del tipo de formato que se adapte a las necesidades del tema y la audiencia como: (videos, reels, blogs, infografías, etc.)
+2. Ideas de contenido para plasmar en los formatos sugeridos.
+3. Para cada idea, sugiere:
+   - El formato más adecuado
+   - Un título atractivo
+   - Breve descripción del contenido
+   - Por qué funcionaría bien con la audiencia objetivo
+
+Prioriza formatos y temas que se adecuen al tipo de contenido y sugerencias de contenido y frecuencia de publicación del contenido.""",
+        "codigo": "Genera código en {lenguaje} para la siguiente tarea:\n\n{descripcion}\n\n",
+        "codigo_solo": "IMPORTANTE: Proporciona SOLO el código, sin explicaciones, comentarios adicionales ni descripciones. El código debe ser completamente funcional y listo para usar.",
+        "codigo_incluye": "Incluye en tu respuesta:\n",
+        "codigo_sin_comentarios": "- NO incluyas comentarios en el código\n",
+        "mensaje_codigo": "Genera código en {lenguaje} para la siguiente tarea: {descripcion} Proporciona código bien comentado y explicado, siguiendo las mejores prácticas de programación.",
+        "mejora": "{encabezado}:\n\n{codigo}\n\n{instruccion}",
+        "mejora_indicaciones": " Considera estas indicaciones adicionales: {indicaciones}",
+        "mejora_personalizada": "Revisa y mejora el siguiente código {lenguaje} según estas indicaciones específicas:\n\n{codigo}\n\nMejoras solicitadas: {indicaciones}",
+        "mejora_turno": "{instruccion}\n\nDevuelve el código {lenguaje} completo con los cambios aplicados.",
+        "mejora_turno_personalizada": "Revisa y mejora el código anterior según estas indicaciones específicas: {indicaciones}\n\nDevuelve el código {lenguaje} completo con los cambios aplicados.",
+        "conversacion_resumen": "Mejoras ya aplicadas (la versión del código que sigue ya las incluye):\n{mejoras}",
+        "multiformato": """Adapta el siguiente brief a cada uno de estos formatos:
+{formatos}
+
+Brief: {tema}
+Tipo de respuesta requerida: {tipo_respuesta}
+
+Responde solo con un objeto JSON cuyas claves sean exactamente los nombres de los formatos y cuyos valores sean el texto final de cada uno, listo para publicar.""",
+        "multiformato_formato": "- {tipo_contenido}: {indicaciones}",
+        "multiformato_limite": " Máximo {maximo} caracteres.",
+        "reparar_codigo": """El siguiente código {lenguaje} tiene un error de sintaxis ({error}). Corrige solo ese error, sin cambiar nada más, y devuelve el código completo en un único bloque de código:
+
+{codigo}""",
+        "corregir_longitud": """El siguiente texto para {tipo_contenido} tiene {longitud} caracteres y el máximo es {maximo}. Reescríbelo en {maximo} caracteres o menos manteniendo el mensaje principal, y responde solo con el texto final:
+
+{texto}"""
+    },
+    "opciones_codigo": {
+        "comentarios": "- Comentarios explicativos dentro del código\n",
+        "explicacion": "- Una explicación detallada de cómo funciona el código\n",
+        "ejemplo": "- Un ejemplo de uso con entrada y salida esperada\n",
+        "complejidad": "- Un análisis de la complejidad temporal y espacial del código\n",
+        "rendimiento": "- Un análisis del rendimiento y posibles optimizaciones\n",
+        "alternativas": "- Enfoques alternativos para resolver el mismo problema\n"
+    },
+    "mejoras_codigo": {
+        "optimizar": {
+            "encabezado": "Revisa, mejora y optimiza el siguiente código {lenguaje} para mejorar su rendimiento",
+            "instruccion": "Optimiza el rendimiento del código manteniendo la misma funcionalidad. Enfócate en mejorar la eficiencia y velocidad de ejecución."
+        },
+        "legibilidad": {
+            "encabezado": "Revisa y refactoriza el siguiente código {lenguaje} para mejorar su legibilidad y mantenibilidad",
+            "instruccion": "Mejora la legibilidad y mantenibilidad del código. Enfócate en hacer el código más claro, mejor organizado y más fácil de mantener."
+        },
+        "refactorizar": {
+            "encabezado": "Refactoriza el siguiente código {lenguaje}",
+            "instruccion": "Refactoriza el código para mejorar su estructura, reducir duplicación y seguir mejores prácticas."
+        }
+    }
+}
+
+# Campos que puede usar cada plantilla de usuario; se comprueban al cargar
+CAMPOS_USUARIO = {
+    "contenido": {"tipo_contenido", "tema", "tipo_respuesta"},
+    "ideas": {"tema", "audiencia", "objetivo"},
+    "codigo": {"lenguaje", "descripcion"},
+    "codigo_solo": set(),
+    "codigo_incluye": set(),
+    "codigo_sin_comentarios": set(),
+    "mensaje_codigo": {"lenguaje", "descripcion"},
+    "mejora": {"encabezado", "codigo", "instruccion"},
+    "mejora_indicaciones": {"indicaciones"},
+    "mejora_personalizada": {"lenguaje", "codigo", "indicaciones"},
+    "mejora_turno": {"instruccion", "lenguaje"},
+    "mejora_turno_personalizada": {"indicaciones", "lenguaje"},
+    "conversacion_resumen": {"mejoras"},
+    "multiformato": {"formatos", "tema", "tipo_respuesta"},
+    "multiformato_formato": {"tipo_contenido", "indicaciones"},
+    "multiformato_limite": {"maximo"},
+    "reparar_codigo": {"lenguaje", "error", "codigo"},
+    "corregir_longitud": {"tipo_contenido", "longitud", "maximo", "texto"}
+}
+
+class PlantillaInvalida(ValueError):
+    pass
+
+def campos(texto, nombre):
+    if not isinstance(texto, str):
+        raise PlantillaInvalida(f"La plantilla '{nombre}' debe ser un texto")
+    try:
+        return {campo for _, campo, _, _ in string.Formatter().parse(texto) if campo is not None}
+    except ValueError as e:
+        raise PlantillaInvalida(f"La plantilla '{nombre}' no es válida: {e}")
+
+def validar_campos(texto, nombre, permitidos):
+    desconocidos = campos(texto, nombre) - permitidos
+    if desconocidos:
+        raise PlantillaInvalida(f"La plantilla '{nombre}' usa campos desconocidos: {', '.join(sorted(desconocidos))}")
+
+def huella(datos):
+    contenido = json.dumps(datos, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(contenido.encode("utf-8")).hexdigest()[:12]
+
+class Plantillas:
+    # Conjunto de plantillas ya validado; no se modifica después de crearse,
+    # así que puede compartirse entre hilos sin bloqueo
+    def __init__(self, datos):
+        self.validar(datos)
+        self.datos = datos
+        self.version = str(datos["version"])
+        self.huella = huella(datos)
+        self.tipos_contenido = list(datos["contenido"])
+        self.tipos_respuesta = list(datos["tipos_respuesta"])
+        self.objetivos = list(datos["objetivos"])
+        self.lenguajes = list(datos["lenguajes"])
+        self.opciones_codigo = dict(datos["opciones_codigo"])
+        self.mejoras_codigo = dict(datos["mejoras_codigo"])
+        self.usuario = dict(datos["usuario"])
+        # Identificadores estables: cambian solo si cambia el texto de la plantilla
+        self.ids = {f"usuario.{nombre}": f"{nombre}@{huella(texto)}" for nombre, texto in self.usuario.items()}
+        self.ids.update({f"contenido.{tipo}": f"{tipo}@{huella(plantilla)}" for tipo, plantilla in datos["contenido"].items()})
+        self.ids["sistema_codigo"] = f"sistema_codigo@{huella([datos['sistema_codigo'], datos['lenguajes']])}"
+
+    @staticmethod
+    def validar(datos):
+        for seccion in ["version", "sistema_generico", "sistema_ideas", "sistema_multiformato", "contenido", "tipos_respuesta", "objetivos", "sistema_codigo", "lenguajes", "usuario", "opciones_codigo", "mejoras_codigo"]:
+            if not datos.get(seccion):
+                raise PlantillaInvalida(f"Falta la sección '{seccion}'")
+
+        validar_campos(datos["sistema_generico"], "sistema_generico", set())
+        validar_campos(datos["sistema_ideas"], "sistema_ideas", set())
+        validar_campos(datos["sistema_multiformato"], "sistema_multiformato", set())
+        for tipo, plantilla in datos["contenido"].items():
+            if not isinstance(plantilla, dict) or not plantilla.get("sistema"):
+                raise PlantillaInvalida(f"El tipo de contenido '{tipo}' no tiene prompt de sistema")
+            validar_campos(plantilla["sistema"], f"contenido.{tipo}", set())
+            maximo = plantilla.get("max_caracteres")
+            if maximo is not None and (not isinstance(maximo, int) or isinstance(maximo, bool) or maximo <= 0):
+                raise PlantillaInvalida(f"'max_caracteres' de '{tipo}' debe ser un entero positivo")
+
+        validar_campos(datos["sistema_codigo"], "sistema_codigo", {"lenguaje"})
+        for lenguaje, guia in datos["lenguajes"].items():
+            validar_campos(guia, f"lenguajes.{lenguaje}", set())
+
+        faltantes = set(CAMPOS_USUARIO) - set(datos["usuario"])
+        if faltantes:
+            raise PlantillaInvalida(f"Faltan plantillas de usuario: {', '.join(sorted(faltantes))}")
+        for nombre, texto in datos["usuario"].items():
+            validar_campos(texto, f"usuario.{nombre}", CAMPOS_USUARIO.get(nombre, set()))
+
+        for opcion, texto in datos["opciones_codigo"].items():
+            validar_campos(texto, f"opciones_codigo.{opcion}", set())
+        for tipo, mejora in datos["mejoras_codigo"].items():
+            if not isinstance(mejora, dict) or not mejora.get("encabezado") or not mejora.get("instruccion"):
+                raise PlantillaInvalida(f"La mejora '{tipo}' necesita 'encabezado' e 'instruccion'")
+            validar_campos(mejora["encabezado"], f"mejoras_codigo.{tipo}", {"lenguaje"})
+            validar_campos(mejora["instruccion"], f"mejoras_codigo.{tipo}", set())
+
+    def render(self, nombre, **valores):
+        return self.usuario[nombre].format(**valores)
+
+    def sistema_texto(self, tipo_contenido):
+        if tipo_contenido == TIPO_IDEAS:
+            return self.datos["sistema_ideas"]
+        plantilla = self.datos["contenido"].get(tipo_contenido)
+        return plantilla["sistema"] if plantilla else self.datos["sistema_generico"]
+
+    def sistema_codigo(self, lenguaje):
+        sistema = self.datos["sistema_codigo"].format(lenguaje=lenguaje)
+        guia = self.datos["lenguajes"].get(lenguaje)
+        return f"{sistema} {guia}" if guia else sistema
+
+    def sistema_multiformato(self):
+        return self.datos["sistema_multiformato"]
+
+    def max_caracteres(self, tipo_contenido):
+        plantilla = self.datos["contenido"].get(tipo_contenido)
+        return plantilla.get("max_caracteres") if plantilla else None
+
+    def ayuda(self, tipo_contenido):
+        plantilla = self.datos["contenido"].get(tipo_contenido)
+        return plantilla.get("ayuda", "") if plantilla else ""
+
+def leer_archivo(ruta):
+    with open(ruta, encoding="utf-8") as archivo:
+        if ruta.lower().endswith((".yaml", ".yml")):
+            # PyYAML es opcional y solo se importa si el archivo es YAML; sin
+            # él el archivo de plantillas debe ser JSON
+            try:
+                import yaml
+            except ImportError:
+                raise PlantillaInvalida("Instala PyYAML para usar plantillas en YAML")
+            return yaml.safe_load(archivo) or {}
+        return json.load(archivo)
+
+def cargar(ruta=None):
+    # Las secciones del archivo sustituyen a las de por defecto; los
+    # diccionarios de primer nivel se combinan para poder cambiar solo una parte
+    datos = copy.deepcopy(PLANTILLAS_POR_DEFECTO)
+    if ruta:
+        for seccion, valor in leer_archivo(ruta).items():
+            if isinstance(valor, dict) and isinstance(datos.get(seccion), dict):
+                datos[seccion].update(valor)
+            else:
+                datos[seccion] = valor
+    return Plantillas(datos)
+
+class RegistroPlantillas:
+    def __init__(self, ruta=PLANTILLAS_RUTA, intervalo=PLANTILLAS_INTERVALO_RECARGA):
+        self.ruta = ruta
+        self.intervalo = intervalo
+        self.lock = threading.Lock()
+        self.error = None
+        self.modificado = self.fecha_archivo()
+        self.revisado = time.monotonic()
+        # Un archivo inválido al arrancar es un error de configuración y detiene el proceso
+        self.plantillas = cargar(ruta)
+
+    def fecha_archivo(self):
+        try:
+            return os.path.getmtime(self.ruta) if self.ruta else None
+        except OSError:
+            return None
+
+    def actuales(self):
+        if self.ruta and time.monotonic() - self.revisado >= self.intervalo:
+            self.revisado = time.monotonic()
+            if self.fecha_archivo() != self.modificado:
+                self.recargar()
+        return self.plantillas
+
+    def recargar(self):
+        # Si el archivo nuevo no es válido se siguen usando las plantillas anteriores
+        with self.lock:
+            self.modificado = self.fecha_archivo()
+            try:
+                self.plantillas = cargar(self.ruta)
+                self.error = None
+                return True
+            except Exception as e:
+                self.error = str(e)
+                return False
+
+# El módulo se importa una sola vez por proceso: las plantillas se validan al
+# arrancar y no se reconstruyen en cada rerun de Streamlit
+registro = RegistroPlantillas()
+
+def actuales():
+    return registro.actuales()
@@ -0,0 +1,231 @@
+import ast
+import hashlib
+import json
+import re
+import threading
+from collections import OrderedDict
+
+from configuracion import VALIDACION_CACHE_ENTRADAS
+from observabilidad import medir
+
+# Postprocesado del código generado: separa los bloques ``` de la prosa a
+# medida que llega el stream y comprueba la sintaxis sin salir del proceso
+# en los lenguajes que lo permiten (Python con ast, JSON con json y, en SQL,
+# solo lo que es un error en cualquier motor). La app vuelve a validar el
+# mismo código en cada rerun, así que los resultados se guardan por huella
+# del contenido
+
+APERTURA = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*([^\s`]*)")
+CIERRE = re.compile(r"^ {0,3}(`{3,}|~{3,})\s*$")
+
+# Piezas de SQL que pueden contener paréntesis o comillas sin que cuenten:
+# comentarios (también los # de MySQL), cadenas, identificadores entre
+# comillas y cadenas $$ de PostgreSQL. Lo que queda después de ellas son
+# aperturas sin cerrar
+PIEZAS_SQL = r"""--[^\n]*|#[^\n]*|/\*.*?\*/|\$(?P<etiqueta>(?:[A-Za-z_]\w*)?)\$.*?\$(?P=etiqueta)\$|{cadena}|"(?:[^"]|"")*"|`[^`]*`|(?P<parentesis>[()])|(?P<sin_cerrar>/\*|\$(?:[A-Za-z_]\w*)?\$|['"`])"""
+# Cadenas estándar ('' escapa la comilla) y con barra invertida (MySQL)
+TOKENS_SQL = [
+    re.compile(PIEZAS_SQL.format(cadena=r"'(?:[^']|'')*'"), re.S),
+    re.compile(PIEZAS_SQL.format(cadena=r"'(?:[^'\\]|\\.|'')*'"), re.S)
+]
+
+# Etiquetas de bloque que se aceptan como el lenguaje pedido; los bloques sin
+# etiqueta también cuentan, los de otros lenguajes (p. ej. bash) no
+ALIAS_LENGUAJES = {
+    "python": {"python", "py", "python3"},
+    "json": {"json"},
+    "sql": {"sql", "sqlite", "postgresql", "postgres", "mysql"},
+    "javascript": {"javascript", "js", "jsx"},
+    "typescript": {"typescript", "ts", "tsx"},
+    "c++": {"c++", "cpp", "cc"},
+    "c#": {"c#", "csharp", "cs"},
+    "go": {"go", "golang"},
+    "ruby": {"ruby", "rb"},
+    "rust": {"rust", "rs"}
+}
+
+def del_lenguaje(etiqueta, lenguaje):
+    return not etiqueta or etiqueta in ALIAS_LENGUAJES.get(lenguaje.lower(), {lenguaje.lower()})
+
+class ExtractorBloques:
+    # Recibe la respuesta por fragmentos y devuelve las líneas de código en
+    # cuanto se completan; la prosa fuera de los bloques se descarta y, si se
+    # indica el lenguaje, también los bloques de otros lenguajes
+    def __init__(self, lenguaje=None):
+        self.lenguaje = lenguaje
+        self.emitidos = 0
+        self.pendiente = ""
+        self.valla = None
+        self.bloques = []
+        self.prosa = []
+
+    def alimentar(self, fragmento):
+        *lineas, self.pendiente = (self.pendiente + fragmento).split("\n")
+        return "".join(self.procesar(linea + "\n") for linea in lineas)
+
+    def procesar(self, linea):
+        if self.valla is None:
+            apertura = APERTURA.match(linea)
+            if apertura:
+                self.valla = apertura.group(1)
+                self.bloques.append((apertura.group(2).lower(), []))
+            else:
+                self.prosa.append(linea)
+            return ""
+
+        cierre = CIERRE.match(linea)
+        if cierre and cierre.group(1)[0] == self.valla[0] and len(cierre.group(1)) >= len(self.valla):
+            self.valla = None
+            return ""
+        etiqueta, lineas = self.bloques[-1]
+        lineas.append(linea)
+        if self.lenguaje and not del_lenguaje(etiqueta, self.lenguaje):
+            return ""
+        if len(lineas) == 1:
+            self.emitidos += 1
+            # Una línea en blanco separa un bloque del anterior en el código emitido
+            if self.emitidos > 1:
+                return "\n" + linea
+        return linea
+
+    def terminar(self):
+        resto = self.procesar(self.pendiente) if self.pendiente else ""
+        self.pendiente = ""
+        if not self.bloques:
+            # El modelo no usó bloques: toda la respuesta es el código
+            return "".join(self.prosa)
+        if not self.emitidos:
+            # Ningún bloque tenía la etiqueta esperada: se devuelven todos
+            return "\n".join("".join(lineas) for _, lineas in self.bloques)
+        return resto
+
+def extraer_bloques(texto):
+    extractor = ExtractorBloques()
+    extractor.alimentar(texto)
+    extractor.terminar()
+    return [(lenguaje, "".join(lineas)) for lenguaje, lineas in extractor.bloques]
+
+def extraer_codigo(texto, lenguaje=None):
+    extractor = ExtractorBloques(lenguaje)
+    return (extractor.alimentar(texto) + extractor.terminar()).strip("\n")
+
+def extraer_codigo_stream(fragmentos, lenguaje=None):
+    extractor = ExtractorBloques(lenguaje)
+    try:
+        for fragmento in fragmentos:
+            codigo = extractor.alimentar(fragmento)
+            if codigo:
+                yield codigo
+        resto = extractor.terminar()
+        if resto:
+            yield resto
+    finally:
+        # Al detener el stream se cierra también el del proveedor
+        fragmentos.close()
+
+def validar_python(codigo):
+    # ast.parse rechaza los bytes nulos con ValueError y agota la pila con
+    # anidamientos muy profundos: también son código no válido
+    try:
+        ast.parse(codigo)
+    except SyntaxError as e:
+        return f"línea {e.lineno}: {e.msg}" if e.lineno else e.msg
+    except ValueError as e:
+        return str(e)
+    except (RecursionError, MemoryError):
+        return "anidamiento demasiado profundo"
+    return None
+
+def validar_json(codigo):
+    try:
+        json.loads(codigo)
+    except json.JSONDecodeError as e:
+        return f"línea {e.lineno}: {e.msg}"
+    except ValueError as e:
+        return str(e)
+    except RecursionError:
+        return "anidamiento demasiado profundo"
+    return None
+
+def revisar_sql(codigo, tokens):
+    abiertos = []
+    for pieza in tokens.finditer(codigo):
+        linea = codigo.count("\n", 0, pieza.start()) + 1
+        if pieza.group("sin_cerrar"):
+            return f"línea {linea}: falta cerrar {pieza.group('sin_cerrar')}"
+        if pieza.group("parentesis") == "(":
+            abiertos.append(linea)
+        elif pieza.group("parentesis") == ")":
+            if not abiertos:
+                return f"línea {linea}: paréntesis de cierre sin abrir"
+            abiertos.pop()
+    if abiertos:
+        return f"línea {abiertos[-1]}: paréntesis sin cerrar"
+    return None
+
+def validar_sql(codigo):
+    # Cada motor tiene su propia sintaxis (ILIKE, ::, TOP, ENGINE=...), así
+    # que solo se comprueba lo que es un error en todos: paréntesis sin
+    # pareja y comillas o comentarios sin cerrar
+    errores = [revisar_sql(codigo, tokens) for tokens in TOKENS_SQL]
+    return errores[0] if all(errores) else None
+
+VALIDADORES = {
+    "python": validar_python,
+    "json": validar_json,
+    "sql": validar_sql
+}
+
+def validable(lenguaje):
+    return lenguaje.lower() in VALIDADORES
+
+class CacheValidaciones:
+    def __init__(self, max_entradas=VALIDACION_CACHE_ENTRADAS):
+        self.max_entradas = max_entradas
+        self.resultados = OrderedDict()
+        self.lock = threading.Lock()
+
+    def validar(self, codigo, lenguaje):
+        # Devuelve el mensaje del primer error de sintaxis o None
+        validador = VALIDADORES.get(lenguaje.lower())
+        if validador is None:
+            return None
+        clave = hashlib.sha256(f"{lenguaje.lower()}\n{codigo}".encode("utf-8")).hexdigest()
+        with medir("validacion", tipo=f"Código {lenguaje}", cache="acierto") as etiquetas:
+            with self.lock:
+                if clave in self.resultados:
+                    self.resultados.move_to_end(clave)
+                    return self.resultados[clave]
+            etiquetas["cache"] = "fallo"
+            error = validador(codigo)
+            with self.lock:
+                self.resultados[clave] = error
+                while len(self.resultados) > self.max_entradas:
+                    self.resultados.popitem(last=False)
+            return error
+
+# Compartida por todas las sesiones del proceso
+validaciones = CacheValidaciones()
+
+def validar(codigo, lenguaje):
+    return validaciones.validar(codigo, lenguaje)
+
+def bloques_validables(texto, lenguaje, es_codigo=False):
+    # Sin bloques ``` el texto solo se valida si se sabe que es código (lo
+    # que ya extrajo "solo código"): una explicación en prosa no es un error
+    # de sintaxis ni motivo para pedir una reparación
+    bloques = extraer_bloques(texto)
+    if not bloques:
+        return [texto] if es_codigo else []
+    return [codigo for etiqueta, codigo in bloques if del_lenguaje(etiqueta, lenguaje)]
+
+def validar_respuesta(texto, lenguaje, es_codigo=False):
+    # Primer bloque con error de sintaxis como (código, error); None si la
+    # respuesta es válida, no tiene código o el lenguaje no se puede comprobar
+    if not validable(lenguaje):
+        return None
+    for codigo in bloques_validables(texto, lenguaje, es_codigo):
+        error = validar(codigo, lenguaje)
+        if error:
+            return codigo, error
+    return None
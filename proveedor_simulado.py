@@ -0,0 +1,230 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from http import HTTPStatus
+
+from servidor_http import ErrorPeticion, leer_peticion, enviar_json, evento_sse
+
+# Servidor local que imita los endpoints de chat de DeepSeek (compatible con
+# OpenAI) y de Mistral, para medir la aplicación sin llamar a las APIs de pago.
+# Se usa apuntando CONTELIA_URL_DEEPSEEK / CONTELIA_URL_MISTRAL a su dirección:
+#
+#   python proveedor_simulado.py --puerto 8700 --latencia 0.3 --tokens-por-segundo 80
+#   CONTELIA_URL_DEEPSEEK=http://127.0.0.1:8700 CONTELIA_URL_MISTRAL=http://127.0.0.1:8700 streamlit run app.py
+
+RUTAS_CHAT = {"/chat/completions", "/v1/chat/completions"}
+CARACTERES_POR_TOKEN = 4
+MAX_PREFIJOS = 10000
+MAX_CUERPO_BYTES = 16 * 1024 * 1024
+PALABRAS = (
+    "contenido estrategia audiencia publicación marca campaña formato idea "
+    "código función rendimiento prueba resultado datos mensaje valor"
+).split()
+
+class Simulacion:
+    def __init__(self, latencia=0.2, tokens_por_segundo=50.0, tokens_respuesta=200, tasa_errores=0.0, tasa_429=0.0, semilla=None):
+        self.latencia = latencia
+        self.tokens_por_segundo = tokens_por_segundo
+        self.tokens_respuesta = tokens_respuesta
+        self.tasa_errores = tasa_errores
+        self.tasa_429 = tasa_429
+        self.aleatorio = random.Random(semilla)
+        # Prefijos de conversación ya vistos, para simular la caché de contexto de DeepSeek
+        self.prefijos = OrderedDict()
+        self.lock = threading.Lock()
+        self.peticiones = 0
+
+    def tokens_mensajes(self, mensajes):
+        return sum(len(str(mensaje.get("content", ""))) // CARACTERES_POR_TOKEN + 4 for mensaje in mensajes)
+
+    def tokens_en_cache(self, mensajes):
+        # Longitud del prefijo más largo (en mensajes completos) ya visto en otra petición
+        aciertos = 0
+        huella = hashlib.sha256()
+        with self.lock:
+            for numero, mensaje in enumerate(mensajes, 1):
+                huella.update(json.dumps(mensaje, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+                clave = huella.hexdigest()
+                if clave in self.prefijos:
+                    self.prefijos.move_to_end(clave)
+                    aciertos = self.tokens_mensajes(mensajes[:numero])
+                else:
+                    self.prefijos[clave] = True
+            while len(self.prefijos) > MAX_PREFIJOS:
+                self.prefijos.popitem(last=False)
+        return aciertos
+
+    def fallo(self):
+        with self.lock:
+            self.peticiones += 1
+            tirada = self.aleatorio.random()
+        if tirada < self.tasa_429:
+            return HTTPStatus.TOO_MANY_REQUESTS, "Rate limit reached (simulado)"
+        if tirada < self.tasa_429 + self.tasa_errores:
+            return HTTPStatus.INTERNAL_SERVER_ERROR, "Internal error (simulado)"
+        return None
+
+    def fragmentos(self, mensajes, maximo):
+        # Texto determinista según la petición, en fragmentos de una palabra (≈ un token)
+        semilla = hashlib.sha256(json.dumps(mensajes, ensure_ascii=False).encode("utf-8")).hexdigest()
+        aleatorio = random.Random(semilla)
+        cantidad = min(self.tokens_respuesta, maximo or self.tokens_respuesta)
+        yield f"Respuesta simulada {semilla[:8]}:"
+        for _ in range(cantidad - 1):
+            yield " " + aleatorio.choice(PALABRAS)
+
+def uso(simulacion, mensajes, salida):
+    entrada = simulacion.tokens_mensajes(mensajes)
+    en_cache = simulacion.tokens_en_cache(mensajes)
+    return {
+        "prompt_tokens": entrada,
+        "completion_tokens": salida,
+        "total_tokens": entrada + salida,
+        "prompt_cache_hit_tokens": en_cache,
+        "prompt_cache_miss_tokens": entrada - en_cache
+    }
+
+class ProveedorSimulado:
+    def __init__(self, simulacion, host="127.0.0.1", puerto=8700):
+        self.simulacion = simulacion
+        self.host = host
+        self.puerto = puerto
+        self.servidor = None
+
+    async def iniciar(self):
+        self.servidor = await asyncio.start_server(self.atender, self.host, self.puerto)
+        self.puerto = self.servidor.sockets[0].getsockname()[1]
+        return self.servidor
+
+    async def atender(self, lector, escritor):
+        try:
+            while True:
+                try:
+                    peticion = await leer_peticion(lector, MAX_CUERPO_BYTES)
+                except ErrorPeticion as e:
+                    await enviar_json(escritor, e.estado, {"error": {"message": str(e)}}, mantener=False)
+                    break
+                if peticion is None:
+                    break
+                if not await self.responder(escritor, *peticion):
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
+        finally:
+            escritor.close()
+
+    async def responder(self, escritor, metodo, ruta, cabeceras, cuerpo, mantener):
+        if metodo != "POST" or ruta not in RUTAS_CHAT:
+            await enviar_json(escritor, HTTPStatus.NOT_FOUND, {"error": {"message": f"Ruta desconocida: {ruta}"}}, mantener)
+            return mantener
+
+        try:
+            datos = json.loads(cuerpo or b"{}")
+            mensajes = datos["messages"]
+            modelo = datos.get("model", "simulado")
+        except (ValueError, KeyError):
+            await enviar_json(escritor, HTTPStatus.BAD_REQUEST, {"error": {"message": "Cuerpo no válido"}}, mantener)
+            return mantener
+
+        simulacion = self.simulacion
+        fallo = simulacion.fallo()
+        await asyncio.sleep(simulacion.latencia)
+        if fallo is not None:
+            estado, mensaje = fallo
+            extra = {"Retry-After": "1"} if estado == HTTPStatus.TOO_MANY_REQUESTS else None
+            await enviar_json(escritor, estado, {"error": {"message": mensaje, "type": "simulado"}}, mantener, extra)
+            return mantener
+
+        identificador = f"sim-{uuid.uuid4().hex[:12]}"
+        creado = int(time.time())
+        pausa = 1.0 / simulacion.tokens_por_segundo if simulacion.tokens_por_segundo else 0
+        fragmentos = list(simulacion.fragmentos(mensajes, datos.get("max_tokens")))
+
+        if not datos.get("stream"):
+            await asyncio.sleep(pausa * len(fragmentos))
+            await enviar_json(escritor, HTTPStatus.OK, {
+                "id": identificador, "object": "chat.completion", "created": creado, "model": modelo,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(fragmentos)}, "finish_reason": "stop"}],
+                "usage": uso(simulacion, mensajes, len(fragmentos))
+            }, mantener)
+            return mantener
+
+        escritor.write((
+            "HTTP/1.1 200 OK\r\n"
+            "Content-Type: text/event-stream\r\n"
+            "Cache-Control: no-cache\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode("latin-1"))
+        for numero, fragmento in enumerate(fragmentos):
+            delta = {"role": "assistant", "content": fragmento} if numero == 0 else {"content": fragmento}
+            escritor.write(evento_sse({
+                "id": identificador, "object": "chat.completion.chunk", "created": creado, "model": modelo,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}]
+            }))
+            await escritor.drain()
+            await asyncio.sleep(pausa)
+        # El último fragmento lleva el motivo de fin y el consumo, como en ambas APIs
+        escritor.write(evento_sse({
+            "id": identificador, "object": "chat.completion.chunk", "created": creado, "model": modelo,
+            "choices": [{"index": 0, "delta": {"content": ""}, "finish_reason": "stop"}],
+            "usage": uso(simulacion, mensajes, len(fragmentos))
+        }))
+        escritor.write(b"data: [DONE]\n\n")
+        await escritor.drain()
+        return False
+
+def iniciar_en_segundo_plano(simulacion, host="127.0.0.1", puerto=0):
+    # Arranca el servidor en un hilo con su propio bucle y devuelve la URL base
+    listo = threading.Event()
+    proveedor = ProveedorSimulado(simulacion, host, puerto)
+
+    def ejecutar():
+        bucle = asyncio.new_event_loop()
+        bucle.run_until_complete(proveedor.iniciar())
+        listo.set()
+        bucle.run_forever()
+
+    threading.Thread(target=ejecutar, name="proveedor-simulado", daemon=True).start()
+    listo.wait()
+    return f"http://{host}:{proveedor.puerto}"
+
+def argumentos_simulacion(parser):
+    parser.add_argument("--latencia", type=float, default=0.2, help="Segundos hasta el primer token")
+    parser.add_argument("--tokens-por-segundo", type=float, default=50.0)
+    parser.add_argument("--tokens-respuesta", type=int, default=200)
+    parser.add_argument("--tasa-errores", type=float, default=0.0, help="Fracción de peticiones que responden 500")
+    parser.add_argument("--tasa-429", type=float, default=0.0, help="Fracción de peticiones que responden 429")
+    parser.add_argument("--semilla", type=int, default=None)
+
+def simulacion_desde(args):
+    return Simulacion(args.latencia, args.tokens_por_segundo, args.tokens_respuesta, args.tasa_errores, args.tasa_429, args.semilla)
+
+async def servir(simulacion, host, puerto):
+    proveedor = ProveedorSimulado(simulacion, host, puerto)
+    servidor = await proveedor.iniciar()
+    print(f"Proveedor simulado escuchando en http://{host}:{proveedor.puerto}", file=sys.stderr)
+    async with servidor:
+        await servidor.serve_forever()
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="Proveedor de LLM simulado (API de chat compatible con OpenAI y Mistral)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--puerto", type=int, default=8700)
+    argumentos_simulacion(parser)
+    args = parser.parse_args(argumentos)
+
+    try:
+        asyncio.run(servir(simulacion_desde(args), args.host, args.puerto))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
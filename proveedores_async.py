@@ -0,0 +1,139 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+import httpx
+
+from clientes import URLS_BASE, LIMITES_CONEXION, MAX_CLIENTES, TIEMPO_ESPERA, clase_cliente, huella_clave
+from configuracion import TIEMPO_ESPERA_SEGUNDOS, MAX_TOKENS_SALIDA
+from resiliencia import ErrorGeneracion, circuito, es_reintentable
+from tokens import registrar_uso
+
+class ErrorCarrera(Exception):
+    def __init__(self, errores):
+        self.errores = errores
+        detalle = "; ".join(f"{proveedor}: {error}" for proveedor, error in errores.items())
+        super().__init__(f"Ningún proveedor respondió correctamente ({detalle})")
+
+# Los clientes asíncronos quedan ligados al bucle de eventos que los usa, así
+# que todas las llamadas se ejecutan en un único bucle de fondo por proceso y
+# los pools de conexiones se reutilizan entre llamadas y sesiones. Como en el
+# registro síncrono, el número de clientes está acotado y se expulsa el menos
+# usado; solo el bucle de fondo toca clientes_async, así que no necesita lock
+bucle = None
+lock_bucle = threading.Lock()
+clientes_async = OrderedDict()
+
+def obtener_bucle():
+    global bucle
+    with lock_bucle:
+        if bucle is None:
+            bucle = asyncio.new_event_loop()
+            threading.Thread(target=bucle.run_forever, name="contelia-async", daemon=True).start()
+        return bucle
+
+def ejecutar(corrutina, timeout=None):
+    # Ejecuta una corrutina en el bucle de fondo desde código síncrono (p. ej. Streamlit)
+    return asyncio.run_coroutine_threadsafe(corrutina, obtener_bucle()).result(timeout)
+
+def obtener_cliente_async(proveedor, api_key, base_url=None):
+    base_url = base_url or URLS_BASE.get(proveedor)
+    clave = (proveedor, huella_clave(api_key), base_url)
+    if clave in clientes_async:
+        clientes_async.move_to_end(clave)
+    else:
+        Cliente = clase_cliente(proveedor, asincrono=True)
+        http_client = httpx.AsyncClient(limits=LIMITES_CONEXION, timeout=TIEMPO_ESPERA)
+        if proveedor == "DeepSeek":
+            cliente = Cliente(api_key=api_key, base_url=base_url, http_client=http_client, timeout=TIEMPO_ESPERA, max_retries=0)
+        else:
+            cliente = Cliente(api_key=api_key, server_url=base_url, async_client=http_client, timeout_ms=int(TIEMPO_ESPERA_SEGUNDOS * 1000))
+        clientes_async[clave] = (cliente, http_client)
+        # Un cliente expulsado puede tener peticiones en curso en otras
+        # tareas: no se cierra, el recolector libera su pool
+        while len(clientes_async) > MAX_CLIENTES:
+            clientes_async.popitem(last=False)
+    return clientes_async[clave][0]
+
+async def descartar_clientes_async(proveedor, api_key=None):
+    # Igual que en el registro síncrono, los clientes descartados solo salen
+    # del registro: las peticiones en curso terminan y el recolector libera
+    # el pool. Se ejecuta en el bucle de fondo, el único que toca clientes_async
+    huella = huella_clave(api_key) if api_key is not None else None
+    for clave in list(clientes_async):
+        if clave[0] == proveedor and (huella is None or clave[1] == huella):
+            del clientes_async[clave]
+
+def descartar_cliente_async(proveedor, api_key=None):
+    if bucle is not None:
+        ejecutar(descartar_clientes_async(proveedor, api_key))
+
+async def completar_async(proveedor, api_key, modelo, mensajes, sesion=None):
+    cliente = obtener_cliente_async(proveedor, api_key)
+    if proveedor == "Mistral":
+        respuesta = await cliente.chat.complete_async(model=modelo, messages=mensajes, max_tokens=MAX_TOKENS_SALIDA)
+    else:
+        respuesta = await cliente.chat.completions.create(model=modelo, messages=mensajes, max_tokens=MAX_TOKENS_SALIDA, stream=False)
+    registrar_uso(sesion, proveedor, modelo, respuesta.usage)
+    return respuesta.choices[0].message.content
+
+async def completar_medido(proveedor, api_key, modelo, mensajes, sesion=None):
+    # Pasa por el mismo circuito que las llamadas síncronas: con el circuito
+    # abierto la tarea falla con CircuitoAbierto sin llamar al proveedor, y el
+    # resultado de cada llamada se registra al terminar. Si la tarea se
+    # cancela (otro proveedor ganó la carrera) no se registra nada, pero la
+    # prueba del estado semiabierto se suelta
+    circuito_proveedor = circuito(proveedor)
+    prueba = circuito_proveedor.permitir()
+    registrado = False
+    inicio = time.monotonic()
+    try:
+        try:
+            resultado = await completar_async(proveedor, api_key, modelo, mensajes, sesion)
+        except ErrorGeneracion:
+            raise
+        except Exception as e:
+            registrado = True
+            if es_reintentable(e):
+                circuito_proveedor.registrar_fallo()
+            else:
+                circuito_proveedor.registrar_exito()
+            raise
+        registrado = True
+        circuito_proveedor.registrar_exito()
+    finally:
+        if prueba and not registrado:
+            circuito_proveedor.liberar_prueba()
+    return {"proveedor": proveedor, "resultado": resultado, "duracion": time.monotonic() - inicio}
+
+async def carrera(solicitudes):
+    # Devuelve la primera respuesta correcta y cancela el resto de peticiones
+    tareas = {
+        asyncio.create_task(completar_medido(*solicitud)): solicitud[0]
+        for solicitud in solicitudes
+    }
+    pendientes = set(tareas)
+    errores = {}
+    try:
+        while pendientes:
+            terminadas, pendientes = await asyncio.wait(pendientes, return_when=asyncio.FIRST_COMPLETED)
+            for tarea in terminadas:
+                if tarea.exception() is None:
+                    return tarea.result()
+                errores[tareas[tarea]] = tarea.exception()
+        raise ErrorCarrera(errores)
+    finally:
+        for tarea in pendientes:
+            tarea.cancel()
+
+async def comparar(solicitudes):
+    # Todas las peticiones en paralelo: el tiempo total es el del proveedor más lento
+    async def completar_sin_fallar(proveedor, api_key, modelo, mensajes, sesion=None):
+        inicio = time.monotonic()
+        try:
+            return {**await completar_medido(proveedor, api_key, modelo, mensajes, sesion), "error": None}
+        except Exception as e:
+            return {"proveedor": proveedor, "resultado": None, "error": str(e), "duracion": time.monotonic() - inicio}
+
+    return list(await asyncio.gather(*(completar_sin_fallar(*solicitud) for solicitud in solicitudes)))
@@ -0,0 +1,177 @@
+import random
+import threading
+import time
+
+from configuracion import (
+    TIEMPO_ESPERA_SEGUNDOS, REINTENTOS, ESPERA_BASE_SEGUNDOS, ESPERA_MAXIMA_SEGUNDOS,
+    CIRCUITO_UMBRAL_FALLOS, CIRCUITO_RECUPERACION_SEGUNDOS
+)
+
+CODIGOS_REINTENTABLES = {408, 409, 429, 500, 502, 503, 504}
+
+class ErrorGeneracion(Exception):
+    pass
+
+class CircuitoAbierto(ErrorGeneracion):
+    def __init__(self, proveedor, segundos):
+        super().__init__(f"{proveedor} no está disponible temporalmente por fallos repetidos; reintenta en {segundos:.0f} s")
+
+class Circuito:
+    # Cerrado: se permiten llamadas. Abierto: se rechazan hasta que pasa el
+    # tiempo de recuperación. Semiabierto: se deja pasar una llamada de prueba
+    def __init__(self, proveedor, umbral=CIRCUITO_UMBRAL_FALLOS, recuperacion=CIRCUITO_RECUPERACION_SEGUNDOS):
+        self.proveedor = proveedor
+        self.umbral = umbral
+        self.recuperacion = recuperacion
+        self.fallos = 0
+        self.abierto_desde = None
+        self.prueba_en_curso = False
+        self.lock = threading.Lock()
+
+    def estado(self):
+        if self.abierto_desde is None:
+            return "cerrado"
+        if time.monotonic() - self.abierto_desde < self.recuperacion:
+            return "abierto"
+        return "semiabierto"
+
+    def permitir(self):
+        # Devuelve True si la llamada es la prueba del estado semiabierto
+        with self.lock:
+            estado = self.estado()
+            if estado == "cerrado":
+                return False
+            if estado == "semiabierto" and not self.prueba_en_curso:
+                self.prueba_en_curso = True
+                return True
+            restante = self.recuperacion - (time.monotonic() - self.abierto_desde)
+            raise CircuitoAbierto(self.proveedor, max(restante, 0))
+
+    def registrar_exito(self):
+        with self.lock:
+            self.fallos = 0
+            self.abierto_desde = None
+            self.prueba_en_curso = False
+
+    def registrar_fallo(self):
+        with self.lock:
+            self.fallos += 1
+            if self.prueba_en_curso or self.fallos >= self.umbral:
+                self.abierto_desde = time.monotonic()
+            self.prueba_en_curso = False
+
+    def liberar_prueba(self):
+        # La prueba terminó sin decir nada del proveedor (error propio,
+        # ejecución detenida, stream cerrado): otra llamada podrá probar
+        with self.lock:
+            self.prueba_en_curso = False
+
+circuitos = {}
+lock_circuitos = threading.Lock()
+
+def circuito(proveedor):
+    with lock_circuitos:
+        if proveedor not in circuitos:
+            circuitos[proveedor] = Circuito(proveedor)
+        return circuitos[proveedor]
+
+def es_reintentable(error):
+    codigo = getattr(error, "status_code", None)
+    if codigo is not None:
+        return codigo in CODIGOS_REINTENTABLES
+    # Errores de red y de tiempo de espera de httpx, openai y mistralai
+    nombre = type(error).__name__
+    return "Timeout" in nombre or "Connection" in nombre or "Connect" in nombre
+
+def espera(intento):
+    # Backoff exponencial con jitter completo
+    return random.uniform(0, min(ESPERA_MAXIMA_SEGUNDOS, ESPERA_BASE_SEGUNDOS * 2 ** intento))
+
+def llamar_con_reintentos(proveedor, funcion, intentos=REINTENTOS, plazo=TIEMPO_ESPERA_SEGUNDOS):
+    limite = time.monotonic() + plazo
+    circuito_proveedor = circuito(proveedor)
+    intento = 0
+    while True:
+        prueba = circuito_proveedor.permitir()
+        registrado = False
+        try:
+            try:
+                resultado = funcion()
+            except ErrorGeneracion:
+                # Errores propios (cola llena, presupuesto): no dicen nada del
+                # proveedor, pero si la llamada era la prueba hay que soltarla
+                registrado = True
+                if prueba:
+                    circuito_proveedor.liberar_prueba()
+                raise
+            except Exception as e:
+                registrado = True
+                if not es_reintentable(e):
+                    circuito_proveedor.registrar_exito()
+                    raise
+                circuito_proveedor.registrar_fallo()
+                pausa = espera(intento)
+                intento += 1
+                if intento >= intentos or time.monotonic() + pausa >= limite:
+                    raise
+            else:
+                registrado = True
+                circuito_proveedor.registrar_exito()
+                return resultado
+        finally:
+            # Cualquier otra salida (incluidas las BaseException de Streamlit
+            # o un GeneratorExit) no puede dejar el circuito bloqueado
+            if prueba and not registrado:
+                circuito_proveedor.liberar_prueba()
+        time.sleep(pausa)
+
+def transmitir_con_reintentos(proveedor, crear_stream, intentos=REINTENTOS, plazo=TIEMPO_ESPERA_SEGUNDOS):
+    # Solo se reintenta hasta recibir el primer fragmento: una vez mostrado
+    # texto al usuario no se puede repetir la respuesta
+    def primer_fragmento():
+        stream = iter(crear_stream())
+        return stream, next(stream, None)
+
+    stream, primero = llamar_con_reintentos(proveedor, primer_fragmento, intentos, plazo)
+    if primero is None:
+        return
+    yield primero
+    try:
+        yield from stream
+    except Exception as e:
+        if es_reintentable(e):
+            circuito(proveedor).registrar_fallo()
+        raise
+
+def describir_error(proveedor, error):
+    if isinstance(error, ErrorGeneracion):
+        return str(error)
+    return f"{proveedor}: {error}"
+
+def con_respaldo(proveedores, funcion):
+    # Prueba los proveedores en orden hasta que uno responde
+    errores = []
+    for proveedor in proveedores:
+        try:
+            return funcion(proveedor)
+        except Exception as e:
+            errores.append(describir_error(proveedor, e))
+    raise ErrorGeneracion("; ".join(errores))
+
+def transmitir_con_respaldo(proveedores, crear_stream):
+    errores = []
+    for proveedor in proveedores:
+        try:
+            stream = iter(crear_stream(proveedor))
+            primero = next(stream, None)
+        except Exception as e:
+            errores.append(describir_error(proveedor, e))
+            continue
+        if primero is not None:
+            yield primero
+        try:
+            yield from stream
+        except Exception as e:
+            raise ErrorGeneracion(describir_error(proveedor, e)) from e
+        return
+    raise ErrorGeneracion("; ".join(errores))
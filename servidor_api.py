@@ -0,0 +1,351 @@
+import argparse
+import asyncio
+import hmac
+import json
+import re
+import sys
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+
+from starlette.applications import Starlette
+from starlette.exceptions import HTTPException
+from starlette.middleware import Middleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import nucleo
+import observabilidad
+import plantillas
+from configuracion import API_HOST, API_PUERTO, API_TOKEN, API_HILOS, API_MAX_CUERPO_BYTES, API_MAX_CABECERAS_BYTES
+from servidor_http import ErrorPeticion, MAX_CABECERAS, TIEMPO_INACTIVIDAD_SEGUNDOS, evento_sse
+from planificador import ColaLlena, planificador
+from resiliencia import ErrorGeneracion, circuito
+from tokens import PresupuestoExcedido
+
+# API HTTP sin Streamlit para clientes automáticos (p. ej. el CMS). Usa el
+# mismo núcleo que la interfaz, así que comparte caché, clientes y planificador.
+# Es una aplicación ASGI (Starlette) servida con uvicorn, que ya instala Streamlit.
+#
+#   GET  /salud
+#   GET  /metricas             métricas en formato de texto de Prometheus
+#   POST /v1/contenido         {"tema", "tipo_contenido", "tipo_respuesta", "proveedor"}
+#   POST /v1/ideas             {"tema", "audiencia", "objetivo", "proveedor"}
+#   POST /v1/codigo            {"descripcion", "lenguaje", "solo_codigo", "opciones", "proveedor"}
+#   POST /v1/codigo/mejora     {"tipo", "lenguaje", "codigo", "indicaciones", "proveedor"}
+#
+# "tipo_contenido" y "lenguaje" tienen que ser de los definidos en las plantillas.
+# Todas las rutas /v1 aceptan "ignorar_cache" y "respaldo", y tienen una
+# variante /stream que devuelve la respuesta como Server-Sent Events. Las API
+# keys se envían en las cabeceras X-DeepSeek-Key / X-Mistral-Key o se toman
+# del entorno; X-Cliente identifica al cliente en el planificador y en el consumo.
+# X-Peticion fija el identificador de la petición en los registros JSON (si no
+# se envía o no es de letras, dígitos, - y _, se genera uno) y se devuelve en
+# la respuesta.
+
+LATIDO_SEGUNDOS = 15
+FIN_STREAM = object()
+IDENTIFICADOR_VALIDO = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+def campo(datos, nombre, obligatorio=True):
+    valor = datos.get(nombre, "")
+    if not isinstance(valor, str):
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"El campo '{nombre}' debe ser un texto")
+    if obligatorio and not valor.strip():
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"Falta el campo '{nombre}'")
+    return valor
+
+def opcion(datos, nombre, validas):
+    # Los valores que acaban como etiqueta "tipo" en las métricas se limitan
+    # a los de las plantillas: un texto libre del cliente crearía una serie
+    # nueva por cada valor distinto
+    valor = campo(datos, nombre)
+    if valor not in validas:
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"Valores válidos para '{nombre}': {', '.join(validas)}")
+    return valor
+
+def proveedor_de(datos):
+    proveedor = datos.get("proveedor") or nucleo.PROVEEDORES[0]
+    if proveedor not in nucleo.PROVEEDORES:
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"Proveedor no soportado: {proveedor}")
+    return proveedor
+
+# Cada ruta traduce el cuerpo JSON a un generador del núcleo y sus argumentos
+
+def preparar_contenido(datos):
+    tipo_contenido = opcion(datos, "tipo_contenido", plantillas.actuales().tipos_contenido)
+    prompt = nucleo.construir_prompt_contenido(tipo_contenido, campo(datos, "tema"), campo(datos, "tipo_respuesta"))
+    return nucleo.generar_texto, nucleo.generar_texto_stream, (prompt, proveedor_de(datos), tipo_contenido)
+
+def preparar_ideas(datos):
+    prompt = nucleo.construir_prompt_ideas(campo(datos, "tema"), campo(datos, "audiencia"), campo(datos, "objetivo"))
+    return nucleo.generar_texto, nucleo.generar_texto_stream, (prompt, proveedor_de(datos), plantillas.TIPO_IDEAS)
+
+def preparar_codigo(datos):
+    lenguaje = opcion(datos, "lenguaje", plantillas.actuales().lenguajes)
+    solo_codigo = bool(datos.get("solo_codigo"))
+    opciones = datos.get("opciones") or []
+    opciones_codigo = plantillas.actuales().opciones_codigo
+    if not isinstance(opciones, list) or any(opcion not in opciones_codigo for opcion in opciones):
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"Opciones válidas: {', '.join(opciones_codigo)}")
+    if not solo_codigo and not opciones:
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, "Indica 'solo_codigo' o al menos una opción de generación")
+    prompt = nucleo.construir_prompt_codigo(lenguaje, campo(datos, "descripcion"), solo_codigo, set(opciones))
+    return nucleo.generar_codigo, nucleo.generar_codigo_stream, (prompt, proveedor_de(datos), lenguaje)
+
+def preparar_mejora(datos):
+    tipo_mejora = campo(datos, "tipo")
+    mejoras_codigo = plantillas.actuales().mejoras_codigo
+    if tipo_mejora != "personalizada" and tipo_mejora not in mejoras_codigo:
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"Tipos de mejora: {', '.join([*mejoras_codigo, 'personalizada'])}")
+    lenguaje = opcion(datos, "lenguaje", plantillas.actuales().lenguajes)
+    indicaciones = campo(datos, "indicaciones", obligatorio=tipo_mejora == "personalizada")
+    prompt = nucleo.construir_prompt_mejora(tipo_mejora, lenguaje, campo(datos, "codigo"), indicaciones)
+    return nucleo.generar_codigo, nucleo.generar_codigo_stream, (prompt, proveedor_de(datos), lenguaje)
+
+RUTAS = {
+    "/v1/contenido": preparar_contenido,
+    "/v1/ideas": preparar_ideas,
+    "/v1/codigo": preparar_codigo,
+    "/v1/codigo/mejora": preparar_mejora
+}
+
+def estado_error(error):
+    if isinstance(error, ErrorPeticion):
+        return error.estado
+    if isinstance(error, ColaLlena):
+        return HTTPStatus.TOO_MANY_REQUESTS
+    if isinstance(error, PresupuestoExcedido):
+        return HTTPStatus.REQUEST_ENTITY_TOO_LARGE
+    if isinstance(error, ErrorGeneracion):
+        return HTTPStatus.BAD_GATEWAY
+    return HTTPStatus.INTERNAL_SERVER_ERROR
+
+def respuesta_error(error):
+    estado = estado_error(error)
+    extra = {"Retry-After": "5"} if estado == HTTPStatus.TOO_MANY_REQUESTS else None
+    mensaje = str(error) if estado != HTTPStatus.INTERNAL_SERVER_ERROR else "Error interno del servidor"
+    return JSONResponse({"error": mensaje}, estado, extra)
+
+async def error_http(peticion, error):
+    # Rutas y métodos que no existen, con el mismo formato JSON que el resto
+    if error.status_code == HTTPStatus.NOT_FOUND:
+        mensaje = f"Ruta desconocida: {peticion.url.path}"
+    elif error.status_code == HTTPStatus.METHOD_NOT_ALLOWED:
+        mensaje = f"Usa {(error.headers or {}).get('Allow', 'otro método')}"
+    else:
+        mensaje = error.detail
+    return JSONResponse({"error": mensaje}, error.status_code, error.headers)
+
+def identificador_peticion(cabeceras):
+    # El identificador del cliente se devuelve en una cabecera y se escribe en
+    # los registros: solo se acepta si es un identificador simple
+    recibido = cabeceras.get("x-peticion", "")
+    return recibido if IDENTIFICADOR_VALIDO.fullmatch(recibido) else uuid.uuid4().hex[:16]
+
+class LimiteCabeceras:
+    # h11 solo limita el tamaño de las cabeceras que llegan en varios trozos;
+    # aquí se limitan también su número y su tamaño cuando llegan de golpe
+    def __init__(self, app, max_cabeceras=MAX_CABECERAS, max_bytes=API_MAX_CABECERAS_BYTES):
+        self.app = app
+        self.max_cabeceras = max_cabeceras
+        self.max_bytes = max_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            cabeceras = scope["headers"]
+            if len(cabeceras) > self.max_cabeceras or sum(len(nombre) + len(valor) for nombre, valor in cabeceras) > self.max_bytes:
+                respuesta = JSONResponse({"error": "Cabeceras demasiado grandes"}, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE)
+                await respuesta(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
+
+class ServidorAPI:
+    def __init__(self, token=API_TOKEN, hilos=API_HILOS, max_cuerpo=API_MAX_CUERPO_BYTES):
+        self.token = token
+        self.max_cuerpo = max_cuerpo
+        # El núcleo es bloqueante (SDK síncronos, SQLite, planificador), así que
+        # cada generación ocupa un hilo y el bucle de eventos queda libre para
+        # aceptar y leer conexiones
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="contelia-api")
+        rutas = [
+            Route("/salud", self.salud, methods=["GET"]),
+            Route("/metricas", self.metricas, methods=["GET"])
+        ]
+        for ruta in RUTAS:
+            rutas += [Route(ruta, self.generar, methods=["POST"]), Route(f"{ruta}/stream", self.generar, methods=["POST"])]
+        self.app = Starlette(routes=rutas, middleware=[Middleware(LimiteCabeceras)], exception_handlers={HTTPException: error_http})
+
+    def cerrar(self):
+        self.ejecutor.shutdown(wait=False, cancel_futures=True)
+
+    def autorizado(self, cabeceras):
+        if not self.token:
+            return True
+        recibido = cabeceras.get("authorization", "").removeprefix("Bearer ").strip()
+        return hmac.compare_digest(recibido.encode("utf-8"), self.token.encode("utf-8"))
+
+    def no_autorizado(self):
+        return JSONResponse({"error": "Token no válido"}, HTTPStatus.UNAUTHORIZED, {"WWW-Authenticate": "Bearer"})
+
+    async def leer_cuerpo(self, peticion):
+        # Se corta al superar el máximo aunque el cliente no envíe Content-Length
+        longitud = peticion.headers.get("content-length", "0")
+        if longitud.isdigit() and int(longitud) > self.max_cuerpo:
+            raise ErrorPeticion(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"El cuerpo supera {self.max_cuerpo} bytes")
+        cuerpo = bytearray()
+        async for parte in peticion.stream():
+            cuerpo += parte
+            if len(cuerpo) > self.max_cuerpo:
+                raise ErrorPeticion(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"El cuerpo supera {self.max_cuerpo} bytes")
+        return bytes(cuerpo)
+
+    async def salud(self, peticion):
+        return JSONResponse({
+            "estado": "ok",
+            "circuitos": {proveedor: circuito(proveedor).estado() for proveedor in nucleo.PROVEEDORES},
+            "planificador": planificador.metricas(),
+            "plantillas": {
+                "version": plantillas.actuales().version,
+                "huella": plantillas.actuales().huella,
+                "error_recarga": plantillas.registro.error
+            }
+        })
+
+    async def metricas(self, peticion):
+        if not self.autorizado(peticion.headers):
+            return self.no_autorizado()
+        return Response(observabilidad.metricas.exportar(), media_type=observabilidad.TIPO_CONTENIDO_METRICAS)
+
+    async def generar(self, peticion):
+        if not self.autorizado(peticion.headers):
+            return self.no_autorizado()
+        ruta = peticion.url.path
+        stream = ruta.endswith("/stream")
+        preparar = RUTAS[ruta.removesuffix("/stream")]
+        cabeceras = peticion.headers
+
+        try:
+            datos = json.loads(await self.leer_cuerpo(peticion) or b"{}")
+            if not isinstance(datos, dict):
+                raise ErrorPeticion(HTTPStatus.BAD_REQUEST, "El cuerpo debe ser un objeto JSON")
+            generar, generar_stream, argumentos = preparar(datos)
+            claves = nucleo.claves_entorno()
+            for proveedor in nucleo.PROVEEDORES:
+                claves[proveedor] = cabeceras.get(f"x-{proveedor.lower()}-key") or claves[proveedor]
+            respaldo = bool(datos.get("respaldo"))
+            if not claves.get(argumentos[1]) and not (respaldo and any(claves.values())):
+                raise ErrorPeticion(HTTPStatus.BAD_REQUEST, f"Falta la API key de {argumentos[1]}")
+        except ValueError:
+            # JSON mal formado o que no es UTF-8
+            return JSONResponse({"error": "El cuerpo no es JSON válido"}, HTTPStatus.BAD_REQUEST)
+        except ErrorPeticion as e:
+            return respuesta_error(e)
+
+        argumentos = (*argumentos, claves, bool(datos.get("ignorar_cache")), respaldo, cabeceras.get("x-cliente") or "api")
+        identificador = identificador_peticion(cabeceras)
+        if stream:
+            return await self.transmitir(generar_stream, argumentos, identificador)
+
+        def ejecutar():
+            # El identificador se fija en el hilo que ejecuta la generación
+            with observabilidad.peticion(identificador):
+                return generar(*argumentos)
+
+        bucle = asyncio.get_running_loop()
+        try:
+            resultado = await bucle.run_in_executor(self.ejecutor, ejecutar)
+        except Exception as e:
+            return respuesta_error(e)
+        return JSONResponse({"resultado": resultado}, headers={"X-Peticion": identificador})
+
+    async def transmitir(self, generar_stream, argumentos, identificador):
+        # El generador del núcleo se consume en un hilo y sus fragmentos pasan
+        # al bucle por una cola; si el cliente se desconecta se deja de leer
+        # del proveedor en el siguiente fragmento
+        bucle = asyncio.get_running_loop()
+        cola = asyncio.Queue()
+        cancelado = threading.Event()
+
+        def producir():
+            fragmentos = generar_stream(*argumentos)
+            try:
+                with observabilidad.peticion(identificador):
+                    for fragmento in fragmentos:
+                        if cancelado.is_set():
+                            break
+                        bucle.call_soon_threadsafe(cola.put_nowait, fragmento)
+            except Exception as e:
+                bucle.call_soon_threadsafe(cola.put_nowait, e)
+            finally:
+                with observabilidad.peticion(identificador):
+                    fragmentos.close()
+                bucle.call_soon_threadsafe(cola.put_nowait, FIN_STREAM)
+
+        bucle.run_in_executor(self.ejecutor, producir)
+        try:
+            # Los errores previos al primer fragmento (cola llena, presupuesto,
+            # proveedor caído) se devuelven con su código HTTP
+            elemento = await cola.get()
+        except BaseException:
+            cancelado.set()
+            raise
+        if isinstance(elemento, Exception):
+            cancelado.set()
+            return respuesta_error(elemento)
+
+        async def eventos(elemento):
+            # Starlette cancela el generador si el cliente se desconecta
+            try:
+                while elemento is not FIN_STREAM:
+                    if isinstance(elemento, Exception):
+                        yield evento_sse({"error": str(elemento)}, "error")
+                    elif elemento is not None:
+                        yield evento_sse({"texto": elemento})
+                    try:
+                        elemento = await asyncio.wait_for(cola.get(), LATIDO_SEGUNDOS)
+                    except asyncio.TimeoutError:
+                        # Comentario SSE para mantener viva la conexión y detectar desconexiones
+                        yield b": latido\n\n"
+                        elemento = None
+                yield evento_sse({}, "fin")
+            finally:
+                cancelado.set()
+
+        return StreamingResponse(
+            eventos(elemento), media_type="text/event-stream; charset=utf-8",
+            headers={"Cache-Control": "no-cache", "X-Peticion": identificador}
+        )
+
+async def servir(host=API_HOST, puerto=API_PUERTO, hilos=API_HILOS):
+    import uvicorn
+
+    servidor = ServidorAPI(hilos=hilos)
+    # h11 limita el tamaño de la línea de petición y de todas las cabeceras
+    # juntas, y rechaza los saltos de línea sueltos dentro de ellas
+    configuracion = uvicorn.Config(
+        servidor.app, host=host, port=puerto, http="h11", h11_max_incomplete_event_size=API_MAX_CABECERAS_BYTES,
+        timeout_keep_alive=TIEMPO_INACTIVIDAD_SEGUNDOS, log_level="warning"
+    )
+    print(f"API de ContelIA escuchando en http://{host}:{puerto}", file=sys.stderr)
+    try:
+        await uvicorn.Server(configuracion).serve()
+    finally:
+        servidor.cerrar()
+
+def main(argumentos=None):
+    parser = argparse.ArgumentParser(description="API HTTP de ContelIA (JSON y Server-Sent Events)")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--puerto", type=int, default=API_PUERTO)
+    parser.add_argument("--hilos", type=int, default=API_HILOS, help="Generaciones simultáneas como máximo")
+    args = parser.parse_args(argumentos)
+
+    try:
+        asyncio.run(servir(args.host, args.puerto, args.hilos))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+import asyncio
+import json
+from http import HTTPStatus
+
+# Utilidades HTTP/1.1 mínimas sobre asyncio para el proveedor simulado
+# (proveedor_simulado.py) y el puerto de métricas (observabilidad.py); la API
+# pública (servidor_api.py) usa Starlette y uvicorn y de aquí solo toma los
+# errores y el formato SSE. No depende de configuracion.py para que el
+# simulador pueda arrancarse antes de fijar la configuración de la aplicación
+
+TIEMPO_INACTIVIDAD_SEGUNDOS = 30
+# Cada línea ya está limitada por el búfer del StreamReader (64 KB)
+MAX_CABECERAS = 100
+
+class ErrorPeticion(Exception):
+    def __init__(self, estado, mensaje):
+        self.estado = estado
+        super().__init__(mensaje)
+
+async def leer_peticion(lector, max_cuerpo):
+    try:
+        linea = await asyncio.wait_for(lector.readline(), TIEMPO_INACTIVIDAD_SEGUNDOS)
+    except asyncio.TimeoutError:
+        return None
+    if not linea:
+        return None
+
+    partes = linea.decode("latin-1").split()
+    if len(partes) != 3 or not partes[2].startswith("HTTP/1."):
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, "Línea de petición no válida")
+    metodo, objetivo, version = partes
+
+    cabeceras = {}
+    for numero in range(MAX_CABECERAS + 1):
+        linea = await lector.readline()
+        if linea in (b"\r\n", b"\n", b""):
+            break
+        if numero == MAX_CABECERAS:
+            raise ErrorPeticion(HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE, f"Más de {MAX_CABECERAS} cabeceras")
+        nombre, _, valor = linea.decode("latin-1").partition(":")
+        cabeceras[nombre.strip().lower()] = valor.strip()
+
+    if "chunked" in cabeceras.get("transfer-encoding", "").lower():
+        raise ErrorPeticion(HTTPStatus.LENGTH_REQUIRED, "Se requiere Content-Length")
+    try:
+        longitud = int(cabeceras.get("content-length", 0))
+    except ValueError:
+        raise ErrorPeticion(HTTPStatus.BAD_REQUEST, "Content-Length no válido")
+    if longitud > max_cuerpo:
+        raise ErrorPeticion(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"El cuerpo supera {max_cuerpo} bytes")
+    cuerpo = await lector.readexactly(longitud) if longitud else b""
+
+    mantener = cabeceras.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+    return metodo, objetivo.split("?", 1)[0], cabeceras, cuerpo, mantener
+
+async def enviar(escritor, estado, cuerpo=b"", tipo="application/json; charset=utf-8", mantener=True, extra=None):
+    cabeceras = [
+        f"HTTP/1.1 {estado.value} {estado.phrase}",
+        f"Content-Type: {tipo}",
+        f"Content-Length: {len(cuerpo)}",
+        f"Connection: {'keep-alive' if mantener else 'close'}"
+    ]
+    cabeceras += [f"{nombre}: {valor}" for nombre, valor in (extra or {}).items()]
+    escritor.write(("\r\n".join(cabeceras) + "\r\n\r\n").encode("latin-1") + cuerpo)
+    await escritor.drain()
+
+async def enviar_json(escritor, estado, datos, mantener=True, extra=None):
+    await enviar(escritor, estado, json.dumps(datos, ensure_ascii=False).encode("utf-8"), mantener=mantener, extra=extra)
+
+def evento_sse(datos, evento=None):
+    prefijo = f"event: {evento}\n" if evento else ""
+    return f"{prefijo}data: {json.dumps(datos, ensure_ascii=False)}\n\n".encode("utf-8")
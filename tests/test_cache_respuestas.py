@@ -0,0 +1,94 @@
+import threading
+import time
+
+import pytest
+
+import cache_respuestas
+from cache_respuestas import CacheRespuestas
+
+@pytest.fixture
+def reloj(monkeypatch):
+    # Reloj manual para la caducidad y el orden de acceso
+    ahora = [1000.0]
+    monkeypatch.setattr(cache_respuestas.time, "time", lambda: ahora[0])
+    return ahora
+
+def nueva_cache(tmp_path, **opciones):
+    return CacheRespuestas(ruta=str(tmp_path / "respuestas.sqlite"), **opciones)
+
+def test_las_entradas_caducan_con_el_ttl(tmp_path, reloj):
+    cache = nueva_cache(tmp_path, ttl=60)
+    cache.guardar("a", "respuesta")
+    reloj[0] += 59
+    assert cache.obtener("a") == "respuesta"
+    reloj[0] += 2
+    assert cache.obtener("a") is None
+
+def test_desaloja_las_menos_usadas(tmp_path, reloj):
+    cache = nueva_cache(tmp_path, max_entradas=2)
+    cache.guardar("a", "1")
+    reloj[0] += 1
+    cache.guardar("b", "2")
+    reloj[0] += 1
+    assert cache.obtener("a") == "1"
+    reloj[0] += 1
+    cache.guardar("c", "3")
+    assert cache.obtener("b") is None
+    assert cache.obtener("a") == "1"
+    assert cache.obtener("c") == "3"
+
+def test_desaloja_por_tamano(tmp_path, reloj):
+    cache = nueva_cache(tmp_path, max_bytes=10)
+    cache.guardar("a", "x" * 6)
+    reloj[0] += 1
+    cache.guardar("b", "y" * 6)
+    assert cache.obtener("a") is None
+    assert cache.obtener("b") == "y" * 6
+
+def test_las_peticiones_identicas_comparten_una_llamada(tmp_path):
+    cache = nueva_cache(tmp_path)
+    empezada = threading.Event()
+    seguir = threading.Event()
+    llamadas = []
+
+    def generar():
+        llamadas.append(1)
+        empezada.set()
+        seguir.wait(5)
+        return "respuesta"
+
+    resultados = []
+    lider = threading.Thread(target=lambda: resultados.append(cache.obtener_o_generar("clave", generar)))
+    lider.start()
+    assert empezada.wait(5)
+    seguidor = threading.Thread(target=lambda: resultados.append(cache.obtener_o_generar("clave", generar)))
+    seguidor.start()
+    time.sleep(0.05)
+    seguir.set()
+    lider.join(5)
+    seguidor.join(5)
+
+    assert len(llamadas) == 1
+    assert sorted(resultados, key=lambda r: r[1]) == [("respuesta", False), ("respuesta", True)]
+    assert cache.en_vuelo == {}
+
+def test_el_error_del_lider_no_queda_en_cache(tmp_path):
+    cache = nueva_cache(tmp_path)
+
+    def fallar():
+        raise RuntimeError("proveedor caído")
+
+    with pytest.raises(RuntimeError):
+        cache.obtener_o_generar("clave", fallar)
+    assert cache.en_vuelo == {}
+    assert cache.obtener_o_generar("clave", lambda: "ok") == ("ok", False)
+
+def test_transmision_cortada_no_guarda_nada(tmp_path):
+    cache = nueva_cache(tmp_path)
+    flujo = cache.transmitir("clave", lambda: iter(["a", "b", "c"]))
+    assert next(flujo) == "a"
+    flujo.close()
+    assert cache.en_vuelo == {}
+    assert cache.obtener("clave") is None
+    assert "".join(cache.transmitir("clave", lambda: iter(["a", "b"]))) == "ab"
+    assert cache.obtener("clave") == "ab"
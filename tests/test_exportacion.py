@@ -0,0 +1,87 @@
+import io
+import json
+import zipfile
+
+import pytest
+
+from cache_respuestas import CacheRespuestas
+from exportacion import clave_registro, exportar, importar, leer_registros, registros_historial
+from historial import HistorialMemoria
+
+RESULTADO_LARGO = "línea, con \"comillas\"\n" * 10000
+
+@pytest.fixture
+def historial():
+    historial = HistorialMemoria()
+    historial.agregar("origen", "Post para Twitter/X", "Un tuit sobre café", "☕ Café, siempre")
+    historial.agregar("origen", "Código Python", "Suma", RESULTADO_LARGO)
+    return historial
+
+def exportado(historial, formato):
+    return exportar(registros_historial(historial, "origen"), formato, io.BytesIO()).getvalue()
+
+def contenido(historial, sesion):
+    return [(entrada["tipo"], entrada["prompt"], entrada["resultado"], round(entrada["creado"], 3)) for entrada in historial.iterar(sesion)]
+
+@pytest.mark.parametrize("formato", ["jsonl", "csv"])
+def test_ida_y_vuelta(historial, formato):
+    datos = exportado(historial, formato)
+    totales = importar(leer_registros(io.BytesIO(datos), f"historial.{formato}"), historial, "destino")
+    assert totales == {"leidos": 2, "historial": 2, "descartados": 0, "cache": 0}
+    assert contenido(historial, "destino") == contenido(historial, "origen")
+
+    # Importar el mismo archivo otra vez no duplica nada
+    totales = importar(leer_registros(io.BytesIO(datos), f"historial.{formato}"), historial, "destino")
+    assert totales["leidos"] == 2 and totales["historial"] == 0
+
+def test_markdown_zip(historial):
+    with zipfile.ZipFile(io.BytesIO(exportado(historial, "zip"))) as archivo:
+        assert archivo.namelist() == ["00001-post-para-twitter-x.md", "00002-codigo-python.md"]
+        primero = archivo.read("00001-post-para-twitter-x.md").decode("utf-8")
+    assert primero.startswith('---\nid: 1\ntipo: "Post para Twitter/X"\n')
+    assert "☕ Café, siempre" in primero and "Un tuit sobre café" in primero
+
+def jsonl(*filas):
+    return io.BytesIO("".join((fila if isinstance(fila, str) else json.dumps(fila)) + "\n" for fila in filas).encode("utf-8"))
+
+VALIDA = {"tipo": "texto", "prompt": "p", "resultado": "r"}
+
+@pytest.mark.parametrize("fila, mensaje", [
+    ("{no es json", "La línea 2 no es JSON válido"),
+    ("[1, 2]", "La línea 2 no es un objeto"),
+    ({"tipo": "texto"}, "La línea 2 no tiene tipo o resultado"),
+    ({**VALIDA, "prompt": {"a": 1}}, "La línea 2 tiene campos que no son texto: prompt"),
+    ({**VALIDA, "creado": "ayer"}, "La línea 2 tiene una fecha no válida: 'ayer'"),
+    ({**VALIDA, "creado": [1]}, "La línea 2 tiene una fecha no válida")
+])
+def test_entrada_mal_formada(fila, mensaje):
+    with pytest.raises(ValueError, match=mensaje):
+        list(leer_registros(jsonl(VALIDA, fila), "historial.jsonl"))
+
+def test_csv_mal_formado():
+    archivo = io.BytesIO("tipo,resultado\ntexto,bien\ntexto,\n".encode("utf-8"))
+    with pytest.raises(ValueError, match="La línea 3 no tiene tipo o resultado"):
+        list(leer_registros(archivo, "historial.csv"))
+
+def test_salida_de_lote_con_errores_y_prompt_reconstruido():
+    fila = {"id": "1", "tipo_contenido": "Post para Twitter/X", "tema": "Café", "tipo_respuesta": "Breve", "proveedor": "DeepSeek", "resultado": "tuit"}
+    registros = list(leer_registros(jsonl(fila, {"id": "2", "error": "cuota agotada"}, ""), "lote.jsonl"))
+    assert len(registros) == 1
+    assert registros[0]["tipo"] == "Post para Twitter/X"
+    assert "Café" in registros[0]["prompt"]
+
+def test_importar_a_la_cache(tmp_path):
+    cache = CacheRespuestas(ruta=str(tmp_path / "respuestas.sqlite"))
+    fila = {"tipo_contenido": "Post para Twitter/X", "tema": "Café", "tipo_respuesta": "Breve", "proveedor": "DeepSeek", "resultado": "tuit"}
+    sin_proveedor = {"tipo": "texto", "prompt": "p", "resultado": "r"}
+    registros = list(leer_registros(jsonl(fila, sin_proveedor), "lote.jsonl"))
+
+    totales = importar(registros, HistorialMemoria(), "destino", cache)
+    assert totales["historial"] == 2 and totales["cache"] == 1
+    assert cache.obtener(clave_registro(registros[0])) == "tuit"
+
+def test_la_retencion_descarta_lo_importado():
+    registros = [{**VALIDA, "prompt": f"p{numero}", "creado": 0.0} for numero in range(3)]
+    registros.append({**VALIDA, "creado": 10**10})
+    totales = importar(registros, HistorialMemoria(dias_retencion=1), "destino")
+    assert totales == {"leidos": 4, "historial": 1, "descartados": 3, "cache": 0}
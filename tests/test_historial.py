@@ -0,0 +1,79 @@
+import sqlite3
+import time
+
+import pytest
+
+from historial import HistorialMemoria, HistorialSQLite
+
+@pytest.fixture(params=["sqlite", "memoria"])
+def crear(request, tmp_path):
+    def crear(**opciones):
+        if request.param == "sqlite":
+            return HistorialSQLite(ruta=str(tmp_path / "historial.sqlite"), **opciones)
+        return HistorialMemoria(**opciones)
+    return crear
+
+def entrada(prompt, resultado="resultado", tipo="texto", creado=None):
+    return {"tipo": tipo, "prompt": prompt, "resultado": resultado, "creado": creado or time.time()}
+
+def test_busqueda_por_palabras(crear):
+    historial = crear()
+    historial.agregar("s1", "texto", "Ideas para un curso de Python", "Diez ideas")
+    historial.agregar("s1", "codigo", "Ordenar una lista", "sorted(lista)")
+    historial.agregar("s2", "texto", "Curso de Python", "Otra sesión")
+
+    assert historial.contar("s1", busqueda="python") == 1
+    assert historial.contar("s1", busqueda="sorted") == 1
+    assert historial.contar("s1", busqueda="curso", tipo="codigo") == 0
+    # Las comillas y operadores no rompen la consulta
+    assert historial.contar("s1", busqueda='"curso OR') == 0
+
+def test_busqueda_completa_por_prefijo_y_tras_eliminar(tmp_path):
+    historial = HistorialSQLite(ruta=str(tmp_path / "historial.sqlite"))
+    if not historial.busqueda_completa:
+        pytest.skip("SQLite sin FTS5")
+    identificador = historial.agregar("s1", "texto", "Programación funcional", "Mapas y filtros")
+    assert historial.contar("s1", busqueda="progra filt") == 1
+    historial.eliminar("s1", identificador)
+    assert historial.contar("s1", busqueda="progra") == 0
+
+def test_retencion_por_numero_y_antiguedad(crear):
+    historial = crear(max_por_sesion=3, dias_retencion=1)
+    for numero in range(5):
+        historial.agregar("s1", "texto", f"prompt {numero}", "resultado")
+    assert [historial.obtener("s1", fila["id"])["prompt"] for fila in historial.listar("s1")] == ["prompt 4", "prompt 3", "prompt 2"]
+
+    insertadas = historial.importar("s1", [entrada("antigua", creado=time.time() - 2 * 86400)])
+    assert historial.conservadas("s1", insertadas) == 0
+    assert historial.contar("s1") == 3
+
+def test_importar_dos_veces_no_duplica(crear):
+    historial = crear()
+    historial.agregar("s1", "texto", "ya estaba", "resultado")
+    entradas = [entrada("ya estaba"), entrada("nueva"), entrada("nueva")]
+
+    assert len(historial.importar("s1", entradas)) == 1
+    assert historial.importar("s1", entradas) == []
+    assert historial.contar("s1") == 2
+    # La misma entrada en otra sesión sí se importa
+    assert len(historial.importar("s2", entradas)) == 2
+
+def test_migracion_completa_la_huella(tmp_path):
+    ruta = str(tmp_path / "historial.sqlite")
+    conexion = sqlite3.connect(ruta)
+    conexion.execute("""
+        CREATE TABLE historial (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, sesion TEXT NOT NULL, tipo TEXT NOT NULL,
+            creado REAL NOT NULL, resumen TEXT NOT NULL, prompt TEXT NOT NULL, resultado TEXT NOT NULL
+        )
+    """)
+    conexion.execute(
+        "INSERT INTO historial (sesion, tipo, creado, resumen, prompt, resultado) VALUES (?, ?, ?, ?, ?, ?)",
+        ("s1", "texto", time.time(), "resultado", "anterior", "resultado")
+    )
+    conexion.commit()
+    conexion.close()
+
+    historial = HistorialSQLite(ruta=ruta)
+    assert historial.importar("s1", [entrada("anterior")]) == []
+    assert historial.contar("s1") == 1
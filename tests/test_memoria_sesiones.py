@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from streamlit import runtime
+
+import memoria_sesiones
+from memoria_sesiones import DepositoDisco, GestorMemoria
+
+class RuntimeFalso:
+    def __init__(self, activas):
+        self.activas = activas
+
+    def is_active_session(self, sesion):
+        return sesion in self.activas
+
+@pytest.fixture
+def activas():
+    return set()
+
+@pytest.fixture
+def gestor(activas, tmp_path, monkeypatch):
+    monkeypatch.setattr(runtime, "exists", lambda: True)
+    monkeypatch.setattr(runtime, "get_instance", lambda: RuntimeFalso(activas))
+    monkeypatch.setattr(memoria_sesiones, "plazo_reconexion", lambda: 120)
+    gestor = GestorMemoria(max_bytes=1000, inactividad=60)
+    gestor.deposito = DepositoDisco(str(tmp_path / "sesiones.sqlite"))
+    return gestor
+
+def preparar(gestor, sesion):
+    # Una sesión con una entrada grande que ya pasó a disco
+    estado = {"grande": "x" * 5000}
+    gestor.entrar(sesion)
+    gestor.recuperar(sesion, estado, "grande")
+    gestor.sesiones[sesion].ultimo_acceso += 1
+    gestor.revisar(sesion, estado)
+    assert "grande" not in estado
+    return estado
+
+def envejecer(gestor, sesion, segundos):
+    gestor.sesiones[sesion].ultimo_acceso = time.time() - segundos
+    gestor.limpiado = 0.0
+
+def test_sesion_activa_inactiva_conserva_lo_que_hay_en_disco(gestor, activas):
+    estado = preparar(gestor, "a")
+    activas.add("a")
+    envejecer(gestor, "a", 3600)
+    gestor.limpiar()
+    assert "a" in gestor.sesiones
+    assert gestor.recuperar("a", estado, "grande") == "x" * 5000
+
+def test_sesion_desconectada_se_conserva_durante_el_plazo_de_reconexion(gestor):
+    preparar(gestor, "a")
+    envejecer(gestor, "a", 90)
+    gestor.limpiar()
+    assert "a" in gestor.sesiones
+
+def test_sesion_cerrada_se_olvida_con_su_disco(gestor):
+    estado = preparar(gestor, "a")
+    envejecer(gestor, "a", 3600)
+    gestor.limpiar()
+    assert "a" not in gestor.sesiones
+    assert gestor.deposito.sacar("a", "grande") is None
+    assert "grande" not in estado
+
+def test_objetos_de_trabajos_en_curso_no_van_a_disco(gestor):
+    estado = {"conversacion": ["x" * 5000]}
+    gestor.entrar("a")
+    gestor.recuperar("a", estado, "conversacion")
+    gestor.sesiones["a"].ultimo_acceso += 1
+    gestor.revisar("a", estado, en_uso=[estado["conversacion"]])
+    assert "conversacion" in estado
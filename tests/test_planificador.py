@@ -0,0 +1,83 @@
+import time
+from collections import deque
+
+import pytest
+
+from planificador import ColaLlena, CuboTokens, Planificador, Turno
+
+def nuevo_planificador(rpm=2):
+    # Límite por proveedor con recarga lenta: solo cuenta la capacidad inicial
+    return Planificador(
+        limites_proveedor={"X": {"rpm": rpm, "tpm": 10**6}, "Y": {"rpm": rpm, "tpm": 10**6}},
+        limites_clave={}
+    )
+
+def encolar(planificador, sesion, proveedor, cantidad=1):
+    turnos = [Turno(sesion, proveedor, "huella", 1) for _ in range(cantidad)]
+    planificador.colas.setdefault((sesion, proveedor), deque()).extend(turnos)
+    return turnos
+
+def despachar(planificador):
+    with planificador.condicion:
+        return planificador.despachar()
+
+def test_las_sesiones_se_atienden_por_turnos():
+    planificador = nuevo_planificador(rpm=2)
+    lote = encolar(planificador, "A", "X", 4)
+    suelta = encolar(planificador, "B", "X")
+
+    despachar(planificador)
+    assert lote[0].concedido and suelta[0].concedido
+    assert not any(turno.concedido for turno in lote[1:])
+    assert planificador.en_cola() == 3
+
+def test_un_proveedor_saturado_no_retiene_a_otro():
+    planificador = nuevo_planificador(rpm=1)
+    encolar(planificador, "A", "X")
+    despachar(planificador)
+
+    bloqueada = encolar(planificador, "A", "X")
+    otra = encolar(planificador, "A", "Y")
+    espera = despachar(planificador)
+    assert otra[0].concedido
+    assert not bloqueada[0].concedido
+    assert espera > 0
+
+def test_posicion_cuenta_solo_el_mismo_proveedor():
+    planificador = nuevo_planificador()
+    lote = encolar(planificador, "A", "X", 3)
+    suelta = encolar(planificador, "B", "X")
+    encolar(planificador, "C", "Y", 5)
+
+    assert planificador.posicion(suelta[0]) == 2
+    assert planificador.posicion(lote[0]) == 2
+    assert planificador.posicion(lote[2]) == 4
+
+def test_tiempo_agotado_sale_de_la_cola():
+    planificador = nuevo_planificador(rpm=1)
+    planificador.adquirir("A", "X", "clave", 0)
+    with pytest.raises(ColaLlena):
+        planificador.adquirir("A", "X", "clave", 0, tiempo_maximo=0.05)
+    assert planificador.colas == {}
+    assert planificador.metricas()["X"]["rechazados"] == 1
+
+def test_cola_llena_rechaza_sin_encolar():
+    planificador = Planificador(limites_proveedor={}, limites_clave={}, max_cola=1)
+    encolar(planificador, "A", "X")
+    with pytest.raises(ColaLlena):
+        planificador.adquirir("B", "X", "clave", 0)
+    assert planificador.en_cola() == 1
+
+def test_se_olvidan_los_cubos_llenos():
+    planificador = nuevo_planificador(rpm=60)
+    ahora = time.monotonic()
+    planificador.cubos[("X",)] = (CuboTokens(60), CuboTokens(10**6))
+    planificador.cubos[("Y",)] = (CuboTokens(60), CuboTokens(10**6))
+    # El cubo de Y se vacía justo antes de la limpieza
+    planificador.cubos[("Y",)][0].recargar(ahora + 60)
+    planificador.cubos[("Y",)][0].consumir(60)
+
+    planificador.limpiar_cubos(ahora + 30)
+    assert set(planificador.cubos) == {("X",), ("Y",)}
+    planificador.limpiar_cubos(ahora + 61)
+    assert set(planificador.cubos) == {("Y",)}
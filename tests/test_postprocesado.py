@@ -0,0 +1,108 @@
+import pytest
+
+from postprocesado import (
+    CacheValidaciones, extraer_bloques, extraer_codigo, extraer_codigo_stream,
+    validar_json, validar_python, validar_respuesta, validar_sql
+)
+
+RESPUESTA = """Aquí tienes la función:
+
+```python
+def suma(a, b):
+    return a + b
+```
+
+Para instalarla:
+
+```bash
+pip install paquete
+```
+
+Y un ejemplo:
+
+````py
+print(suma(1, 2))
+```
+````
+"""
+
+class Fragmentos:
+    # Stream del proveedor que recuerda si se cerró
+    def __init__(self, texto, tamano):
+        self.partes = iter([texto[inicio:inicio + tamano] for inicio in range(0, len(texto), tamano)])
+        self.cerrado = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self.partes)
+
+    def close(self):
+        self.cerrado = True
+
+def test_extrae_solo_los_bloques_del_lenguaje():
+    assert extraer_codigo(RESPUESTA, "Python") == 'def suma(a, b):\n    return a + b\n\nprint(suma(1, 2))\n```'
+    assert [etiqueta for etiqueta, _ in extraer_bloques(RESPUESTA)] == ["python", "bash", "py"]
+
+@pytest.mark.parametrize("tamano", [1, 3, 17, 1000])
+def test_el_stream_extrae_lo_mismo_que_el_texto_completo(tamano):
+    fragmentos = Fragmentos(RESPUESTA, tamano)
+    assert "".join(extraer_codigo_stream(fragmentos, "Python")).strip("\n") == extraer_codigo(RESPUESTA, "Python")
+    assert fragmentos.cerrado
+
+def test_detener_el_stream_cierra_el_del_proveedor():
+    fragmentos = Fragmentos(RESPUESTA, 5)
+    stream = extraer_codigo_stream(fragmentos, "Python")
+    assert next(stream).startswith("def suma")
+    stream.close()
+    assert fragmentos.cerrado
+
+def test_sin_bloques_o_sin_la_etiqueta_esperada():
+    assert extraer_codigo("x = 1\n", "Python") == "x = 1"
+    assert extraer_codigo("```js\nlet x = 1\n```\n", "Python") == "let x = 1"
+
+def test_validar_python():
+    assert validar_python("x = 1\n") is None
+    assert validar_python("x = 1\ndef f(:\n").startswith("línea 2")
+    assert validar_python("x = '\0'\0") is not None
+    assert validar_python("(" * 100000 + ")" * 100000) is not None
+
+def test_validar_json():
+    assert validar_json('{"a": [1, 2]}') is None
+    assert validar_json('{"a": \n}').startswith("línea 2")
+    assert validar_json("[" * 100000 + "]" * 100000) is not None
+
+@pytest.mark.parametrize("codigo", [
+    "SELECT * FROM t WHERE nombre ILIKE 'a%' AND id::text = '1'",
+    "CREATE FUNCTION f() RETURNS int AS $$ SELECT (1 $$ LANGUAGE sql",
+    "SELECT 'it''s', \"col(\" FROM t -- (comentario",
+    "SELECT 'a\\'b' FROM t"
+])
+def test_sql_valido_en_algun_motor(codigo):
+    assert validar_sql(codigo) is None
+
+@pytest.mark.parametrize("codigo, error", [
+    ("SELECT (1 FROM t", "línea 1: paréntesis sin cerrar"),
+    ("SELECT 1)\nFROM t", "línea 1: paréntesis de cierre sin abrir"),
+    ("SELECT 1\nFROM t WHERE a = 'x", "línea 2: falta cerrar '"),
+    ("SELECT 1 /* sin cerrar", "línea 1: falta cerrar /*")
+])
+def test_sql_no_valido(codigo, error):
+    assert validar_sql(codigo) == error
+
+def test_validar_respuesta():
+    assert validar_respuesta("Usa un bucle for para recorrer la lista.", "Python") is None
+    codigo, error = validar_respuesta("Usa un bucle for (sin paréntesis", "Python", es_codigo=True)
+    assert codigo.startswith("Usa un bucle") and error
+    respuesta = "Explicación.\n```bash\nif [ -f x ]; then\n```\n```python\ndef f(:\n```\n"
+    codigo, error = validar_respuesta(respuesta, "Python")
+    assert codigo == "def f(:\n" and error.startswith("línea 1")
+    assert validar_respuesta("```ruby\ndef f(\n```", "Ruby") is None
+
+def test_cache_de_validaciones_limitada():
+    cache = CacheValidaciones(max_entradas=2)
+    for codigo in ("a = 1", "b = (", "c = 3"):
+        cache.validar(codigo, "Python")
+    assert len(cache.resultados) == 2
+    assert cache.validar("b = (", "python") is not None
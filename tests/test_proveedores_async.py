@@ -0,0 +1,56 @@
+import asyncio
+
+import pytest
+
+import proveedores_async
+import resiliencia
+from proveedores_async import ErrorCarrera, carrera, comparar
+from resiliencia import Circuito, CircuitoAbierto
+
+class ErrorRed(Exception):
+    status_code = 503
+
+@pytest.fixture
+def circuitos(monkeypatch):
+    # Un circuito por proveedor que se abre al primer fallo
+    creados = {proveedor: Circuito(proveedor, umbral=1, recuperacion=60) for proveedor in ("Rapido", "Lento", "Roto")}
+    for proveedor, circuito in creados.items():
+        monkeypatch.setitem(resiliencia.circuitos, proveedor, circuito)
+
+    async def completar_async(proveedor, api_key, modelo, mensajes, sesion=None):
+        if proveedor == "Roto":
+            raise ErrorRed()
+        await asyncio.sleep(0 if proveedor == "Rapido" else 10)
+        return proveedor
+
+    monkeypatch.setattr(proveedores_async, "completar_async", completar_async)
+    return creados
+
+def solicitud(proveedor):
+    return (proveedor, "clave", "modelo", [])
+
+def test_carrera_registra_fallos_y_omite_circuitos_abiertos(circuitos):
+    resultado = asyncio.run(carrera([solicitud("Roto"), solicitud("Rapido")]))
+    assert resultado["proveedor"] == "Rapido"
+    assert circuitos["Roto"].estado() == "abierto"
+
+    with pytest.raises(ErrorCarrera) as error:
+        asyncio.run(carrera([solicitud("Roto")]))
+    assert isinstance(error.value.errores["Roto"], CircuitoAbierto)
+
+def test_carrera_cancelada_libera_la_prueba(circuitos):
+    lento = circuitos["Lento"]
+    lento.registrar_fallo()
+    lento.recuperacion = 0
+    assert lento.estado() == "semiabierto"
+
+    resultado = asyncio.run(carrera([solicitud("Lento"), solicitud("Rapido")]))
+    assert resultado["proveedor"] == "Rapido"
+    assert lento.estado() == "semiabierto"
+    assert not lento.prueba_en_curso
+
+def test_comparar_informa_del_circuito_abierto(circuitos):
+    circuitos["Roto"].registrar_fallo()
+    resultados = asyncio.run(comparar([solicitud("Roto"), solicitud("Rapido")]))
+    assert "no está disponible" in resultados[0]["error"]
+    assert resultados[1]["resultado"] == "Rapido"
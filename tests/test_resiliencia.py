@@ -0,0 +1,74 @@
+import pytest
+
+import resiliencia
+from resiliencia import Circuito, ErrorGeneracion, llamar_con_reintentos, transmitir_con_reintentos
+
+class ErrorRed(Exception):
+    status_code = 503
+
+class Detenido(BaseException):
+    # Como las excepciones con las que Streamlit detiene una ejecución
+    pass
+
+@pytest.fixture
+def semiabierto(monkeypatch):
+    # Circuito que se abre al primer fallo y pasa enseguida a semiabierto
+    circuito = Circuito("Prueba", umbral=1, recuperacion=0)
+    monkeypatch.setitem(resiliencia.circuitos, "Prueba", circuito)
+    circuito.registrar_fallo()
+    assert circuito.estado() == "semiabierto"
+    return circuito
+
+def comprobar_liberado(circuito):
+    assert not circuito.prueba_en_curso
+    assert llamar_con_reintentos("Prueba", lambda: "ok", intentos=1) == "ok"
+    assert circuito.estado() == "cerrado"
+
+def test_error_propio_libera_la_prueba(semiabierto):
+    def cola_llena():
+        raise ErrorGeneracion("cola llena")
+
+    with pytest.raises(ErrorGeneracion):
+        llamar_con_reintentos("Prueba", cola_llena, intentos=1)
+    assert semiabierto.estado() == "semiabierto"
+    comprobar_liberado(semiabierto)
+
+def test_ejecucion_detenida_libera_la_prueba(semiabierto):
+    def detener():
+        raise Detenido()
+
+    with pytest.raises(Detenido):
+        llamar_con_reintentos("Prueba", detener, intentos=1)
+    comprobar_liberado(semiabierto)
+
+def test_stream_cerrado_libera_la_prueba(semiabierto):
+    def crear_stream():
+        raise GeneratorExit
+        yield "nunca"
+
+    stream = transmitir_con_reintentos("Prueba", crear_stream, intentos=1)
+    with pytest.raises(GeneratorExit):
+        next(stream)
+    comprobar_liberado(semiabierto)
+
+def test_stream_cerrado_tras_el_primer_fragmento(semiabierto):
+    def crear_stream():
+        yield "hola"
+        yield "mundo"
+
+    stream = transmitir_con_reintentos("Prueba", crear_stream, intentos=1)
+    assert next(stream) == "hola"
+    stream.close()
+    assert semiabierto.estado() == "cerrado"
+
+def test_fallo_de_la_prueba_reabre_el_circuito(semiabierto):
+    semiabierto.recuperacion = 60
+
+    def fallar():
+        raise ErrorRed()
+
+    semiabierto.abierto_desde -= 60
+    with pytest.raises(ErrorRed):
+        llamar_con_reintentos("Prueba", fallar, intentos=1)
+    assert semiabierto.estado() == "abierto"
+    assert not semiabierto.prueba_en_curso
@@ -0,0 +1,128 @@
+import json
+
+import pytest
+from starlette.testclient import TestClient
+
+import nucleo
+from planificador import ColaLlena
+from servidor_api import ServidorAPI
+
+TOKEN = "secreto"
+AUTORIZACION = {"Authorization": f"Bearer {TOKEN}"}
+CONTENIDO = {"tema": "Café", "tipo_contenido": "Post para Twitter/X", "tipo_respuesta": "Breve"}
+
+@pytest.fixture
+def llamadas(monkeypatch):
+    # Generadores del núcleo sustituidos: registran lo que reciben y fallan según el tema
+    registro = []
+
+    def generar_texto(prompt, proveedor, tipo, claves, ignorar_cache, respaldo, sesion):
+        registro.append({"proveedor": proveedor, "tipo": tipo, "claves": claves, "sesion": sesion})
+        if "cola llena" in prompt:
+            raise ColaLlena("Hay demasiadas peticiones en espera")
+        if "fallo" in prompt:
+            raise RuntimeError("detalle interno")
+        return "respuesta"
+
+    def generar_texto_stream(*argumentos):
+        yield "hola, "
+        yield "mundo"
+
+    monkeypatch.setattr(nucleo, "generar_texto", generar_texto)
+    monkeypatch.setattr(nucleo, "generar_texto_stream", generar_texto_stream)
+    monkeypatch.setattr(nucleo, "claves_entorno", lambda: {proveedor: "" for proveedor in nucleo.PROVEEDORES})
+    return registro
+
+@pytest.fixture
+def cliente(llamadas):
+    servidor = ServidorAPI(token=TOKEN, hilos=2, max_cuerpo=1024)
+    with TestClient(servidor.app) as cliente:
+        yield cliente
+    servidor.cerrar()
+
+def publicar(cliente, datos, ruta="/v1/contenido", **cabeceras):
+    cabeceras = {**AUTORIZACION, "X-DeepSeek-Key": "clave", **cabeceras}
+    contenido = datos if isinstance(datos, bytes) else json.dumps(datos).encode("utf-8")
+    return cliente.post(ruta, content=contenido, headers=cabeceras)
+
+def test_autorizacion(cliente):
+    assert cliente.get("/salud").status_code == 200
+    for cabeceras in ({}, {"Authorization": "Bearer otro"}, {"Authorization": TOKEN + "x"}):
+        respuesta = cliente.post("/v1/contenido", json=CONTENIDO, headers=cabeceras)
+        assert respuesta.status_code == 401
+        assert respuesta.headers["WWW-Authenticate"] == "Bearer"
+    assert cliente.get("/metricas").status_code == 401
+    assert cliente.get("/metricas", headers=AUTORIZACION).status_code == 200
+
+def test_genera_con_la_clave_de_la_cabecera(cliente, llamadas):
+    respuesta = publicar(cliente, CONTENIDO, **{"X-Cliente": "cms"})
+    assert respuesta.status_code == 200
+    assert respuesta.json() == {"resultado": "respuesta"}
+    assert llamadas[0]["proveedor"] == "DeepSeek"
+    assert llamadas[0]["claves"]["DeepSeek"] == "clave"
+    assert llamadas[0]["sesion"] == "cms"
+
+@pytest.mark.parametrize("datos, mensaje", [
+    ({**CONTENIDO, "tema": ""}, "Falta el campo 'tema'"),
+    ({**CONTENIDO, "tema": 3}, "debe ser un texto"),
+    ({**CONTENIDO, "tipo_contenido": "Otro"}, "Valores válidos para 'tipo_contenido'"),
+    ({**CONTENIDO, "proveedor": "Otro"}, "Proveedor no soportado"),
+    ([CONTENIDO], "debe ser un objeto JSON"),
+    (b"{", "no es JSON válido"),
+    (b'{"tema": "\xff"}', "no es JSON válido")
+])
+def test_cuerpos_no_validos(cliente, llamadas, datos, mensaje):
+    respuesta = publicar(cliente, datos)
+    assert respuesta.status_code == 400
+    assert mensaje in respuesta.json()["error"]
+    assert llamadas == []
+
+def test_falta_la_api_key(cliente):
+    respuesta = cliente.post("/v1/contenido", json=CONTENIDO, headers=AUTORIZACION)
+    assert respuesta.status_code == 400
+    assert "Falta la API key de DeepSeek" in respuesta.json()["error"]
+
+def test_cuerpo_demasiado_grande(cliente):
+    respuesta = publicar(cliente, {**CONTENIDO, "tema": "x" * 2048})
+    assert respuesta.status_code == 413
+
+    def trozos():
+        for _ in range(4):
+            yield b" " * 512
+    # Sin Content-Length (transferencia por trozos) también se corta
+    respuesta = cliente.post("/v1/contenido", content=trozos(), headers=AUTORIZACION)
+    assert respuesta.status_code == 413
+
+def test_rutas_y_metodos_desconocidos(cliente):
+    respuesta = cliente.get("/v2/nada")
+    assert respuesta.status_code == 404
+    assert respuesta.json() == {"error": "Ruta desconocida: /v2/nada"}
+    respuesta = cliente.get("/v1/contenido")
+    assert respuesta.status_code == 405
+    assert respuesta.json() == {"error": "Usa POST"}
+
+def test_demasiadas_cabeceras(cliente):
+    cabeceras = {f"X-Relleno-{numero}": "x" for numero in range(150)}
+    assert cliente.get("/salud", headers=cabeceras).status_code == 431
+    assert cliente.get("/salud", headers={"X-Relleno": "x" * 20000}).status_code == 431
+
+def test_identificador_de_peticion(cliente):
+    assert publicar(cliente, CONTENIDO, **{"X-Peticion": "cms-42_a"}).headers["X-Peticion"] == "cms-42_a"
+    for recibido in ("con espacios", "a/b", "x" * 65):
+        generado = publicar(cliente, CONTENIDO, **{"X-Peticion": recibido}).headers["X-Peticion"]
+        assert generado != recibido and len(generado) == 16
+
+def test_errores_de_generacion(cliente):
+    respuesta = publicar(cliente, {**CONTENIDO, "tema": "cola llena"})
+    assert respuesta.status_code == 429
+    assert respuesta.headers["Retry-After"] == "5"
+    respuesta = publicar(cliente, {**CONTENIDO, "tema": "fallo"})
+    assert respuesta.status_code == 500
+    assert respuesta.json() == {"error": "Error interno del servidor"}
+
+def test_stream(cliente):
+    respuesta = publicar(cliente, CONTENIDO, ruta="/v1/contenido/stream")
+    assert respuesta.status_code == 200
+    assert respuesta.headers["content-type"].startswith("text/event-stream")
+    datos = [json.loads(linea[len("data: "):]) for linea in respuesta.text.splitlines() if linea.startswith("data: ")]
+    assert datos == [{"texto": "hola, "}, {"texto": "mundo"}, {}]
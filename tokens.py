@@ -0,0 +1,148 @@
+import csv
+import io
+import threading
+import time
+from collections import OrderedDict, defaultdict, deque
+
+from configuracion import MAX_TOKENS_ENTRADA, PRECIOS_MODELOS
+from observabilidad import metricas
+from resiliencia import ErrorGeneracion
+
+# tiktoken es opcional; sin él se usa una aproximación por caracteres. El
+# codificador se carga en el primer recuento y no al importar el módulo:
+# get_encoding lee (o descarga) la tabla BPE y retrasaría el arranque de la
+# app, la API y los lotes
+codificador = None
+codificador_cargado = False
+lock_codificador = threading.Lock()
+
+CARACTERES_POR_TOKEN = 3.5
+TOKENS_POR_MENSAJE = 4
+MAX_REGISTROS = 2000
+MAX_SESIONES = 1000
+
+class PresupuestoExcedido(ErrorGeneracion):
+    pass
+
+def obtener_codificador():
+    global codificador, codificador_cargado
+    if not codificador_cargado:
+        with lock_codificador:
+            if not codificador_cargado:
+                try:
+                    import tiktoken
+                    codificador = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    codificador = None
+                codificador_cargado = True
+    return codificador
+
+def estimar_tokens(texto):
+    if not texto:
+        return 0
+    codificador = obtener_codificador()
+    if codificador is not None:
+        return len(codificador.encode(texto, disallowed_special=()))
+    return int(len(texto) / CARACTERES_POR_TOKEN) + 1
+
+def estimar_tokens_mensajes(mensajes):
+    return sum(estimar_tokens(mensaje["content"]) + TOKENS_POR_MENSAJE for mensaje in mensajes)
+
+def verificar_presupuesto(mensajes, maximo=MAX_TOKENS_ENTRADA):
+    estimados = estimar_tokens_mensajes(mensajes)
+    if estimados > maximo:
+        raise PresupuestoExcedido(
+            f"La petición ocupa unos {estimados} tokens y el máximo permitido es {maximo}. "
+            "Reduce el texto o el código incluido en el prompt."
+        )
+    return estimados
+
+def coste(modelo, entrada, salida, entrada_cache=0):
+    # entrada_cache son los tokens de entrada que el proveedor sirvió desde su
+    # caché de contexto (incluidos en entrada), que suelen cobrarse más barato
+    precio = PRECIOS_MODELOS.get(modelo)
+    if not precio:
+        return 0.0
+    precio_cache = precio.get("entrada_cache", precio["entrada"])
+    return ((entrada - entrada_cache) * precio["entrada"] + entrada_cache * precio_cache + salida * precio["salida"]) / 1_000_000
+
+class Contabilidad:
+    def __init__(self, max_registros=MAX_REGISTROS, max_sesiones=MAX_SESIONES):
+        self.lock = threading.Lock()
+        self.registros = deque(maxlen=max_registros)
+        # Sesiones de la app y clientes de la API (X-Cliente): se conservan las
+        # que han consumido más recientemente y se olvidan las inactivas
+        self.max_sesiones = max_sesiones
+        self.por_sesion = OrderedDict()
+        self.por_proveedor = defaultdict(lambda: {"llamadas": 0, "entrada": 0, "entrada_cache": 0, "salida": 0, "coste": 0.0})
+
+    def registrar(self, sesion, proveedor, modelo, entrada, salida, estimado=False, entrada_cache=0):
+        importe = coste(modelo, entrada, salida, entrada_cache)
+        with self.lock:
+            self.registros.append({
+                "momento": time.time(), "sesion": sesion, "proveedor": proveedor, "modelo": modelo,
+                "tokens_entrada": entrada, "tokens_entrada_cache": entrada_cache, "tokens_salida": salida,
+                "coste_usd": importe, "estimado": estimado
+            })
+            if sesion not in self.por_sesion:
+                self.por_sesion[sesion] = defaultdict(lambda: {"llamadas": 0, "entrada": 0, "entrada_cache": 0, "salida": 0, "coste": 0.0})
+                while len(self.por_sesion) > self.max_sesiones:
+                    self.por_sesion.popitem(last=False)
+            self.por_sesion.move_to_end(sesion)
+            for agregado in (self.por_sesion[sesion][proveedor], self.por_proveedor[proveedor]):
+                agregado["llamadas"] += 1
+                agregado["entrada"] += entrada
+                agregado["entrada_cache"] += entrada_cache
+                agregado["salida"] += salida
+                agregado["coste"] += importe
+
+    def resumen_sesion(self, sesion):
+        with self.lock:
+            return {proveedor: dict(agregado) for proveedor, agregado in self.por_sesion.get(sesion, {}).items()}
+
+    def resumen_proveedores(self):
+        with self.lock:
+            return {proveedor: dict(agregado) for proveedor, agregado in self.por_proveedor.items()}
+
+    def exportar_csv(self, sesion=None):
+        with self.lock:
+            registros = [registro for registro in self.registros if sesion is None or registro["sesion"] == sesion]
+        salida = io.StringIO()
+        escritor = csv.DictWriter(salida, fieldnames=["momento", "sesion", "proveedor", "modelo", "tokens_entrada", "tokens_entrada_cache", "tokens_salida", "coste_usd", "estimado"])
+        escritor.writeheader()
+        escritor.writerows(registros)
+        return salida.getvalue()
+
+contabilidad = Contabilidad()
+
+def metricas_consumo():
+    resumen = contabilidad.resumen_proveedores()
+    return [
+        ("contelia_llamadas_total", "counter", "Llamadas a cada proveedor", [
+            ({"proveedor": proveedor}, agregado["llamadas"]) for proveedor, agregado in resumen.items()
+        ]),
+        ("contelia_tokens_total", "counter", "Tokens consumidos por proveedor y clase", [
+            ({"proveedor": proveedor, "clase": clase}, agregado[clase])
+            for proveedor, agregado in resumen.items() for clase in ("entrada", "entrada_cache", "salida")
+        ]),
+        ("contelia_coste_usd_total", "counter", "Coste estimado en USD", [
+            ({"proveedor": proveedor}, agregado["coste"]) for proveedor, agregado in resumen.items()
+        ])
+    ]
+
+metricas.registrar_colector(metricas_consumo)
+
+def tokens_en_cache(uso):
+    # DeepSeek informa prompt_cache_hit_tokens; la API de OpenAI y compatibles, prompt_tokens_details.cached_tokens
+    aciertos = getattr(uso, "prompt_cache_hit_tokens", None)
+    if aciertos is None:
+        aciertos = getattr(getattr(uso, "prompt_tokens_details", None), "cached_tokens", None)
+    return aciertos or 0
+
+def registrar_uso(sesion, proveedor, modelo, uso, mensajes=None, texto=None):
+    # Se usa el consumo que informa el proveedor; si no lo hay (p. ej. un
+    # stream cancelado) se registra una estimación local
+    if uso is not None and getattr(uso, "prompt_tokens", None) is not None:
+        contabilidad.registrar(sesion, proveedor, modelo, uso.prompt_tokens, uso.completion_tokens or 0, entrada_cache=tokens_en_cache(uso))
+    elif mensajes is not None:
+        contabilidad.registrar(sesion, proveedor, modelo, estimar_tokens_mensajes(mensajes), estimar_tokens(texto), estimado=True)
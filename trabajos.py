@@ -0,0 +1,175 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import observabilidad
+from configuracion import TRABAJOS_HILOS, TRABAJOS_MAX_ACTIVOS, TRABAJOS_CONSERVAR, TRABAJOS_RETENCION_SEGUNDOS
+from resiliencia import ErrorGeneracion
+
+# Generaciones en segundo plano: la interfaz envía un trabajo y sigue
+# respondiendo mientras un hilo compartido por todas las sesiones consume el
+# stream del núcleo. Los reruns de Streamlit no interrumpen el trabajo y el
+# resultado se recoge desde la sesión cuando termina
+
+TERMINADOS = {"completado", "error", "cancelado"}
+
+class Trabajo:
+    def __init__(self, sesion, descripcion, crear_stream, destino, al_completar=None, procesar=None, objetos=()):
+        self.id = uuid.uuid4().hex[:12]
+        self.sesion = sesion
+        self.descripcion = descripcion
+        # crear_stream(al_esperar) devuelve el generador de fragmentos del núcleo
+        self.crear_stream = crear_stream
+        # Clave de st.session_state donde la interfaz deja el resultado
+        self.destino = destino
+        # Se ejecutan en el hilo del trabajo: procesar(texto) transforma el
+        # resultado (p. ej. validar el código) y al_completar lo guarda
+        self.procesar = procesar
+        self.al_completar = al_completar
+        # Objetos de la sesión que el trabajo lee o modifica (p. ej. la
+        # conversación de código): no deben salir de memoria mientras dure
+        self.objetos = tuple(objetos)
+        self.estado = "en_cola"
+        self.partes = []
+        self.resultado = None
+        self.error = None
+        self.posicion = None
+        self.creado = time.time()
+        self.fin = None
+        self.entregado = False
+        self.cancelado = threading.Event()
+        self.futuro = None
+
+    @property
+    def terminado(self):
+        return self.estado in TERMINADOS
+
+    def texto(self):
+        return "".join(self.partes)
+
+    def duracion(self):
+        return (self.fin or time.time()) - self.creado
+
+class ErrorTrabajos(ErrorGeneracion):
+    pass
+
+class GestorTrabajos:
+    def __init__(self, hilos=TRABAJOS_HILOS, max_activos=TRABAJOS_MAX_ACTIVOS, conservar=TRABAJOS_CONSERVAR, retencion=TRABAJOS_RETENCION_SEGUNDOS):
+        self.ejecutor = ThreadPoolExecutor(max_workers=hilos, thread_name_prefix="contelia-trabajo")
+        self.max_activos = max_activos
+        self.conservar = conservar
+        self.retencion = retencion
+        self.trabajos = {}
+        self.lock = threading.Lock()
+
+    def enviar(self, sesion, descripcion, crear_stream, destino, al_completar=None, procesar=None, objetos=()):
+        trabajo = Trabajo(sesion, descripcion, crear_stream, destino, al_completar, procesar, objetos)
+        with self.lock:
+            self.limpiar()
+            propios = self.trabajos.setdefault(sesion, OrderedDict())
+            if sum(1 for otro in propios.values() if not otro.terminado) >= self.max_activos:
+                raise ErrorTrabajos(f"Ya tienes {self.max_activos} generaciones en curso; espera a que termine alguna o cancélala")
+            propios[trabajo.id] = trabajo
+        trabajo.futuro = self.ejecutor.submit(self.ejecutar, trabajo)
+        return trabajo
+
+    def ejecutar(self, trabajo):
+        if trabajo.cancelado.is_set():
+            trabajo.estado = "cancelado"
+            trabajo.fin = time.time()
+            return
+        trabajo.estado = "ejecutando"
+
+        def al_esperar(posicion):
+            trabajo.posicion = posicion or None
+
+        with observabilidad.peticion():
+            try:
+                fragmentos = trabajo.crear_stream(al_esperar)
+                try:
+                    # La cancelación se comprueba entre fragmentos; al cerrar
+                    # el generador se cierra la conexión con el proveedor
+                    for fragmento in fragmentos:
+                        if trabajo.cancelado.is_set():
+                            break
+                        trabajo.partes.append(fragmento)
+                finally:
+                    fragmentos.close()
+
+                if trabajo.cancelado.is_set():
+                    trabajo.estado = "cancelado"
+                    return
+                trabajo.resultado = trabajo.procesar(trabajo.texto()) if trabajo.procesar else trabajo.texto()
+                if trabajo.al_completar:
+                    trabajo.al_completar(trabajo.resultado)
+                trabajo.estado = "completado"
+            except Exception as e:
+                trabajo.error = str(e) if isinstance(e, ErrorGeneracion) else f"{type(e).__name__}: {e}"
+                trabajo.estado = "error"
+            finally:
+                trabajo.fin = time.time()
+
+    def cancelar(self, sesion, identificador):
+        trabajo = self.obtener(sesion, identificador)
+        if trabajo is None or trabajo.terminado:
+            return False
+        trabajo.cancelado.set()
+        # Si aún no había empezado, sale de la cola del ejecutor sin llegar a ejecutarse
+        if trabajo.futuro is not None and trabajo.futuro.cancel():
+            trabajo.estado = "cancelado"
+            trabajo.fin = time.time()
+        return True
+
+    def obtener(self, sesion, identificador):
+        with self.lock:
+            return self.trabajos.get(sesion, {}).get(identificador)
+
+    def en_uso(self, sesion):
+        with self.lock:
+            return [objeto for trabajo in self.trabajos.get(sesion, {}).values() if not trabajo.terminado for objeto in trabajo.objetos]
+
+    def listar(self, sesion):
+        with self.lock:
+            return list(self.trabajos.get(sesion, {}).values())
+
+    def descartar(self, sesion, identificador):
+        with self.lock:
+            propios = self.trabajos.get(sesion, {})
+            if identificador in propios and propios[identificador].terminado:
+                del propios[identificador]
+
+    def limpiar(self):
+        # Se conservan los últimos trabajos terminados de cada sesión durante
+        # un tiempo, por si la sesión vuelve a consultarlos
+        limite = time.time() - self.retencion
+        for sesion in list(self.trabajos):
+            propios = self.trabajos[sesion]
+            terminados = [trabajo for trabajo in propios.values() if trabajo.terminado]
+            sobrantes = len(terminados) - self.conservar
+            for posicion, trabajo in enumerate(terminados):
+                if posicion < sobrantes or (trabajo.fin or time.time()) < limite:
+                    del propios[trabajo.id]
+            if not propios:
+                del self.trabajos[sesion]
+
+    def metricas(self):
+        with self.lock:
+            estados = {}
+            for propios in self.trabajos.values():
+                for trabajo in propios.values():
+                    estados[trabajo.estado] = estados.get(trabajo.estado, 0) + 1
+            return estados
+
+# Compartido por todas las sesiones del proceso, igual que el planificador
+gestor = GestorTrabajos()
+
+def metricas_trabajos():
+    return [
+        ("contelia_trabajos", "gauge", "Trabajos en segundo plano por estado", [
+            ({"estado": estado}, cantidad) for estado, cantidad in gestor.metricas().items()
+        ])
+    ]
+
+observabilidad.metricas.registrar_colector(metricas_trabajos)
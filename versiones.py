@@ -0,0 +1,115 @@
+import difflib
+
+from configuracion import MAX_VERSIONES, VERSIONES_INTERVALO_COMPLETA
+
+def calcular_delta(anterior, nuevo):
+    # Solo se guardan los tramos que cambian: (inicio, fin, líneas nuevas)
+    # sobre las líneas de la versión anterior
+    comparador = difflib.SequenceMatcher(None, anterior, nuevo)
+    return [
+        (i1, i2, nuevo[j1:j2])
+        for operacion, i1, i2, j1, j2 in comparador.get_opcodes()
+        if operacion != "equal"
+    ]
+
+def aplicar_delta(anterior, delta):
+    lineas = []
+    posicion = 0
+    for inicio, fin, nuevas in delta:
+        lineas.extend(anterior[posicion:inicio])
+        lineas.extend(nuevas)
+        posicion = fin
+    lineas.extend(anterior[posicion:])
+    return lineas
+
+class Version:
+    # Registro compacto (sin un dict por versión). Las copias completas se
+    # guardan como un único texto y los deltas como tuplas de líneas
+    __slots__ = ("etiqueta", "completa", "delta")
+
+    def __init__(self, etiqueta, completa=None, delta=None):
+        self.etiqueta = etiqueta
+        self.completa = completa
+        self.delta = delta
+
+class AlmacenVersiones:
+    # Historial de versiones de un texto: cada VERSIONES_INTERVALO_COMPLETA
+    # versiones se guarda una copia completa y el resto como diferencias con
+    # la anterior, de modo que la memoria crece con el tamaño de los cambios
+    # y no con el del texto
+    def __init__(self, max_versiones=MAX_VERSIONES, intervalo=VERSIONES_INTERVALO_COMPLETA):
+        self.max_versiones = max_versiones
+        self.intervalo = max(intervalo, 1)
+        self.versiones = []
+        self.ultima = None
+
+    def __len__(self):
+        return len(self.versiones)
+
+    def agregar(self, texto, etiqueta=""):
+        if texto == self.ultima:
+            return False
+        if not self.versiones or self.deltas_seguidos() + 1 >= self.intervalo:
+            self.versiones.append(Version(etiqueta, completa=texto))
+        else:
+            delta = calcular_delta(self.ultima.splitlines(keepends=True), texto.splitlines(keepends=True))
+            self.versiones.append(Version(etiqueta, delta=tuple((inicio, fin, tuple(nuevas)) for inicio, fin, nuevas in delta)))
+        self.ultima = texto
+        self.recortar()
+        return True
+
+    def deltas_seguidos(self):
+        cantidad = 0
+        for version in reversed(self.versiones):
+            if version.completa is not None:
+                break
+            cantidad += 1
+        return cantidad
+
+    def recortar(self):
+        # La versión más antigua que se conserva pasa a ser copia completa
+        sobrantes = len(self.versiones) - self.max_versiones
+        if sobrantes <= 0:
+            return
+        primera = "".join(self.lineas(sobrantes))
+        del self.versiones[:sobrantes]
+        self.versiones[0].completa = primera
+        self.versiones[0].delta = None
+
+    def lineas(self, indice):
+        # Se parte de la copia completa más cercana hacia atrás y se aplican los deltas
+        base = indice
+        while self.versiones[base].completa is None:
+            base -= 1
+        lineas = self.versiones[base].completa.splitlines(keepends=True)
+        for version in self.versiones[base + 1:indice + 1]:
+            lineas = aplicar_delta(lineas, version.delta)
+        return lineas
+
+    def obtener(self, indice):
+        if indice < 0:
+            indice += len(self.versiones)
+        if indice == len(self.versiones) - 1:
+            return self.ultima
+        return "".join(self.lineas(indice))
+
+    def etiqueta(self, indice):
+        return self.versiones[indice].etiqueta
+
+    def diferencias(self, desde, hasta=-1):
+        return "".join(difflib.unified_diff(
+            self.obtener(desde).splitlines(keepends=True),
+            self.obtener(hasta).splitlines(keepends=True),
+            fromfile=f"versión {desde % len(self.versiones) + 1}",
+            tofile=f"versión {hasta % len(self.versiones) + 1}"
+        ))
+
+    def tamano(self):
+        # Caracteres almacenados, para comparar con guardar cada versión completa
+        total = 0
+        for version in self.versiones:
+            if version.completa is not None:
+                total += len(version.completa)
+            else:
+                total += sum(len(linea) for _, _, nuevas in version.delta for linea in nuevas)
+        return total